@@ -6,8 +6,16 @@ Movan RPC - 一个简单的 RPC（远程过程调用）框架
 """
 
 from .server import RPCServer, AddressType
+from .cache import ResultCache
+from .protocol import OverloadedError
 from .client import RPCClient
 from .client_threading import RPCClientThreading
+from .client_pool import RPCClientPool
+from .client_balancer import RPCClientBalancer
+from .client_sharded import RPCClientSharded
+from .extensions import register_dataclass, register_type
 
-__all__ = ['RPCServer', 'RPCClient', 'AddressType','RPCClientThreading']
+__all__ = ['RPCServer', 'RPCClient', 'AddressType', 'RPCClientThreading', 'RPCClientPool',
+           'RPCClientBalancer', 'RPCClientSharded', 'ResultCache', 'OverloadedError',
+           'register_dataclass', 'register_type']
 __version__ = '0.1.6'
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+结果缓存模块 - 缓存幂等方法的返回值和编码后的响应
+
+用 ``@server.method(cache=ResultCache(ttl=5))`` 注册的方法，参数相同的调用在有效期内
+直接返回缓存结果。
+客户端的 ``server_method_stub(cache=...)`` 使用同一个类在本地缓存结果，由服务端推送的
+invalidate 帧保持一致。
+参数先按方法签名绑定（``f(1)`` 与 ``f(x=1)`` 是同一个键），再转换成可哈希的规范形式。
+紧凑分帧的连接还会缓存编码（以及压缩）后的消息体，命中时只需重新打包帧头，
+既不调用方法也不重新序列化。
+
+缓存的结果被所有调用方共享，方法不应修改已经返回过的对象。
+"""
+
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+
+def canonicalize(value: Any) -> Hashable:
+    """把参数转换为可哈希的规范形式，不支持的类型抛出 TypeError"""
+    if value is None or isinstance(value, (str, int)) and not isinstance(value, bool):
+        return value
+    # 1、1.0 和 True 的哈希相同，带上类型以免互相命中
+    if isinstance(value, (bool, float)):
+        return type(value), value
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(canonicalize(item) for item in value)
+    if isinstance(value, dict):
+        items = [(canonicalize(key), canonicalize(item)) for key, item in value.items()]
+        return dict, tuple(sorted(items, key=repr))
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(canonicalize(item) for item in value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes, bytes(value)
+    hash(value)
+    return type(value), value
+
+
+class CallKey:
+    """按方法签名把调用参数转换为键，结果缓存和 singleflight 共用"""
+
+    def __init__(self, method: Optional[Callable] = None):
+        self._signature: Optional[inspect.Signature] = None
+        if method is not None:
+            try:
+                self._signature = inspect.signature(method)
+            except (TypeError, ValueError):
+                pass
+
+    def __call__(self, args: Sequence, kwargs: Dict) -> Optional[Hashable]:
+        """计算键，参数无法绑定或不可哈希时返回 None"""
+        try:
+            if self._signature is not None:
+                bound = self._signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return tuple(canonicalize(value) for value in bound.arguments.values())
+            return (*(canonicalize(value) for value in args), canonicalize(kwargs or {}))
+        except TypeError:
+            return None
+
+
+class CacheEntry:
+    """一条缓存：结果、过期时间以及按分帧方式缓存的消息体"""
+
+    __slots__ = ('key', 'value', 'expires', 'bodies', 'size')
+
+    def __init__(self, key: Hashable, value: Any, expires: Optional[float]):
+        self.key = key
+        self.value = value
+        self.expires = expires
+        # (编码名, 压缩算法名) -> (帧标志, 消息体)
+        self.bodies: Dict[Tuple, Tuple[int, bytes]] = {}
+        self.size = 0
+
+
+class ResultCache:
+    """单个方法的结果缓存，按最近最少使用淘汰"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 1024,
+                 max_bytes: Optional[int] = None):
+        """
+        参数:
+            ttl: 缓存有效期（秒），None 表示直到被淘汰或失效
+            max_entries: 最多缓存的条目数
+            max_bytes: 缓存的消息体总字节数上限，None 表示不限制。
+                只计算紧凑分帧下缓存的编码结果
+        """
+        if max_entries < 1:
+            raise ValueError("缓存条目数必须大于 0")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self._bytes = 0
+        self._make_key = CallKey()
+        # thread 模式的方法可能在线程池中失效缓存
+        self._lock = threading.Lock()
+
+        # 每次失效加一，用于丢弃失效前发出、失效后才返回的结果
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def bind(self, method: Callable) -> None:
+        """记录方法签名，用于把位置参数和关键字参数统一成同一个键"""
+        self._make_key = CallKey(method)
+
+    def make_key(self, args: Sequence, kwargs: Dict) -> Optional[Hashable]:
+        """计算缓存键，参数无法绑定或不可哈希时返回 None，该次调用不使用缓存"""
+        return self._make_key(args, kwargs)
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, value: Any) -> CacheEntry:
+        """写入结果，同一个结果对象重复写入时沿用已有条目及其编码好的消息体"""
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.value is value:
+                return entry
+            entry = CacheEntry(key, value, expires)
+            self._remove(key)
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def add_body(self, entry: CacheEntry, variant: Tuple, flags: int, body: bytes) -> None:
+        """为条目补充一种分帧方式下的消息体"""
+        with self._lock:
+            if variant in entry.bodies:
+                return
+            entry.bodies[variant] = (flags, body)
+            entry.size += len(body)
+            # 条目可能已经被淘汰或失效，此时消息体只用于本次发送
+            if self._entries.get(entry.key) is entry:
+                self._bytes += len(body)
+                self._evict()
+
+    def discard(self, entry: CacheEntry) -> None:
+        """删除一条缓存，条目已经被替换时不做任何事"""
+        with self._lock:
+            if self._entries.get(entry.key) is entry:
+                self._remove(entry.key)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self.max_bytes is not None and self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def invalidate(self, prefix: Sequence = ()) -> int:
+        """
+        失效参数以 prefix 开头的缓存，返回删除的条目数
+
+        prefix 是按签名顺序排列的前几个参数，为空时清空整个缓存。
+        """
+        with self._lock:
+            self.generation += 1
+            if not prefix:
+                count = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+                return count
+            try:
+                head = tuple(canonicalize(value) for value in prefix)
+            except TypeError:
+                return 0
+            keys = [key for key in self._entries
+                    if isinstance(key, tuple) and key[:len(head)] == head]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -1,26 +1,60 @@
 import asyncio
-import json
-import time
 import inspect
-from typing import Dict, Any, Callable, Optional, List
-import uuid
+import time
+from typing import (AsyncIterable, AsyncIterator, Dict, Any, Callable, Iterable, Optional, List,
+                    Union)
 from . import utils
+from .cache import ResultCache
+from .codec import CODECS, get_codec
+from .compression import CompressionStats, get_compressor
+from .protocol import (
+    Frame, FrameTooLarge, FrameWriter, Framing, RequestId, FLAG_BATCH, FLAG_ERROR, FLAG_STREAM,
+    PROTOCOL_VERSION, error_from_frame, read_frame, skip_body, unpack_batch_results,
+)
 
 
 class RPCClient:
-    def __init__(self, address: str, port: int):
+    def __init__(self, address: str, port: int, codecs: Optional[List[str]] = None,
+                 compression: Optional[List[str]] = None, compress_threshold: int = 4096,
+                 max_frame_size: Optional[int] = 64 * 1024 * 1024):
+        """
+        参数:
+            address: 服务器地址
+            port: 服务器端口
+            codecs: 按优先级排列的期望编码名列表，默认优先使用二进制编码
+            compression: 按优先级排列的期望压缩算法列表，例如 ['zstd', 'zlib']，默认不压缩
+            compress_threshold: 消息体达到多少字节才压缩
+            max_frame_size: 接收的单帧消息体（解压后）的最大字节数，超过时丢弃该帧，
+                对应的调用抛出错误，None 表示不限制
+        """
         self.host: str = address
         self.port: int = port
         self.methods: Dict[str, Callable] = {}
         self.reader: Optional[asyncio.StreamReader] = None
         self.writer: Optional[asyncio.StreamWriter] = None
+        self.frame_writer: Optional[FrameWriter] = None
         self.connected = False
-        
+        self.codecs: List[str] = codecs if codecs is not None else list(CODECS)
+        self.compression: List[str] = compression or []
+        self.compress_threshold = compress_threshold
+        self.compression_stats = CompressionStats()
+        self.max_frame_size = max_frame_size
+        # 协商前使用旧版 JSON 分帧
+        self.framing = Framing()
+
         self._running_task = None
         self._loop = None
 
-        self._return_buffer: Dict[(str,str), Dict[str, Any]] = {}
-        self._return_buffer_lock = asyncio.Lock()
+        # 等待返回结果的调用 call_id -> Future
+        self._pending_calls: Dict[RequestId, asyncio.Future] = {}
+        # 普通调用遇到生成器方法时收到的流式结果 call_id -> 已收到的项
+        self._stream_items: Dict[RequestId, List] = {}
+        # stream() 调用的接收队列 call_id -> 队列，元素为 (类型, 值)
+        self._streams: Dict[RequestId, asyncio.Queue] = {}
+        # upload() 调用的发送额度 call_id -> 额度
+        self._upload_credits: Dict[RequestId, '_UploadCredit'] = {}
+        # 带缓存的存根 方法名 -> 本地结果缓存
+        self._stub_caches: Dict[str, ResultCache] = {}
 
 
 
@@ -31,25 +65,65 @@ class RPCClient:
 
 
 
-    def server_method_stub(self, func: Callable):
+    def server_method_stub(self, func: Optional[Callable] = None, *,
+                           cache: Union[bool, ResultCache, None] = None):
+        """
+        生成服务端方法的存根，可直接使用 @client.server_method_stub，
+        只读方法也可以带本地缓存 @client.server_method_stub(cache=ResultCache(ttl=60))
+
+        参数:
+            cache: 在本地缓存结果，True 使用默认设置。服务端调用 invalidate_cache 时会推送
+                失效消息；连接断开时清空缓存，因为断开期间可能错过失效消息
+        """
+        if func is None:
+            return lambda f: self.server_method_stub(f, cache=cache)
+
         async def wrapper(*args, **kwargs):
             # 异步函数的处理
             result = await self.call(func.__name__, args, kwargs)
             return result
-        
+
         # 判断是否为异步函数
-        if inspect.iscoroutinefunction(func):
-            return wrapper
-        else:
+        if not inspect.iscoroutinefunction(func):
             raise SyntaxError("服务端方法的存根函数必须使用async def定义")
-    
+        if cache is True:
+            cache = ResultCache()
+        if not cache:
+            return wrapper
+
+        cache.bind(func)
+        self._stub_caches[func.__name__] = cache
+
+        async def cached_wrapper(*args, **kwargs):
+            key = cache.make_key(args, kwargs)
+            if key is None:
+                return await wrapper(*args, **kwargs)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry.value
+            generation = cache.generation
+            result = await wrapper(*args, **kwargs)
+            # 等待期间收到了失效消息，结果可能已经过期，不写入缓存
+            if cache.generation == generation:
+                cache.put(key, result)
+            return result
+
+        return cached_wrapper
+
+    def invalidate_cache(self, method_name: Optional[str] = None, *args) -> int:
+        """失效存根的本地缓存，参数含义与 RPCServer.invalidate_cache 相同，返回删除的条目数"""
+        if method_name is None:
+            return sum(cache.invalidate() for cache in self._stub_caches.values())
+        cache = self._stub_caches.get(method_name)
+        return cache.invalidate(args) if cache is not None else 0
+
     # 装饰器注册方法
     def method(self, func: Callable):
         self.register_method(func.__name__, func)
         return func
-    
 
-            
+
+
 
 
 
@@ -59,25 +133,50 @@ class RPCClient:
             self.reader, self.writer = await asyncio.open_connection(
                 self.host, self.port
             )
+            self.frame_writer = FrameWriter(self.writer)
             self.connected = True
             print(f"已连接到服务器 {self.host}:{self.port}")
-            return True
         except Exception as e:
             print(f"连接服务器失败: {e}")
             return False
 
+        await self._negotiate()
+        return True
+
+    async def _negotiate(self, timeout: float = 2.0):
+        """与服务端协商编码和分帧格式，旧版本服务端不认识协商消息时继续使用 JSON"""
+        self.framing = Framing()
+        request_id = self.framing.new_request_id()
+        payload = {'codecs': self.codecs, 'protocol': PROTOCOL_VERSION,
+                   'compression': self.compression}
+        try:
+            await self._send_frame('negotiate', request_id, payload)
+            # 此时读取循环尚未启动，直接读取一帧回复
+            header, body = await asyncio.wait_for(
+                read_frame(self.reader, self.framing, self.max_frame_size), timeout)
+            reply = self.framing.decode(header, body)
+            if reply.type == 'negotiate' and reply.request_id == request_id:
+                codec = get_codec(reply.payload.get('codec'))
+                compact = reply.payload.get('protocol', 1) >= PROTOCOL_VERSION
+                name = reply.payload.get('compression')
+                compressor = get_compressor(name) if name else None
+                self.framing = Framing(codec, compact, compressor, self.compress_threshold,
+                                       self.compression_stats, self.max_frame_size)
+        except Exception as e:
+            print(f"协商失败，使用旧版 JSON 格式: {e}")
+
     async def _read_loop(self):
         """读取服务器消息的循环"""
         try:
             while self.connected:
                 try:
-                    # 读取长度头部（4字节整数）
-                    length_bytes = await self.reader.readexactly(4)
-                    length = int.from_bytes(length_bytes, byteorder='big')
-                    
-                    # 读取实际数据
-                    data = await self.reader.readexactly(length)
-                    await self._handle_data(data)
+                    # 读取一帧，头部格式取决于协商出的分帧方式
+                    header, body = await read_frame(self.reader, self.framing, self.max_frame_size)
+                    self._handle_data(header, body)
+                except FrameTooLarge as e:
+                    # 丢弃过大的消息体，连接继续可用
+                    await skip_body(self.reader, e.header[0])
+                    self._reject_frame(e.header, e)
                 except asyncio.IncompleteReadError:
                     # 连接关闭或被中断
                     print("服务器连接已断开")
@@ -92,7 +191,7 @@ class RPCClient:
                     if not self.connected:  # 避免重复报错
                         break
                     await asyncio.sleep(0.5)  # 短暂暂停避免CPU占用过高
-            
+
         except asyncio.CancelledError:
             # 任务被取消，正常退出
             print("读取循环任务已取消")
@@ -100,74 +199,133 @@ class RPCClient:
             print(f"读取循环发生未处理异常: {e}")
         finally:
             self.connected = False
+            self._fail_pending_calls(ConnectionError("服务器连接已断开"))
+            # 断开期间可能错过服务端的失效消息
+            self.invalidate_cache()
             print("读取循环结束")
 
-    async def _handle_data(self, data: bytes):
+    def _handle_data(self, header: tuple, body: bytes):
         try:
-            msg:dict = json.loads(data.decode('utf-8'))
-            
-            if not utils.verify_msg(msg):
-                raise Exception('消息格式错误')
+            frame: Frame = self.framing.decode(header, body)
         except Exception as e:
             print(f"解析数据时出错:{e}")
+            self._reject_frame(header, e)
             return
-        
-        msg_type = msg.get('type')
 
         # print("客户端消息")
-        # print(msg)
-        
-        
-        if msg_type == 'return':
+        # print(frame.type, frame.request_id)
+
+        if frame.type == 'heartbeat':
+            # 服务端对 ping 的回复
+            future = self._pending_calls.pop(frame.request_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+            return
+
+        if frame.type == 'invalidate':
+            method_name, prefix = frame.payload
+            self.invalidate_cache(method_name, *prefix)
+            return
+
+        if frame.type == 'credit':
+            credit = self._upload_credits.get(frame.request_id)
+            if credit is not None:
+                credit.grant(frame.payload)
+            return
+
+        if frame.type == 'stream' or (frame.type == 'return' and frame.request_id in self._streams):
+            self._handle_stream(frame)
+            return
+
+        if frame.type == 'return':
             try:
-                timestamp: float = msg.get('timestamp')
-                id:str = msg.get('id')
-                error = msg.get('error')
-                if error:
-                    async with self._return_buffer_lock:
-                        self._return_buffer[(timestamp,id)] = {'error': error}
+                future = self._pending_calls.pop(frame.request_id, None)
+                if future is None or future.done():
+                    # 调用已超时或被取消，直接丢弃结果
+                    return
+                if frame.flags & FLAG_ERROR:
+                    future.set_exception(error_from_frame(frame))
+                    return
+                if frame.flags & FLAG_BATCH:
+                    future.set_result(unpack_batch_results(frame.payload))
                     return
-                result = msg.get('result')
-                async with self._return_buffer_lock:
-                    self._return_buffer[(timestamp,id)] = {'result': result}
+                if frame.flags & FLAG_STREAM:
+                    future.set_result(self._stream_items.pop(frame.request_id, []))
+                    return
+                future.set_result(frame.payload)
             except Exception as e:
                 print(f"处理返回错误: {e}")
                 return
         else:
             return
 
-    async def _send_message(self, message: Dict):
-        """发送消息到服务器"""
+    def _reject_frame(self, header: tuple, error: Exception):
+        """无法接收的帧被丢弃，对应的调用以该错误结束，而不是一直等到超时"""
+        if not self.framing.compact:
+            # 旧版格式的请求 ID 在消息体中，无法对应到调用
+            return
+        request_id = header[3]
+        future = self._pending_calls.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_exception(error)
+        queue = self._streams.get(request_id)
+        if queue is not None:
+            queue.put_nowait(('error', error))
+
+    def _handle_stream(self, frame: Frame):
+        """处理流式返回的 stream 帧和结束帧"""
+        request_id = frame.request_id
+        queue = self._streams.get(request_id)
+        if queue is not None:
+            if frame.type == 'stream':
+                queue.put_nowait(('item', frame.payload))
+            elif frame.flags & FLAG_ERROR:
+                queue.put_nowait(('error', error_from_frame(frame)))
+            elif frame.flags & FLAG_STREAM:
+                queue.put_nowait(('end', None))
+            else:
+                # 普通方法的返回值作为唯一的一项
+                queue.put_nowait(('result', frame.payload))
+            return
+
+        # 普通调用遇到生成器方法：收集全部项，收到后立即补充额度
+        if request_id not in self._pending_calls:
+            return
+        self._stream_items.setdefault(request_id, []).append(frame.payload)
+        try:
+            self.frame_writer.write(*self.framing.encode('credit', request_id, 1))
+        except Exception as e:
+            print(f"发送流式额度失败: {e}")
+
+    async def _send_frame(self, msg_type: str, request_id: RequestId, payload: Any = None,
+                          flags: int = 0):
+        """发送一帧到服务器"""
         if not self.connected or not self.writer:
-            raise Exception("未连接到服务器")
-            
+            raise ConnectionError("未连接到服务器")
+
+        # 按协商出的格式编码，编码失败不影响连接状态
+        buffers = self.framing.encode(msg_type, request_id, payload, flags)
+
         try:
-            # 将消息转换为JSON并添加长度头部
-            data = json.dumps(message).encode('utf-8')
-            length = len(data)
-            length_bytes = length.to_bytes(4, byteorder='big')
-            
-            # 发送数据
-            # print("客户端发送数据")
-            # print(data)
-            self.writer.write(length_bytes + data)
-            await self.writer.drain()
+            # 放入发送队列，同一轮事件循环内的帧合并写出
+            await self.frame_writer.send(*buffers)
         except Exception as e:
             print(f"发送消息失败: {e}")
             self.connected = False
             raise e
 
-    async def call(self, method: str, params: List = None, kwargs: Dict = None, timeout: float = 5.0) -> Any:
+    async def call(self, method: str, params: List = None, kwargs: Dict = None,
+                   timeout: float = 5.0) -> Any:
         """
         异步调用客户端方法
-        
+
         参数:
             client_address: 客户端地址元组 (ip, port)
             method: 要调用的方法名
             params: 位置参数列表
             kwargs: 关键字参数字典
-            timeout: 超时时间（秒）
-            
+            timeout: 超时时间（秒），同时作为截止时间发给服务端，超时后服务端取消执行
+
         返回:
             方法的返回值，如果出现错误则抛出异常
         """
@@ -175,63 +333,222 @@ class RPCClient:
             params = []
         if kwargs is None:
             kwargs = {}
-            
-        timestamp: str = str(time.time())
-        id = str(uuid.uuid4())
-        msg = {
-            'type': 'call',
-            'timestamp': timestamp,
-            'method': method,
-            'args': params,
-            'kwargs': kwargs,
-            'id':id
-        }
-        
-        await self._send_message(msg)
-        
-        # 等待响应
-        wait_step = 0.1  # 每次等待的时间（秒）
-        steps = int(timeout / wait_step)
-        
-        for _ in range(steps):
-            async with self._return_buffer_lock:
-                if (timestamp,id) in self._return_buffer.keys():
-                    result_data = self._return_buffer[(timestamp,id)]
-                    del self._return_buffer[(timestamp,id)]
-                    
-                    # 检查是否有错误
-                    if 'error' in result_data:
-                        raise Exception(f"远程调用错误: {result_data['error']}")
-                    
-                    # 返回结果
-                    return result_data.get('result')
-            
-            await asyncio.sleep(wait_step)
-        
-        raise TimeoutError(f"调用方法 {method} 超时（{timeout}秒）")
-
-    
-        
+
+        payload = [method, params, kwargs, _deadline(timeout)]
+        return await self._request('call', payload, timeout, f"调用方法 {method}")
+
+    async def call_many(self, calls: List, timeout: float = 5.0) -> List[Any]:
+        """
+        批量调用服务端方法，所有调用放在一帧中发送，服务端用一帧返回全部结果
+
+        参数:
+            calls: [(method, args, kwargs), ...]，args 和 kwargs 可以省略
+            timeout: 整个批次的超时时间（秒）
+
+        返回:
+            与 calls 顺序一致的结果列表，出错的项为对应的异常对象
+        """
+        calls = utils.normalize_calls(calls)
+        if not calls:
+            return []
+        deadline = _deadline(timeout)
+        calls = [[*call, deadline] for call in calls]
+        return await self._request('batch', calls, timeout, f"批量调用 {len(calls)} 个方法")
+
+    async def ping(self, timeout: float = 1.0) -> float:
+        """
+        发送心跳并等待服务端回复，返回往返耗时（秒）
+
+        旧版格式的服务端不回复心跳，此时改用 init_connect 调用探测
+        """
+        start = time.perf_counter()
+        if self.framing.compact:
+            await self._request('heartbeat', None, timeout, "心跳")
+        else:
+            await self.call('init_connect', timeout=timeout)
+        return time.perf_counter() - start
+
+    async def stream(self, method: str, params: List = None, kwargs: Dict = None,
+                     timeout: float = 5.0) -> AsyncIterator[Any]:
+        """
+        流式调用服务端的生成器方法，逐项返回结果
+
+        参数:
+            method: 要调用的方法名
+            params: 位置参数列表
+            kwargs: 关键字参数字典
+            timeout: 等待每一项的超时时间（秒）
+
+        用法:
+            async for row in client.stream('query', ['players']):
+                ...
+
+        消费完的项才会通知服务端继续发送，处理得慢时服务端会相应地暂停。
+        调用普通方法时，其返回值作为唯一的一项。
+        """
+        if params is None:
+            params = []
+        if kwargs is None:
+            kwargs = {}
+
+        request_id = self.framing.new_request_id()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams[request_id] = queue
+        consumed = 0
+        finished = False
+        try:
+            await self._send_frame('call', request_id, [method, params, kwargs])
+            while True:
+                # 已经消费的项攒够一批，或即将等待新数据时补充额度
+                if consumed and (consumed >= 4 or queue.empty()):
+                    await self._send_frame('credit', request_id, consumed)
+                    consumed = 0
+                try:
+                    kind, value = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"流式调用 {method} 超时（{timeout}秒）")
+                if kind == 'item':
+                    yield value
+                    consumed += 1
+                    continue
+                finished = True
+                if kind == 'result':
+                    yield value
+                    return
+                elif kind == 'end':
+                    return
+                else:
+                    raise value
+        finally:
+            self._streams.pop(request_id, None)
+            # 提前退出循环、超时或被取消时让服务端停止生成
+            if not finished:
+                self._send_cancel(request_id)
+
+    async def upload(self, method: str,
+                     chunks: Union[bytes, bytearray, memoryview, Iterable, AsyncIterable],
+                     params: List = None, kwargs: Dict = None, timeout: float = 5.0,
+                     chunk_size: int = 1024 * 1024) -> Any:
+        """
+        分块上传：把 chunks 逐块发给服务端方法，方法以第一个参数异步迭代收到的块
+
+        参数:
+            method: 要调用的方法名
+            chunks: 二进制数据（按 chunk_size 切分，不复制），或逐块产生数据的同步/异步可迭代对象
+            params: 其余位置参数列表
+            kwargs: 关键字参数字典
+            timeout: 等待服务端额度以及最终结果的超时时间（秒）
+            chunk_size: chunks 为二进制数据时每块的字节数
+
+        返回:
+            方法的返回值
+
+        服务端每处理完一块才允许客户端多发一块，两端缓存的数据量都与总大小无关。
+        """
+        if not self.framing.compact:
+            raise Exception("服务端不支持分块上传")
+        if params is None:
+            params = []
+        if kwargs is None:
+            kwargs = {}
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            view = memoryview(chunks).cast('B')
+            chunks = (view[offset:offset + chunk_size]
+                      for offset in range(0, view.nbytes, chunk_size))
+
+        request_id = self.framing.new_request_id()
+        future = asyncio.get_running_loop().create_future()
+        credit = _UploadCredit()
+        # 方法提前返回时不再等待额度
+        future.add_done_callback(lambda _: credit.grant(0))
+        self._pending_calls[request_id] = future
+        self._upload_credits[request_id] = credit
+        try:
+            await self._send_frame('upload', request_id, [method, params, kwargs])
+            async for chunk in _iterate(chunks):
+                while credit.count <= 0 and not future.done():
+                    await credit.wait(timeout)
+                if future.done():
+                    break
+                credit.count -= 1
+                await self._send_frame('chunk', request_id, chunk)
+            else:
+                await self._send_frame('chunk', request_id, None, FLAG_STREAM)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"分块上传 {method} 超时（{timeout}秒）")
+        finally:
+            self._pending_calls.pop(request_id, None)
+            self._upload_credits.pop(request_id, None)
+            if not future.done():
+                self._send_cancel(request_id)
+
+    async def _request(self, msg_type: str, payload: Any, timeout: float, description: str) -> Any:
+        """发送一个请求帧并等待对应的 return 帧"""
+        request_id = self.framing.new_request_id()
+
+        # 先登记再发送，避免结果在登记前到达
+        future = asyncio.get_running_loop().create_future()
+        self._pending_calls[request_id] = future
+        try:
+            await self._send_frame(msg_type, request_id, payload)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{description} 超时（{timeout}秒）")
+        except asyncio.CancelledError:
+            # 等待的协程被取消，通知服务端不必再计算
+            self._send_cancel(request_id)
+            raise
+        finally:
+            self._pending_calls.pop(request_id, None)
+            self._stream_items.pop(request_id, None)
+
+    def _send_cancel(self, request_id: RequestId):
+        """发送 cancel 帧，被取消的协程中不能再等待，直接放进发送队列"""
+        if not self.connected or self.frame_writer is None:
+            return
+        try:
+            self.frame_writer.write(*self.framing.encode('cancel', request_id))
+        except Exception as e:
+            print(f"发送取消消息失败: {e}")
+
+    @property
+    def in_flight(self) -> int:
+        """已发出但尚未收到结果的请求数"""
+        return len(self._pending_calls) + len(self._streams)
+
+    def _fail_pending_calls(self, exc: Exception):
+        """连接断开时让所有等待中的调用立即失败"""
+        pending = self._pending_calls
+        self._pending_calls = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        for queue in self._streams.values():
+            queue.put_nowait(('error', exc))
+
+
+
 
 
     async def start_async(self):
         """异步启动客户端"""
         if not await self.connect():
             return False
-            
+
         # 保存当前事件循环
         self._loop = asyncio.get_running_loop()
-            
+
         # 启动读取循环
         self._running_task = asyncio.create_task(self._read_loop())
-        
-        
+
+
         # 触发启动回调
         await self.on_connect()
         return True
-        
 
-        
+
+
     async def on_connect(self):
         """连接成功后的回调（可以重写）"""
         print('连接已建立')
@@ -245,7 +562,7 @@ class RPCClient:
     def run(self):
         """同步启动客户端（阻塞）"""
         asyncio.run(self.start())
-        
+
     async def start(self):
         """运行客户端主循环"""
         try:
@@ -254,11 +571,12 @@ class RPCClient:
                 try:
                     reconnect_attempts = 0
                     max_reconnect_attempts = 3
-                    
+
                     while self.connected or reconnect_attempts < max_reconnect_attempts:
                         if not self.connected:
                             reconnect_attempts += 1
-                            print(f"尝试重新连接 ({reconnect_attempts}/{max_reconnect_attempts})...")
+                            print(f"尝试重新连接 "
+                                  f"({reconnect_attempts}/{max_reconnect_attempts})...")
                             if await self.start_async():
                                 reconnect_attempts = 0  # 重置重连计数
                             else:
@@ -266,7 +584,7 @@ class RPCClient:
                         else:
                             reconnect_attempts = 0  # 连接正常时重置重连计数
                             await asyncio.sleep(0.1)  # 减少CPU占用
-                            
+
                 except KeyboardInterrupt:
                     print("客户端正在关闭...")
         except Exception as e:
@@ -274,11 +592,11 @@ class RPCClient:
         finally:
             await self.close()
             print("客户端已关闭")
-                
+
     async def close(self):
         """关闭连接"""
         self.connected = False
-        
+
 
         # 取消读取循环任务
         if self._running_task:
@@ -290,10 +608,11 @@ class RPCClient:
                     pass  # 预期的结果
             except Exception as e:
                 print(f"取消读取任务时出现错误: {e}")
-                
+
         # 关闭写入器
         if self.writer:
             try:
+                self.frame_writer.flush()
                 self.writer.close()
                 try:
                     # 添加超时以避免在连接已断开时无限等待
@@ -307,3 +626,33 @@ class RPCClient:
             except Exception as e:
                 print(f"关闭写入器时出现错误: {e}")
 
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    """把超时时间换算成发给服务端的绝对截止时间，两端的时钟需要大致同步"""
+    return None if timeout is None else time.time() + timeout
+
+
+class _UploadCredit:
+    """分块上传的发送额度，由服务端的 credit 帧补充"""
+
+    def __init__(self):
+        self.count = 0
+        self._event = asyncio.Event()
+
+    def grant(self, count: int):
+        self.count += count
+        self._event.set()
+
+    async def wait(self, timeout: float):
+        self._event.clear()
+        await asyncio.wait_for(self._event.wait(), timeout)
+
+
+async def _iterate(chunks: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """统一遍历同步和异步可迭代对象"""
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
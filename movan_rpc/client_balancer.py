@@ -0,0 +1,218 @@
+"""
+多服务端客户端 - 在多个服务端之间做带健康检查的负载均衡
+
+每个服务端地址对应一个 RPCClient。每次调用随机选出两个健康的服务端（power of two choices），
+比较 ``延迟 EWMA × (在途请求数 + 1)``，发给代价较小的一个。
+连续失败或超时的服务端会被摘除，后台任务用心跳探测被摘除的服务端，恢复后重新加入。
+"""
+
+import asyncio
+import inspect
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .client import RPCClient
+from .protocol import OverloadedError
+
+
+class Endpoint:
+    """一个服务端及其健康状态"""
+
+    def __init__(self, address: str, port: int, client: RPCClient):
+        self.address = address
+        self.port = port
+        self.client = client
+        self.healthy = False
+        # 延迟的指数加权移动平均（秒），None 表示还没有样本
+        self.latency: Optional[float] = None
+        self.failures = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self.client.in_flight
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.client.connected
+
+    def cost(self) -> float:
+        # 没有样本的服务端代价为 0，让新加入的服务端先得到请求
+        return (self.latency or 0.0) * (self.in_flight + 1)
+
+
+class RPCClientBalancer:
+    def __init__(self, endpoints: List[Tuple[str, int]], codecs: Optional[List[str]] = None,
+                 max_retries: int = 2, failure_threshold: int = 2, probe_interval: float = 1.0,
+                 probe_timeout: float = 1.0, decay: float = 0.3):
+        """
+        参数:
+            endpoints: 服务端地址列表 [(address, port), ...]
+            codecs: 传给每个 RPCClient 的编码偏好
+            max_retries: 调用因连接断开或服务端过载失败时，换服务端重试的最大次数
+            failure_threshold: 连续超时多少次后摘除服务端，连接断开时立即摘除
+            probe_interval: 探测被摘除服务端的间隔（秒）
+            probe_timeout: 心跳探测的超时时间（秒）
+            decay: 延迟 EWMA 中新样本的权重
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个服务端地址")
+        self.codecs = codecs
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.decay = decay
+
+        self.endpoints: List[Endpoint] = [
+            Endpoint(address, port, self._create_client(address, port))
+            for address, port in endpoints
+        ]
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def _create_client(self, address: str, port: int) -> RPCClient:
+        return RPCClient(address, port, codecs=self.codecs)
+
+    async def start_async(self) -> bool:
+        """连接全部服务端并启动后台探测任务，至少有一个服务端可用时返回 True"""
+        results = await asyncio.gather(
+            *(endpoint.client.start_async() for endpoint in self.endpoints))
+        for endpoint, ok in zip(self.endpoints, results):
+            endpoint.healthy = bool(ok)
+        if self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+        return any(results)
+
+    @property
+    def connected(self) -> bool:
+        return any(endpoint.available for endpoint in self.endpoints)
+
+    def _pick(self) -> Optional[Endpoint]:
+        """power of two choices：随机取两个可用服务端，选代价较小的一个"""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.available]
+        if len(candidates) < 2:
+            return candidates[0] if candidates else None
+        first, second = random.sample(candidates, 2)
+        return first if first.cost() <= second.cost() else second
+
+    def _record_success(self, endpoint: Endpoint, elapsed: float):
+        endpoint.failures = 0
+        if endpoint.latency is None:
+            endpoint.latency = elapsed
+        else:
+            endpoint.latency += self.decay * (elapsed - endpoint.latency)
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        if endpoint.healthy:
+            print(f"摘除服务端 {endpoint.address}:{endpoint.port}: {reason}")
+        endpoint.healthy = False
+
+    async def _dispatch(self, operation: Callable) -> Any:
+        attempt = 0
+        while True:
+            endpoint = self._pick()
+            if endpoint is None:
+                raise ConnectionError("没有可用的服务端")
+            start = time.perf_counter()
+            try:
+                result = await operation(endpoint.client)
+            except ConnectionError as e:
+                self._eject(endpoint, str(e))
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                continue
+            except OverloadedError:
+                # 过载的服务端没有执行调用，换一个服务端重试是安全的，也不需要摘除
+                endpoint.failures = 0
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                continue
+            except TimeoutError as e:
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold:
+                    self._eject(endpoint, str(e))
+                raise
+            # 远程方法自身抛出的错误也说明服务端是健康的
+            except Exception:
+                self._record_success(endpoint, time.perf_counter() - start)
+                raise
+            self._record_success(endpoint, time.perf_counter() - start)
+            return result
+
+    async def call(self, method: str, params: List = None, kwargs: Dict = None,
+                   timeout: float = 5.0) -> Any:
+        """调用服务端方法，参数与 RPCClient.call 相同"""
+        return await self._dispatch(lambda client: client.call(method, params, kwargs, timeout))
+
+    async def call_many(self, calls: List, timeout: float = 5.0) -> List[Any]:
+        """批量调用，整批发给同一个服务端，参数与 RPCClient.call_many 相同"""
+        return await self._dispatch(lambda client: client.call_many(calls, timeout))
+
+    def server_method_stub(self, func: Callable):
+        async def wrapper(*args, **kwargs):
+            return await self.call(func.__name__, args, kwargs)
+
+        if inspect.iscoroutinefunction(func):
+            return wrapper
+        else:
+            raise SyntaxError("服务端方法的存根函数必须使用async def定义")
+
+    async def _probe(self, endpoint: Endpoint):
+        """探测一个被摘除的服务端，连接已断开时先重新连接"""
+        if not endpoint.client.connected:
+            await endpoint.client.close()
+            endpoint.client = self._create_client(endpoint.address, endpoint.port)
+            if not await endpoint.client.start_async():
+                return
+        try:
+            elapsed = await endpoint.client.ping(self.probe_timeout)
+        except Exception as e:
+            print(f"探测服务端 {endpoint.address}:{endpoint.port} 失败: {e}")
+            return
+        # 恢复后以探测延迟作为新的起点
+        endpoint.latency = elapsed
+        endpoint.failures = 0
+        endpoint.healthy = True
+        print(f"服务端 {endpoint.address}:{endpoint.port} 已恢复")
+
+    async def _probe_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.probe_interval)
+                for endpoint in self.endpoints:
+                    if endpoint.healthy and not endpoint.client.connected:
+                        self._eject(endpoint, "连接已断开")
+                await asyncio.gather(
+                    *(self._probe(endpoint) for endpoint in self.endpoints if not endpoint.healthy),
+                    return_exceptions=True,
+                )
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """每个服务端的健康状态、延迟和在途请求数"""
+        return [
+            {
+                'address': endpoint.address,
+                'port': endpoint.port,
+                'healthy': endpoint.available,
+                'latency': endpoint.latency,
+                'in_flight': endpoint.in_flight,
+                'failures': endpoint.failures,
+            }
+            for endpoint in self.endpoints
+        ]
+
+    async def close(self):
+        """停止探测并关闭全部连接"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        await asyncio.gather(*(endpoint.client.close() for endpoint in self.endpoints),
+                             return_exceptions=True)
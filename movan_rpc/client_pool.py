@@ -0,0 +1,152 @@
+"""
+连接池客户端 - 在同一个 host:port 上维持多条连接
+
+单条 TCP 连接上的一个大响应会阻塞它后面的所有响应。RPCClientPool 同时维持多个 RPCClient，
+每次调用发给在途请求最少的连接；启动时预先建立全部连接，后台任务定期替换已断开的连接。
+因连接断开而失败的调用（ConnectionError）会换一条连接重试。
+"""
+
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, List, Optional
+
+from .client import RPCClient
+
+
+class RPCClientPool:
+    def __init__(self, address: str, port: int, size: int = 4,
+                 codecs: Optional[List[str]] = None, max_retries: int = 2,
+                 reconnect_interval: float = 1.0):
+        """
+        参数:
+            address: 服务器地址
+            port: 服务器端口
+            size: 连接数
+            codecs: 传给每个 RPCClient 的编码偏好
+            max_retries: 调用因连接断开失败时，换连接重试的最大次数。
+                注意断开前已经送达服务端的调用可能会被执行两次
+            reconnect_interval: 后台检查并替换断开连接的间隔（秒）
+        """
+        if size < 1:
+            raise ValueError("连接数必须大于 0")
+        self.host: str = address
+        self.port: int = port
+        self.size = size
+        self.codecs = codecs
+        self.max_retries = max_retries
+        self.reconnect_interval = reconnect_interval
+
+        self.clients: List[RPCClient] = []
+        self._next = 0
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._reconnected = asyncio.Event()
+
+    def _create_client(self) -> RPCClient:
+        return RPCClient(self.host, self.port, codecs=self.codecs)
+
+    async def start_async(self) -> bool:
+        """预先建立全部连接并启动后台维护任务，至少有一条连接成功时返回 True"""
+        self.clients = [self._create_client() for _ in range(self.size)]
+        results = await asyncio.gather(*(client.start_async() for client in self.clients))
+        if self._maintain_task is None:
+            self._maintain_task = asyncio.create_task(self._maintain())
+        return any(results)
+
+    @property
+    def connected(self) -> bool:
+        return any(client.connected for client in self.clients)
+
+    async def _maintain(self):
+        """定期用新连接替换已经断开的连接"""
+        try:
+            while True:
+                await asyncio.sleep(self.reconnect_interval)
+                for index, client in enumerate(self.clients):
+                    if client.connected:
+                        continue
+                    try:
+                        await client.close()
+                        replacement = self._create_client()
+                        if await replacement.start_async():
+                            self.clients[index] = replacement
+                            self._reconnected.set()
+                        else:
+                            await replacement.close()
+                    except Exception as e:
+                        print(f"替换连接 {index} 失败: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    def _pick(self) -> Optional[RPCClient]:
+        """选出在途请求最少的已连接客户端，数量相同时轮流选择"""
+        best = None
+        count = len(self.clients)
+        for offset in range(count):
+            client = self.clients[(self._next + offset) % count]
+            if client.connected and (best is None or client.in_flight < best.in_flight):
+                best = client
+        self._next = (self._next + 1) % max(count, 1)
+        return best
+
+    async def _acquire(self, timeout: float) -> RPCClient:
+        client = self._pick()
+        if client is not None:
+            return client
+        # 全部连接都断开时等待后台任务完成一次重连
+        self._reconnected.clear()
+        try:
+            await asyncio.wait_for(self._reconnected.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        client = self._pick()
+        if client is None:
+            raise ConnectionError(f"没有可用的连接 {self.host}:{self.port}")
+        return client
+
+    async def _with_retry(self, timeout: float, operation: Callable) -> Any:
+        attempt = 0
+        while True:
+            client = await self._acquire(timeout)
+            try:
+                return await operation(client)
+            except ConnectionError:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+    async def call(self, method: str, params: List = None, kwargs: Dict = None,
+                   timeout: float = 5.0) -> Any:
+        """调用服务端方法，参数与 RPCClient.call 相同"""
+        return await self._with_retry(
+            timeout, lambda client: client.call(method, params, kwargs, timeout))
+
+    async def call_many(self, calls: List, timeout: float = 5.0) -> List[Any]:
+        """批量调用，整批发给同一条连接，参数与 RPCClient.call_many 相同"""
+        return await self._with_retry(timeout, lambda client: client.call_many(calls, timeout))
+
+    def server_method_stub(self, func: Callable):
+        async def wrapper(*args, **kwargs):
+            return await self.call(func.__name__, args, kwargs)
+
+        if inspect.iscoroutinefunction(func):
+            return wrapper
+        else:
+            raise SyntaxError("服务端方法的存根函数必须使用async def定义")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """每条连接的状态和在途请求数"""
+        return [
+            {'connected': client.connected, 'in_flight': client.in_flight}
+            for client in self.clients
+        ]
+
+    async def close(self):
+        """关闭全部连接"""
+        if self._maintain_task is not None:
+            self._maintain_task.cancel()
+            try:
+                await self._maintain_task
+            except asyncio.CancelledError:
+                pass
+            self._maintain_task = None
+        await asyncio.gather(*(client.close() for client in self.clients), return_exceptions=True)
@@ -0,0 +1,193 @@
+"""
+分片客户端 - 按路由键把调用固定发往同一个服务端
+
+适合有状态的服务（玩家会话、房间状态等）：同一个键的调用总是到达同一个 RPCServer，
+该服务端内存中的状态和缓存保持有效。服务端地址放在带虚拟节点的一致性哈希环上，
+增加或移除一个服务端时只有约 1/N 的键改变归属。
+"""
+
+import asyncio
+import bisect
+import hashlib
+import inspect
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .client import RPCClient
+
+NodeType = Tuple[str, int]
+
+
+def _hash(data: bytes) -> int:
+    # 不使用内置 hash()，它在不同进程间的结果不同
+    return int.from_bytes(hashlib.md5(data).digest()[:8], byteorder='big')
+
+
+def _key_bytes(key: Any) -> bytes:
+    if isinstance(key, (bytes, bytearray, memoryview)):
+        return bytes(key)
+    return str(key).encode('utf-8')
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes: Optional[List[Hashable]] = None, vnodes: int = 160):
+        """
+        参数:
+            nodes: 初始节点列表
+            vnodes: 每个节点在环上的虚拟节点数，越多分布越均匀
+        """
+        if vnodes < 1:
+            raise ValueError("虚拟节点数必须大于 0")
+        self.vnodes = vnodes
+        self.nodes: List[Hashable] = []
+        self._hashes: List[int] = []
+        self._owners: List[Hashable] = []
+        for node in nodes or []:
+            self.add_node(node)
+
+    def _points(self, node: Hashable) -> List[int]:
+        return [_hash(f"{node}#{index}".encode('utf-8')) for index in range(self.vnodes)]
+
+    def add_node(self, node: Hashable):
+        if node in self.nodes:
+            raise ValueError(f"节点 {node} 已经存在")
+        self.nodes.append(node)
+        for point in self._points(node):
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: Hashable):
+        if node not in self.nodes:
+            raise ValueError(f"节点 {node} 不存在")
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._hashes, self._owners) if owner != node]
+        self._hashes = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def get_node(self, key: Any) -> Hashable:
+        """返回键所属的节点：环上顺时针方向的第一个虚拟节点"""
+        if not self._hashes:
+            raise LookupError("哈希环中没有节点")
+        index = bisect.bisect(self._hashes, _hash(_key_bytes(key)))
+        if index == len(self._hashes):
+            index = 0
+        return self._owners[index]
+
+
+class RPCClientSharded:
+    def __init__(self, endpoints: List[NodeType], codecs: Optional[List[str]] = None,
+                 vnodes: int = 160):
+        """
+        参数:
+            endpoints: 服务端地址列表 [(address, port), ...]
+            codecs: 传给每个 RPCClient 的编码偏好
+            vnodes: 每个服务端在哈希环上的虚拟节点数
+        """
+        self.codecs = codecs
+        self.ring = HashRing(vnodes=vnodes)
+        self.clients: Dict[NodeType, RPCClient] = {}
+        self._connect_locks: Dict[NodeType, asyncio.Lock] = {}
+        for address, port in endpoints:
+            node = (address, port)
+            self.ring.add_node(node)
+            self.clients[node] = self._create_client(node)
+
+    def _create_client(self, node: NodeType) -> RPCClient:
+        return RPCClient(node[0], node[1], codecs=self.codecs)
+
+    async def start_async(self) -> bool:
+        """连接全部服务端，全部成功时返回 True"""
+        results = await asyncio.gather(*(client.start_async() for client in self.clients.values()))
+        return all(results)
+
+    async def add_endpoint(self, address: str, port: int) -> bool:
+        """加入一个服务端，约 1/N 的键会改为发往它"""
+        node = (address, port)
+        client = self._create_client(node)
+        self.ring.add_node(node)
+        self.clients[node] = client
+        return await client.start_async()
+
+    async def remove_endpoint(self, address: str, port: int):
+        """移除一个服务端，只有原来属于它的键会改变归属"""
+        node = (address, port)
+        self.ring.remove_node(node)
+        self._connect_locks.pop(node, None)
+        client = self.clients.pop(node)
+        await client.close()
+
+    def node_for(self, key: Any) -> NodeType:
+        """返回键所属的服务端地址"""
+        return self.ring.get_node(key)
+
+    async def _client_for(self, key: Any) -> RPCClient:
+        node = self.ring.get_node(key)
+        client = self.clients[node]
+        if client.connected:
+            return client
+        # 键必须留在所属的服务端上，断开时重新连接而不是换服务端
+        lock = self._connect_locks.setdefault(node, asyncio.Lock())
+        async with lock:
+            client = self.clients[node]
+            if not client.connected:
+                await client.close()
+                client = self._create_client(node)
+                self.clients[node] = client
+                if not await client.start_async():
+                    raise ConnectionError(f"无法连接到服务端 {node[0]}:{node[1]}")
+        return client
+
+    async def call(self, key: Any, method: str, params: List = None, kwargs: Dict = None,
+                   timeout: float = 5.0) -> Any:
+        """
+        把调用发往 key 所属的服务端
+
+        参数:
+            key: 路由键，相同的键总是发往同一个服务端
+            其余参数与 RPCClient.call 相同
+        """
+        client = await self._client_for(key)
+        return await client.call(method, params, kwargs, timeout)
+
+    async def call_many(self, key: Any, calls: List, timeout: float = 5.0) -> List[Any]:
+        """把一批调用发往 key 所属的服务端，参数与 RPCClient.call_many 相同"""
+        client = await self._client_for(key)
+        return await client.call_many(calls, timeout)
+
+    def server_method_stub(self, func: Callable = None, *, key: Optional[str] = None):
+        """
+        生成服务端方法的存根，用法:
+
+            @client.server_method_stub(key='player_id')
+            async def move(player_id, x, y): ...
+
+        参数:
+            key: 作为路由键的参数名，默认使用第一个参数
+        """
+        if func is None:
+            return lambda f: self.server_method_stub(f, key=key)
+
+        if not inspect.iscoroutinefunction(func):
+            raise SyntaxError("服务端方法的存根函数必须使用async def定义")
+        signature = inspect.signature(func)
+        if key is None:
+            if not signature.parameters:
+                raise ValueError(f"{func.__name__} 没有可作为路由键的参数")
+            key = next(iter(signature.parameters))
+        elif key not in signature.parameters:
+            raise ValueError(f"{func.__name__} 没有名为 {key} 的参数")
+
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            routing_key = bound.arguments[key]
+            return await self.call(routing_key, func.__name__, args, kwargs)
+
+        return wrapper
+
+    async def close(self):
+        """关闭全部连接"""
+        await asyncio.gather(*(client.close() for client in self.clients.values()),
+                             return_exceptions=True)
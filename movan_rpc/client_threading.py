@@ -1,27 +1,57 @@
-import json
 import time
 import socket
 import threading
 import select
-from typing import Dict, Any, Callable, Optional, List, Tuple
-import uuid
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Optional, List
 from . import utils
+from .codec import CODECS, BytesLike, get_codec
+from .compression import CompressionStats, get_compressor
+from .protocol import (
+    Frame, FrameTooLarge, Framing, RecvBuffer, RequestId, FLAG_BATCH, FLAG_ERROR, FLAG_STREAM,
+    PROTOCOL_VERSION, error_from_frame, unpack_batch_results,
+)
 
-CallId = Tuple[str,str]
+CallId = RequestId
 
 class RPCClientThreading:
-    def __init__(self, address: str, port: int):
+    def __init__(self, address: str, port: int, codecs: Optional[List[str]] = None,
+                 compression: Optional[List[str]] = None, compress_threshold: int = 4096,
+                 max_frame_size: Optional[int] = 64 * 1024 * 1024):
+        """
+        参数:
+            address: 服务器地址
+            port: 服务器端口
+            codecs: 按优先级排列的期望编码名列表，默认优先使用二进制编码
+            compression: 按优先级排列的期望压缩算法列表，例如 ['zstd', 'zlib']，默认不压缩
+            compress_threshold: 消息体达到多少字节才压缩
+            max_frame_size: 接收的单帧消息体（解压后）的最大字节数，超过时丢弃该帧，
+                对应的调用抛出错误，None 表示不限制
+        """
         self.host: str = address
         self.port: int = port
         self.methods: Dict[str, Callable] = {}
         self.socket: Optional[socket.socket] = None
         self.connected = False
-        
+        self.codecs: List[str] = codecs if codecs is not None else list(CODECS)
+        self.compression: List[str] = compression or []
+        self.compress_threshold = compress_threshold
+        self.compression_stats = CompressionStats()
+        self.max_frame_size = max_frame_size
+        # 协商前使用旧版 JSON 分帧
+        self.framing = Framing()
+
         self._read_thread = None
         self._keep_running = False
 
         self._return_buffer: Dict[CallId, Dict[str, Any]] = {}
         self._callback_buffer: Dict[CallId, Callable] = {}
+        # 流式返回：读取线程收到的项、每项的回调、普通调用收集到的项
+        self._stream_buffer: Dict[CallId, List] = {}
+        self._chunk_callbacks: Dict[CallId, Callable] = {}
+        self._stream_results: Dict[CallId, List] = {}
+        # call_async 发出的调用，由读取线程直接设置结果，不经过 on_tick
+        self._futures: Dict[CallId, Future] = {}
         self.return_buffer_lock = threading.Lock()
         self._socket_lock = threading.Lock()
         self._last_heartbeat_time = time.time()
@@ -35,17 +65,16 @@ class RPCClientThreading:
 
     def server_method_stub(self, func: Callable):
         def wrapper(*args, **kwargs):
-            # 同步函数的处理
-            result = self.call(func.__name__, args, kwargs)
-            return result
-        
+            # 阻塞等待远程方法的返回值
+            return self.call_sync(func.__name__, list(args), kwargs)
+
         return wrapper
-    
+
     # 装饰器注册方法
     def method(self, func: Callable):
         self.register_method(func.__name__, func)
         return func
-    
+
 
     def connect(self):
         """连接到服务器"""
@@ -54,45 +83,75 @@ class RPCClientThreading:
             self.socket.connect((self.host, self.port))
             self.connected = True
             print(f"已连接到服务器 {self.host}:{self.port}")
-            return True
         except Exception as e:
             print(f"连接服务器失败: {e}")
             return False
 
+        self._negotiate()
+        return True
+
+    def _recv_exactly(self, length: int) -> bytes:
+        """从 socket 读取恰好 length 字节"""
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.socket.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("服务器连接已断开")
+            data += chunk
+        return bytes(data)
+
+    def _read_frame(self) -> Frame:
+        """阻塞读取一帧"""
+        header = self.framing.parse_header(self._recv_exactly(self.framing.header_size))
+        if self.max_frame_size is not None and header[0] > self.max_frame_size:
+            raise FrameTooLarge(header, self.max_frame_size)
+        return self.framing.decode(header, self._recv_exactly(header[0]))
+
+    def _negotiate(self, timeout: float = 2.0):
+        """与服务端协商编码和分帧格式，旧版本服务端不认识协商消息时继续使用 JSON"""
+        self.framing = Framing()
+        request_id = self.framing.new_request_id()
+        payload = {'codecs': self.codecs, 'protocol': PROTOCOL_VERSION,
+                   'compression': self.compression}
+        try:
+            self._send_frame('negotiate', request_id, payload)
+            # 此时读取线程尚未启动，直接读取一帧回复
+            self.socket.settimeout(timeout)
+            try:
+                reply = self._read_frame()
+            finally:
+                self.socket.settimeout(None)
+            if reply.type == 'negotiate' and reply.request_id == request_id:
+                codec = get_codec(reply.payload.get('codec'))
+                compact = reply.payload.get('protocol', 1) >= PROTOCOL_VERSION
+                name = reply.payload.get('compression')
+                compressor = get_compressor(name) if name else None
+                self.framing = Framing(codec, compact, compressor, self.compress_threshold,
+                                       self.compression_stats, self.max_frame_size)
+        except Exception as e:
+            print(f"协商失败，使用旧版 JSON 格式: {e}")
+
     def _read_loop(self):
         """读取服务器消息的循环"""        
 
+        # 每次连接使用新的缓冲区，协商前后的分帧方式可能不同
+        buffer = RecvBuffer(max_size=self.max_frame_size)
         try:
             while self._keep_running and self.connected:
                 try:
                     timestamp = time.time()
                     if self._last_heartbeat_time + 1 < timestamp:
-                        self._send_message({'type': 'heartbeat', 'timestamp': str(timestamp),"id":str(uuid.uuid4())})
+                        self._send_frame('heartbeat', self.framing.new_request_id())
                         self._last_heartbeat_time = timestamp
-                    # 使用 select 函数检查是否有可读数据
+                    # 使用 select 函数检查是否有可读数据，超时只用于发送心跳和检查是否已关闭
                     ready = select.select([self.socket], [], [], 0.5)
                     if ready[0]:
-                        # 读取长度头部（4字节整数）
-                        length_bytes = self.socket.recv(4)
-                        if not length_bytes:
+                        # 一次读取可能包含多帧，也可能只有半帧
+                        if not buffer.recv_into(self.socket):
                             # 连接关闭
                             self.connected = False
                             break
-                            
-                        length = int.from_bytes(length_bytes, byteorder='big')
-                        
-                        # 读取实际数据
-                        data = b''
-                        while len(data) < length:
-                            chunk = self.socket.recv(min(4096, length - len(data)))
-                            if not chunk:
-                                # 连接关闭
-                                self.connected = False
-                                break
-                            data += chunk
-                            
-                        if data:
-                            self._handle_data(data)
+                        self._handle_frames(buffer)
                 except socket.error as e:
                     print(f"连接错误: {e}")
                     self.connected = False
@@ -102,90 +161,191 @@ class RPCClientThreading:
                     if not self.connected:  # 避免重复报错
                         break
                     time.sleep(0.1)  # 短暂暂停避免CPU占用过高
-            
+
         except Exception as e:
             print(f"读取循环发生未处理异常: {e}")
         finally:
             self.connected = False
             print("读取循环结束")
-            
+            self._fail_futures()
+
             if self._keep_running:
                 # 尝试重连
                 time.sleep(1)
                 self.start_sync()
 
-    def _handle_data(self, data: bytes):
+    def _handle_frames(self, buffer: RecvBuffer):
+        """处理缓冲区中全部完整的帧，过大的帧被缓冲区跳过，对应的调用以错误结束"""
+        while True:
+            try:
+                for header, body in buffer.frames(self.framing):
+                    self._handle_data(header, body)
+                return
+            except FrameTooLarge as e:
+                print(f"丢弃过大的帧: {e}")
+                self._reject_frame(e.header, e)
+
+    def _reject_frame(self, header: tuple, error: Exception):
+        """无法接收的帧被丢弃，对应的调用以该错误结束，而不是一直等到超时"""
+        if not self.framing.compact:
+            # 旧版格式的请求 ID 在消息体中，无法对应到调用
+            return
+        request_id = header[3]
+        with self.return_buffer_lock:
+            future = self._futures.pop(request_id, None)
+            self._stream_results.pop(request_id, None)
+            if future is None and (request_id in self._callback_buffer
+                                   or request_id in self._chunk_callbacks):
+                self._return_buffer[request_id] = {'error': str(error)}
+        if future is not None and not future.done():
+            try:
+                future.set_exception(error)
+            except Exception:
+                pass
+
+    def _handle_data(self, header: tuple, data: BytesLike):
         try:
-            msg: dict = json.loads(data.decode('utf-8'))
-            print(msg)
-            
-            if not utils.verify_msg(msg):
-                raise Exception('消息格式错误')
+            frame: Frame = self.framing.decode(header, data)
         except Exception as e:
             print(f"解析数据时出错:{e}")
+            self._reject_frame(header, e)
             return
-        
-        msg_type = msg.get('type')
 
         # print("客户端消息")
-        # print(msg)
-        
-        if msg_type == 'return':
+        # print(frame.type, frame.request_id)
+
+        if frame.type == 'stream':
+            with self.return_buffer_lock:
+                if frame.request_id not in self._futures:
+                    self._stream_buffer.setdefault(frame.request_id, []).append(frame.payload)
+                    return
+                self._stream_results.setdefault(frame.request_id, []).append(frame.payload)
+            # 等待 Future 的调用不经过 on_tick，收到即补充额度
+            try:
+                self._send_frame('credit', frame.request_id, 1)
+            except Exception as e:
+                print(f"发送流式额度失败: {e}")
+            return
+
+        if frame.type == 'return':
+            with self.return_buffer_lock:
+                future = self._futures.pop(frame.request_id, None)
+                stream_result = self._stream_results.pop(frame.request_id, None) \
+                    if future is not None else None
+            if future is not None:
+                self._resolve_future(future, frame, stream_result)
+                return
             try:
-                timestamp: str = msg.get('timestamp')
-                id: str = msg.get('id')
-                error = msg.get('error')
-                if error:
+                if frame.flags & FLAG_ERROR:
+                    with self.return_buffer_lock:
+                        self._return_buffer[frame.request_id] = {'error': frame.payload}
+                    return
+                if frame.flags & FLAG_STREAM:
                     with self.return_buffer_lock:
-                        self._return_buffer[(timestamp, id)] = {'error': error}
+                        self._return_buffer[frame.request_id] = {'result': None, 'stream': True}
                     return
-                result = msg.get('result')
+                result = frame.payload
+                if frame.flags & FLAG_BATCH:
+                    result = unpack_batch_results(result)
                 with self.return_buffer_lock:
-                    self._return_buffer[(timestamp, id)] = {'result': result}
+                    self._return_buffer[frame.request_id] = {'result': result}
             except Exception as e:
                 print(f"处理返回错误: {e}")
                 return
         else:
             return
 
-    def _send_message(self, message: Dict):
-        """发送消息到服务器"""
+    @staticmethod
+    def _resolve_future(future: Future, frame: Frame, stream_result: Optional[List]):
+        """用 return 帧设置 Future 的结果，调用方已经取消时忽略"""
+        if future.cancelled():
+            return
+        try:
+            if frame.flags & FLAG_ERROR:
+                future.set_exception(error_from_frame(frame))
+            elif frame.flags & FLAG_STREAM:
+                future.set_result(stream_result or [])
+            elif frame.flags & FLAG_BATCH:
+                future.set_result(unpack_batch_results(frame.payload))
+            else:
+                future.set_result(frame.payload)
+        except Exception as e:
+            print(f"设置调用结果失败: {e}")
+
+    def _fail_futures(self):
+        """连接断开时让所有等待中的 Future 抛出 ConnectionError"""
+        with self.return_buffer_lock:
+            futures = list(self._futures.values())
+            for call_id in self._futures:
+                self._stream_results.pop(call_id, None)
+            self._futures.clear()
+        for future in futures:
+            if not future.done():
+                try:
+                    future.set_exception(ConnectionError("服务器连接已断开"))
+                except Exception:
+                    pass
+
+    def _on_future_done(self, call_id: CallId, future: Future):
+        """Future 被取消时通知服务端取消对应的调用"""
+        if not future.cancelled():
+            return
+        with self.return_buffer_lock:
+            pending = self._futures.pop(call_id, None) is not None
+            self._stream_results.pop(call_id, None)
+        if pending and self.connected:
+            try:
+                self._send_frame('cancel', call_id)
+            except Exception as e:
+                print(f"发送取消消息失败: {e}")
+
+    def _send_frame(self, msg_type: str, request_id: RequestId, payload: Any = None,
+                    flags: int = 0):
+        """发送一帧到服务器"""
         if not self.connected or not self.socket:
             raise Exception("未连接到服务器")
-            
+
+        # 按协商出的格式编码，编码失败不影响连接状态
+        data = b''.join(self.framing.encode(msg_type, request_id, payload, flags))
+
         try:
-            # 将消息转换为JSON并添加长度头部
-            data = json.dumps(message).encode('utf-8')
-            length = len(data)
-            length_bytes = length.to_bytes(4, byteorder='big')
-            
             # 发送数据需要加锁以防止多线程同时写入
             with self._socket_lock:
-                self.socket.sendall(length_bytes + data)
+                self.socket.sendall(data)
         except Exception as e:
             print(f"发送消息失败: {e}")
             self.connected = False
             raise e
-        
+
     def unbind_call_back(self, call_id: CallId):
-        """解除回调绑定"""
+        """解除回调绑定，并通知服务端取消尚未完成的调用"""
         if not call_id:
             return
         with self.return_buffer_lock:
+            pending = call_id in self._callback_buffer and call_id not in self._return_buffer
             self._callback_buffer.pop(call_id, None)
+            self._chunk_callbacks.pop(call_id, None)
+            self._stream_results.pop(call_id, None)
+            self._stream_buffer.pop(call_id, None)
+        if pending and self.connected:
+            try:
+                self._send_frame('cancel', call_id)
+            except Exception as e:
+                print(f"发送取消消息失败: {e}")
 
 
 
-    def call(self, method: str, call_back:Callable = None, params: List = None, kwargs: Dict = None) -> CallId:
+    def call(self, method: str, call_back:Callable = None, params: List = None,
+             kwargs: Dict = None) -> CallId:
         """
         同步调用客户端方法
-        
+
         参数:
             method: 要调用的方法名
             params: 位置参数列表
             kwargs: 关键字参数字典
             timeout: 超时时间（秒）
-            
+
         返回:
             方法的返回值，如果出现错误则抛出异常
         """
@@ -193,63 +353,185 @@ class RPCClientThreading:
             params = []
         if kwargs is None:
             kwargs = {}
-            
-        timestamp: str = str(time.time())
-        id = str(uuid.uuid4())
-        msg = {
-            'type': 'call',
-            'timestamp': timestamp,
-            'method': method,
-            'args': params,
-            'kwargs': kwargs,
-            'id': id
-        }
-        self._callback_buffer[(timestamp, id)] = call_back
-        self._send_message(msg)
-        return (timestamp,id)
-
-    
+
+        call_id = self.framing.new_request_id()
+        self._callback_buffer[call_id] = call_back
+        self._send_frame('call', call_id, [method, params, kwargs])
+        return call_id
+
+    def call_async(self, method: str, params: List = None, kwargs: Dict = None,
+                   timeout: Optional[float] = None) -> Future:
+        """
+        调用服务端方法并返回 concurrent.futures.Future
+
+        参数:
+            method: 要调用的方法名
+            params: 位置参数列表
+            kwargs: 关键字参数字典
+            timeout: 超时时间（秒），换算成截止时间发给服务端，过期的调用不再执行
+
+        返回:
+            Future，由读取线程设置结果，不需要调用 on_tick；可以在任意线程中等待。
+            调用 future.cancel() 会通知服务端取消调用，生成器方法的结果为全部项组成的列表
+        """
+        if params is None:
+            params = []
+        if kwargs is None:
+            kwargs = {}
+
+        call_id = self.framing.new_request_id()
+        future: Future = Future()
+        # 先登记再发送，避免返回比登记先到
+        with self.return_buffer_lock:
+            self._futures[call_id] = future
+        payload = [method, params, kwargs]
+        if timeout is not None:
+            payload.append(time.time() + timeout)
+        try:
+            self._send_frame('call', call_id, payload)
+        except Exception:
+            with self.return_buffer_lock:
+                self._futures.pop(call_id, None)
+            raise
+        future.add_done_callback(lambda done: self._on_future_done(call_id, done))
+        return future
+
+    def call_sync(self, method: str, params: List = None, kwargs: Dict = None,
+                  timeout: Optional[float] = 5.0) -> Any:
+        """
+        阻塞调用服务端方法，多个线程可以同时通过同一个连接调用
+
+        参数:
+            method: 要调用的方法名
+            params: 位置参数列表
+            kwargs: 关键字参数字典
+            timeout: 超时时间（秒），None 表示一直等待
+
+        返回:
+            方法的返回值，如果出现错误则抛出异常，超时抛出 TimeoutError 并取消服务端的调用
+        """
+        future = self.call_async(method, params, kwargs, timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if not future.cancel():
+                # 结果恰好在超时后到达
+                return future.result()
+            raise TimeoutError(f"调用方法 {method} 超时") from None
+
+    def call_many(self, calls: List, call_back: Callable = None) -> CallId:
+        """
+        批量调用服务端方法，所有调用放在一帧中发送
+
+        参数:
+            calls: [(method, args, kwargs), ...]，args 和 kwargs 可以省略
+            call_back: 回调函数，在 on_tick 中以与 calls 顺序一致的结果列表调用，
+                出错的项为对应的异常对象
+
+        返回:
+            本次批量调用的 ID，可用于 unbind_call_back
+        """
+        call_id = self.framing.new_request_id()
+        self._callback_buffer[call_id] = call_back
+        self._send_frame('batch', call_id, utils.normalize_calls(calls))
+        return call_id
+
+    def stream(self, method: str, on_chunk: Callable, call_back: Callable = None,
+               params: List = None, kwargs: Dict = None) -> CallId:
+        """
+        流式调用服务端的生成器方法
+
+        参数:
+            method: 要调用的方法名
+            on_chunk: 每收到一项调用一次，在 on_tick 中执行
+            call_back: 流式返回结束后以 None 调用
+            params: 位置参数列表
+            kwargs: 关键字参数字典
+
+        返回:
+            本次调用的 ID，可用于 unbind_call_back
+
+        每次 on_tick 处理完收到的项后才通知服务端继续发送，主线程处理得慢时服务端会相应地暂停。
+        """
+        if params is None:
+            params = []
+        if kwargs is None:
+            kwargs = {}
+
+        call_id = self.framing.new_request_id()
+        with self.return_buffer_lock:
+            self._callback_buffer[call_id] = call_back
+            self._chunk_callbacks[call_id] = on_chunk
+        self._send_frame('call', call_id, [method, params, kwargs])
+        return call_id
+
+    def _take_stream_items(self) -> List:
+        """在锁内取出读取线程收到的流式项，返回 [(调用 ID, 每项的回调, 项列表), ...]"""
+        buffer = self._stream_buffer
+        self._stream_buffer = {}
+        taken = []
+        for call_id, items in buffer.items():
+            on_chunk = self._chunk_callbacks.get(call_id)
+            if on_chunk is None and call_id in self._callback_buffer:
+                # 普通调用遇到生成器方法，收集全部项作为结果
+                self._stream_results.setdefault(call_id, []).extend(items)
+            taken.append((call_id, on_chunk, items))
+        return taken
+
+    def _dispatch_stream_items(self, taken: List):
+        """在锁外把流式项交给回调，并为已处理的项补充额度"""
+        for call_id, on_chunk, items in taken:
+            if on_chunk is not None:
+                for item in items:
+                    on_chunk(item)
+            try:
+                self._send_frame('credit', call_id, len(items))
+            except Exception as e:
+                print(f"发送流式额度失败: {e}")
+
     def on_tick(self):
+        # 只在锁内取出收到的项和已完成的调用，回调和发送都在锁外执行，
+        # 回调中可以再次发起调用，发送阻塞时也不会卡住其他线程
+        finished = []
         with self.return_buffer_lock:
-            if len(self._return_buffer) > 0:
-                for (timestamp, id) in self._return_buffer.keys():
-                    result_data = self._return_buffer[(timestamp, id)]
-                    print(result_data)
-                    
-                    # 检查是否有错误
-                    if 'error' in result_data:
-                        print(result_data['error'])
-                    
-                    # 返回结果
-                    result = result_data.get('result')
-                    call_back = self._callback_buffer.get((timestamp, id))
-                    if call_back:
-                        call_back(result)
-                        # try:
-                        #     call_back(result)
-                        # except Exception as e:
-                        #     print(f"call back error: {e}")
-                        self._callback_buffer.pop((timestamp, id), None)
-                self._return_buffer.clear()
-                
-        
-        
+            taken = self._take_stream_items() if self._stream_buffer else []
+            for call_id, result_data in self._return_buffer.items():
+                self._chunk_callbacks.pop(call_id, None)
+                stream_result = self._stream_results.pop(call_id, None)
+                call_back = self._callback_buffer.pop(call_id, None)
+                finished.append((result_data, stream_result, call_back))
+            self._return_buffer.clear()
+
+        self._dispatch_stream_items(taken)
+        for result_data, stream_result, call_back in finished:
+            print(result_data)
+
+            # 检查是否有错误
+            if 'error' in result_data:
+                print(result_data['error'])
+
+            # 返回结果
+            result = result_data.get('result')
+            if result_data.get('stream'):
+                result = stream_result
+            if call_back:
+                call_back(result)
 
     def start_sync(self):
         """同步启动客户端"""
         if not self.connect():
             return False
-            
+
         # 启动读取线程
         self._keep_running = True
         self._read_thread = threading.Thread(target=self._read_loop)
         self._read_thread.daemon = True
         self._read_thread.start()
-        
+
         # 触发启动回调
         self.on_connect()
         return True
-        
+
     def on_connect(self):
         """连接成功后的回调（可以重写）"""
         print('连接已建立')
@@ -263,21 +545,22 @@ class RPCClientThreading:
     def run(self):
         """同步启动客户端（阻塞）"""
         self.start()
-        
 
-                
+
+
     def close(self):
         """关闭连接"""
         self.connected = False
         self._keep_running = False
-        
+        self._fail_futures()
+
         # 等待读取线程结束
         if self._read_thread and self._read_thread.is_alive():
             try:
                 self._read_thread.join(timeout=1.0)
             except Exception as e:
                 print(f"等待读取线程结束时出现错误: {e}")
-                
+
         # 关闭socket
         if self.socket:
             try:
@@ -0,0 +1,451 @@
+"""
+编解码模块 - 提供 Movan RPC 消息体的序列化方式
+
+- JSONCodec: JSON 编码，encode/decode 是未协商连接使用的旧版格式
+- BinaryCodec: 仿照 msgpack 的紧凑二进制编码，只依赖标准库 struct，
+  能够原样保留 bytes 和 tuple
+
+客户端在连接建立时通过 negotiate 消息告知自己支持的编码，服务端从中选出一个，
+之后这条连接上的所有消息都使用协商出的编码。未协商的连接一律使用 JSON。
+
+encode_parts/decode_parts 把消息中的 bytes、bytearray、memoryview 拆成附件：
+结构化部分只保留附件序号，附件本身由分帧层原样写在消息体后面，
+解码时直接引用接收缓冲区中的 memoryview 切片，两端都不复制二进制数据。
+
+其他类型（dataclass、datetime、数组等）通过 extensions 模块的类型注册表编码为扩展类型。
+"""
+
+import dataclasses
+import itertools
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .extensions import DEFAULT_REGISTRY, TypeRegistry
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# JSON 中表示附件引用的对象 {"$attachment": 序号}
+_ATTACHMENT_KEY = '$attachment'
+# JSON 中表示扩展类型的对象 {"$ext": 类型编号, "$value": 负载}
+_EXT_KEY = '$ext'
+_EXT_VALUE_KEY = '$value'
+# 用户数据中以 $ 开头的键编码时再加一个 $，解码时去掉，与上面的标记对象不会混淆
+_ESCAPE = '$'
+_CONTAINERS = (dict, list, tuple)
+
+
+def _escape_keys(obj: Any) -> Any:
+    """
+    给字典中以 $ 开头的键加上转义前缀
+
+    只复制确实有改动的容器，没有需要转义的键时返回原对象。
+    """
+    if isinstance(obj, dict):
+        escaped = None
+        for index, (key, value) in enumerate(obj.items()):
+            item = _escape_keys(value) if isinstance(value, _CONTAINERS) else value
+            new_key = _ESCAPE + key if isinstance(key, str) and key.startswith(_ESCAPE) else key
+            if escaped is None and (item is not value or new_key is not key):
+                escaped = dict(itertools.islice(obj.items(), index))
+            if escaped is not None:
+                escaped[new_key] = item
+        return obj if escaped is None else escaped
+    if isinstance(obj, (list, tuple)):
+        items = None
+        for index, value in enumerate(obj):
+            if not isinstance(value, _CONTAINERS):
+                continue
+            item = _escape_keys(value)
+            if item is not value:
+                if items is None:
+                    items = list(obj)
+                items[index] = item
+        return obj if items is None else items
+    return obj
+
+
+def _unescape_keys(obj: Dict) -> Dict:
+    """去掉 _escape_keys 加上的转义前缀"""
+    prefix = _ESCAPE * 2
+    if not any(isinstance(key, str) and key.startswith(prefix) for key in obj):
+        return obj
+    return {key[1:] if isinstance(key, str) and key.startswith(prefix) else key: value
+            for key, value in obj.items()}
+
+
+def as_byte_view(value: BytesLike) -> memoryview:
+    """把二进制数据转换为按字节寻址的 memoryview，非连续的视图只能复制一次"""
+    view = memoryview(value)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast('B') if view.format != 'B' or view.ndim != 1 else view
+
+
+class Codec:
+    """编解码器接口"""
+
+    name: str = ''
+
+    def __init__(self, registry: Optional[TypeRegistry] = None):
+        self.registry = registry if registry is not None else DEFAULT_REGISTRY
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: BytesLike) -> Any:
+        raise NotImplementedError
+
+    def encode_parts(self, obj: Any) -> Tuple[bytes, List[memoryview]]:
+        """编码并把二进制数据拆成附件，返回 (结构化部分, 附件列表)"""
+        return self.encode(obj), []
+
+    def decode_parts(self, data: BytesLike, attachments: List[memoryview]) -> Any:
+        """解码结构化部分，附件引用替换为对应的 memoryview"""
+        return self.decode(data)
+
+
+class JSONCodec(Codec):
+    """
+    JSON 编码
+
+    encode/decode 用于未协商的旧版连接，与旧版本客户端的格式完全一致，不使用附件、
+    扩展类型和键转义；协商后的连接通过 encode_parts/decode_parts 编解码。
+    """
+
+    name = 'json'
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data: BytesLike) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def encode_parts(self, obj: Any) -> Tuple[bytes, List[memoryview]]:
+        attachments: List[memoryview] = []
+
+        # JSON 无法表示的二进制数据会交给 default，在这里替换成附件引用
+        def attach(value):
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                attachments.append(as_byte_view(value))
+                return {_ATTACHMENT_KEY: len(attachments) - 1}
+            return self._encode_extension(value)
+
+        return json.dumps(_escape_keys(obj), default=attach).encode('utf-8'), attachments
+
+    def decode_parts(self, data: BytesLike, attachments: List[memoryview]) -> Any:
+        registry = self.registry
+
+        # 内层对象先于外层还原，扩展类型的负载中已经是还原好的附件
+        def resolve(obj: Dict):
+            if len(obj) == 1 and _ATTACHMENT_KEY in obj:
+                return attachments[obj[_ATTACHMENT_KEY]]
+            if len(obj) == 2 and _EXT_KEY in obj and _EXT_VALUE_KEY in obj:
+                return registry.decode(obj[_EXT_KEY], obj[_EXT_VALUE_KEY])
+            return _unescape_keys(obj)
+
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data, object_hook=resolve)
+
+    def _encode_extension(self, value: Any) -> Dict:
+        ext = self.registry.find(value)
+        if ext is None:
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+        return {_EXT_KEY: ext.code, _EXT_VALUE_KEY: _escape_keys(ext.encode(value))}
+
+
+# 二进制编码的类型标记，与 msgpack 保持一致
+_NIL = 0xc0
+_FALSE = 0xc2
+_TRUE = 0xc3
+_BIN8, _BIN16, _BIN32 = 0xc4, 0xc5, 0xc6
+_FLOAT64 = 0xcb
+_UINT64 = 0xcf
+_INT8, _INT16, _INT32, _INT64 = 0xd0, 0xd1, 0xd2, 0xd3
+_STR8, _STR16, _STR32 = 0xd9, 0xda, 0xdb
+_ARRAY16, _ARRAY32 = 0xdc, 0xdd
+_MAP16, _MAP32 = 0xde, 0xdf
+# msgpack 中保留未用的 0xc1，这里用作 tuple 前缀，后面紧跟一个数组
+_TUPLE = 0xc1
+# msgpack 的 fixext4，这里固定表示附件引用，后面是 4 字节附件序号
+_ATTACHMENT = 0xd6
+# msgpack 的 ext8，这里表示扩展类型，后面是 1 字节类型编号和负载的编码
+_EXT = 0xc7
+
+_pack_b = struct.Struct('>b').pack
+_pack_h = struct.Struct('>h').pack
+_pack_i = struct.Struct('>i').pack
+_pack_q = struct.Struct('>q').pack
+_pack_B = struct.Struct('>B').pack
+_pack_H = struct.Struct('>H').pack
+_pack_I = struct.Struct('>I').pack
+_pack_Q = struct.Struct('>Q').pack
+_pack_d = struct.Struct('>d').pack
+
+_unpack_b = struct.Struct('>b').unpack_from
+_unpack_h = struct.Struct('>h').unpack_from
+_unpack_i = struct.Struct('>i').unpack_from
+_unpack_q = struct.Struct('>q').unpack_from
+_unpack_H = struct.Struct('>H').unpack_from
+_unpack_I = struct.Struct('>I').unpack_from
+_unpack_Q = struct.Struct('>Q').unpack_from
+_unpack_d = struct.Struct('>d').unpack_from
+
+
+class BinaryCodec(Codec):
+    """类 msgpack 的二进制编码"""
+
+    name = 'binary'
+
+    def encode(self, obj: Any) -> bytes:
+        out = bytearray()
+        self._encode(obj, out)
+        return bytes(out)
+
+    def decode(self, data: BytesLike) -> Any:
+        obj, offset = self._decode(data, 0)
+        if offset != len(data):
+            raise ValueError("二进制消息末尾存在多余数据")
+        return obj
+
+    def encode_parts(self, obj: Any) -> Tuple[bytes, List[memoryview]]:
+        out = bytearray()
+        attachments: List[memoryview] = []
+        self._encode(obj, out, attachments)
+        return bytes(out), attachments
+
+    def decode_parts(self, data: BytesLike, attachments: List[memoryview]) -> Any:
+        obj, offset = self._decode(data, 0, attachments)
+        if offset != len(data):
+            raise ValueError("二进制消息末尾存在多余数据")
+        return obj
+
+    def _encode(self, obj: Any, out: bytearray, attachments: Optional[List] = None) -> None:
+        t = type(obj)
+        if obj is None:
+            out.append(_NIL)
+        elif t is bool:
+            out.append(_TRUE if obj else _FALSE)
+        elif t is int:
+            self._encode_int(obj, out)
+        elif t is float:
+            out.append(_FLOAT64)
+            out += _pack_d(obj)
+        elif t is str:
+            data = obj.encode('utf-8')
+            n = len(data)
+            if n < 32:
+                out.append(0xa0 | n)
+            elif n < 0x100:
+                out.append(_STR8)
+                out.append(n)
+            elif n < 0x10000:
+                out.append(_STR16)
+                out += _pack_H(n)
+            else:
+                out.append(_STR32)
+                out += _pack_I(n)
+            out += data
+        elif (t is bytes or t is bytearray or t is memoryview) and attachments is not None:
+            out.append(_ATTACHMENT)
+            out += _pack_I(len(attachments))
+            attachments.append(as_byte_view(obj))
+        elif t is bytes or t is bytearray or t is memoryview:
+            n = obj.nbytes if t is memoryview else len(obj)
+            if n < 0x100:
+                out.append(_BIN8)
+                out.append(n)
+            elif n < 0x10000:
+                out.append(_BIN16)
+                out += _pack_H(n)
+            else:
+                out.append(_BIN32)
+                out += _pack_I(n)
+            out += obj
+        elif t is list or t is tuple:
+            if t is tuple:
+                out.append(_TUPLE)
+            n = len(obj)
+            if n < 16:
+                out.append(0x90 | n)
+            elif n < 0x10000:
+                out.append(_ARRAY16)
+                out += _pack_H(n)
+            else:
+                out.append(_ARRAY32)
+                out += _pack_I(n)
+            for item in obj:
+                self._encode(item, out, attachments)
+        elif t is dict:
+            n = len(obj)
+            if n < 16:
+                out.append(0x80 | n)
+            elif n < 0x10000:
+                out.append(_MAP16)
+                out += _pack_H(n)
+            else:
+                out.append(_MAP32)
+                out += _pack_I(n)
+            for key, value in obj.items():
+                # 键需要可哈希，不拆成附件
+                self._encode(key, out)
+                self._encode(value, out, attachments)
+        else:
+            ext = self.registry.find(obj)
+            if ext is not None:
+                out.append(_EXT)
+                out.append(ext.code)
+                self._encode(ext.encode(obj), out, attachments)
+                return
+            # 内置类型的子类（IntEnum、namedtuple 等）按其基础类型编码
+            for base in (int, float, str, tuple, list, dict):
+                if isinstance(obj, base):
+                    self._encode(base(obj), out, attachments)
+                    return
+            if dataclasses.is_dataclass(obj):
+                raise TypeError(f"dataclass {t.__name__} 需要先用 register_dataclass 注册")
+            raise TypeError(f"无法编码类型 {t.__name__}")
+
+    @staticmethod
+    def _encode_int(obj: int, out: bytearray) -> None:
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif -0x80 <= obj < 0x80:
+            out.append(_INT8)
+            out += _pack_b(obj)
+        elif -0x8000 <= obj < 0x8000:
+            out.append(_INT16)
+            out += _pack_h(obj)
+        elif -0x80000000 <= obj < 0x80000000:
+            out.append(_INT32)
+            out += _pack_i(obj)
+        elif -0x8000000000000000 <= obj < 0x8000000000000000:
+            out.append(_INT64)
+            out += _pack_q(obj)
+        elif 0 <= obj < 0x10000000000000000:
+            out.append(_UINT64)
+            out += _pack_Q(obj)
+        else:
+            raise OverflowError("整数超出 64 位范围")
+
+    def _decode(self, data: BytesLike, offset: int, attachments: Optional[List] = None):
+        tag = data[offset]
+        offset += 1
+        if tag < 0x80:
+            return tag, offset
+        if tag >= 0xe0:
+            return tag - 0x100, offset
+        if 0xa0 <= tag <= 0xbf:
+            n = tag & 0x1f
+            return str(data[offset:offset + n], 'utf-8'), offset + n
+        if 0x90 <= tag <= 0x9f:
+            return self._decode_array(data, offset, tag & 0x0f, attachments)
+        if 0x80 <= tag <= 0x8f:
+            return self._decode_map(data, offset, tag & 0x0f, attachments)
+        if tag == _NIL:
+            return None, offset
+        if tag == _FALSE:
+            return False, offset
+        if tag == _TRUE:
+            return True, offset
+        if tag == _FLOAT64:
+            return _unpack_d(data, offset)[0], offset + 8
+        if tag == _INT8:
+            return _unpack_b(data, offset)[0], offset + 1
+        if tag == _INT16:
+            return _unpack_h(data, offset)[0], offset + 2
+        if tag == _INT32:
+            return _unpack_i(data, offset)[0], offset + 4
+        if tag == _INT64:
+            return _unpack_q(data, offset)[0], offset + 8
+        if tag == _UINT64:
+            return _unpack_Q(data, offset)[0], offset + 8
+        if tag in (_STR8, _STR16, _STR32):
+            n, offset = self._decode_length(tag - _STR8, data, offset)
+            return str(data[offset:offset + n], 'utf-8'), offset + n
+        if tag in (_BIN8, _BIN16, _BIN32):
+            n, offset = self._decode_length(tag - _BIN8, data, offset)
+            return bytes(data[offset:offset + n]), offset + n
+        if tag in (_ARRAY16, _ARRAY32):
+            n, offset = self._decode_length(tag - _ARRAY16 + 1, data, offset)
+            return self._decode_array(data, offset, n, attachments)
+        if tag in (_MAP16, _MAP32):
+            n, offset = self._decode_length(tag - _MAP16 + 1, data, offset)
+            return self._decode_map(data, offset, n, attachments)
+        if tag == _TUPLE:
+            items, offset = self._decode(data, offset, attachments)
+            if type(items) is not list:
+                raise ValueError("tuple 标记后必须是数组")
+            return tuple(items), offset
+        if tag == _ATTACHMENT:
+            index = _unpack_I(data, offset)[0]
+            if attachments is None or index >= len(attachments):
+                raise ValueError(f"附件 {index} 不存在")
+            return attachments[index], offset + 4
+        if tag == _EXT:
+            code = data[offset]
+            payload, offset = self._decode(data, offset + 1, attachments)
+            return self.registry.decode(code, payload), offset
+        raise ValueError(f"未知的类型标记 0x{tag:02x}")
+
+    @staticmethod
+    def _decode_length(size_class: int, data: BytesLike, offset: int):
+        # size_class: 0 -> 1 字节, 1 -> 2 字节, 2 -> 4 字节
+        if size_class == 0:
+            return data[offset], offset + 1
+        if size_class == 1:
+            return _unpack_H(data, offset)[0], offset + 2
+        return _unpack_I(data, offset)[0], offset + 4
+
+    def _decode_array(self, data: BytesLike, offset: int, n: int,
+                      attachments: Optional[List] = None):
+        items = []
+        append = items.append
+        for _ in range(n):
+            item, offset = self._decode(data, offset, attachments)
+            append(item)
+        return items, offset
+
+    def _decode_map(self, data: BytesLike, offset: int, n: int,
+                    attachments: Optional[List] = None):
+        result = {}
+        for _ in range(n):
+            key, offset = self._decode(data, offset)
+            value, offset = self._decode(data, offset, attachments)
+            result[key] = value
+        return result, offset
+
+
+JSON_CODEC = JSONCodec()
+BINARY_CODEC = BinaryCodec()
+
+# 按优先级排列的内置编码
+CODECS: Dict[str, Codec] = {
+    BINARY_CODEC.name: BINARY_CODEC,
+    JSON_CODEC.name: JSON_CODEC,
+}
+
+# 未协商连接使用的编码
+DEFAULT_CODEC = JSON_CODEC
+
+
+def get_codec(name: str) -> Codec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"不支持的编码 {name}")
+    return codec
+
+
+def choose_codec(offered: List[str], supported: Optional[List[str]] = None) -> Codec:
+    """按客户端给出的优先级选出双方都支持的编码，没有交集时退回 JSON"""
+    if supported is None:
+        supported = list(CODECS)
+    for name in offered:
+        if name in supported and name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
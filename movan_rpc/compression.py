@@ -0,0 +1,165 @@
+"""
+压缩模块 - 为协商成功的连接提供消息体压缩
+
+客户端在 negotiate 消息中给出按优先级排列的压缩算法，服务端从中选出双方都支持的一个。
+之后超过阈值的帧在发送前整体压缩，并在帧头设置 FLAG_COMPRESSED；压缩后没有变小的帧按原样发送。
+
+内置 zlib 和 lzma，安装了 zstandard 时还支持 zstd。
+"""
+
+import lzma
+import zlib
+from typing import Any, Dict, List, Optional
+
+from .codec import BytesLike
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor:
+    """压缩算法接口"""
+
+    name: str = ''
+
+    def compress(self, data: BytesLike) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: BytesLike, max_size: Optional[int] = None) -> bytes:
+        """解压，结果超过 max_size 字节时抛出 ValueError，防止压缩炸弹"""
+        raise NotImplementedError
+
+
+def _check_size(size: int, max_size: Optional[int]) -> None:
+    if max_size is not None and size > max_size:
+        raise ValueError(f"解压后的长度超过上限 {max_size}")
+
+
+class ZlibCompressor(Compressor):
+    name = 'zlib'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: BytesLike) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: BytesLike, max_size: Optional[int] = None) -> bytes:
+        if max_size is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size + 1)
+        _check_size(len(result), max_size)
+        if not decompressor.eof:
+            raise ValueError("压缩数据不完整")
+        return result
+
+
+class LzmaCompressor(Compressor):
+    name = 'lzma'
+
+    def __init__(self, preset: int = 1):
+        self.preset = preset
+
+    def compress(self, data: BytesLike) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data: BytesLike, max_size: Optional[int] = None) -> bytes:
+        decompressor = lzma.LZMADecompressor()
+        result = decompressor.decompress(data, -1 if max_size is None else max_size + 1)
+        _check_size(len(result), max_size)
+        if not decompressor.eof:
+            raise ValueError("压缩数据不完整")
+        return result
+
+
+class ZstdCompressor(Compressor):
+    name = 'zstd'
+
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: BytesLike) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: BytesLike, max_size: Optional[int] = None) -> bytes:
+        with self._decompressor.stream_reader(data) as reader:
+            result = reader.read(-1 if max_size is None else max_size + 1)
+        _check_size(len(result), max_size)
+        return result
+
+
+# 按优先级排列的可用压缩算法
+COMPRESSORS: Dict[str, Compressor] = {}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor()
+COMPRESSORS['zlib'] = ZlibCompressor()
+COMPRESSORS['lzma'] = LzmaCompressor()
+
+
+def get_compressor(name: str) -> Compressor:
+    compressor = COMPRESSORS.get(name)
+    if compressor is None:
+        raise ValueError(f"不支持的压缩算法 {name}")
+    return compressor
+
+
+def choose_compressor(offered: List[str], supported: Optional[List[str]] = None
+                      ) -> Optional[Compressor]:
+    """按客户端给出的优先级选出双方都支持的压缩算法，没有交集时不压缩"""
+    if supported is None:
+        supported = list(COMPRESSORS)
+    for name in offered:
+        if name in supported and name in COMPRESSORS:
+            return COMPRESSORS[name]
+    return None
+
+
+class CompressionStats:
+    """压缩统计，用于调整压缩阈值"""
+
+    def __init__(self):
+        self.compressed_frames = 0
+        # 超过阈值但压缩后没有变小、按原样发送的帧
+        self.skipped_frames = 0
+        # 压缩成功的帧压缩前后的字节数
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_seconds = 0.0
+        self.decompressed_frames = 0
+        self.decompress_seconds = 0.0
+
+    def record_compress(self, raw_size: int, compressed_size: Optional[int],
+                        seconds: float) -> None:
+        self.compress_seconds += seconds
+        if compressed_size is None:
+            self.skipped_frames += 1
+            return
+        self.compressed_frames += 1
+        self.raw_bytes += raw_size
+        self.compressed_bytes += compressed_size
+
+    def record_decompress(self, seconds: float) -> None:
+        self.decompressed_frames += 1
+        self.decompress_seconds += seconds
+
+    @staticmethod
+    def ratio_of(raw_bytes: int, compressed_bytes: int) -> Optional[float]:
+        """压缩后与压缩前的字节数之比，越小压缩效果越好"""
+        return compressed_bytes / raw_bytes if raw_bytes else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'compressed_frames': self.compressed_frames,
+            'skipped_frames': self.skipped_frames,
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'ratio': self.ratio_of(self.raw_bytes, self.compressed_bytes),
+            'compress_seconds': self.compress_seconds,
+            'decompressed_frames': self.decompressed_frames,
+            'decompress_seconds': self.decompress_seconds,
+        }
+
@@ -0,0 +1,206 @@
+"""
+扩展类型模块 - 让编码层直接传输 dataclass、时间和数值数组
+
+编解码器遇到内置类型以外的对象时查询类型注册表，把对象转换为 (类型编号, 负载)，
+负载本身再按普通消息编码；解码时按类型编号还原对象。服务端和两种客户端共用
+DEFAULT_REGISTRY，两端注册相同的类型即可。
+
+内置的扩展类型:
+
+- dataclass: 需要先用 register_dataclass 注册，按字段顺序编码成 [模式 ID, 字段值...]，
+  不携带字段名
+- datetime.datetime / datetime.date / datetime.timedelta
+- array.array: 类型码 + 原始缓冲区，解码时整块复制进新数组，不产生逐元素的 Python 对象
+- numpy.ndarray（安装了 numpy 时）: dtype + shape + 原始缓冲区，解码结果直接引用
+  接收到的缓冲区，是只读数组，需要修改时请先 copy()
+
+原始缓冲区在紧凑分帧下作为附件发送，不经过编码。
+"""
+
+import array
+import dataclasses
+import datetime
+import sys
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 内置扩展类型编号，0-31 保留给内置类型，32-127 可供自定义类型使用
+EXT_DATACLASS = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+EXT_TIMEDELTA = 4
+EXT_ARRAY = 5
+EXT_NDARRAY = 6
+
+MAX_CODE = 127
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class ExtensionType:
+    """一个扩展类型：类型编号以及对象与负载之间的转换函数"""
+
+    __slots__ = ('code', 'encode', 'decode')
+
+    def __init__(self, code: int, encode: Callable[[Any], Any], decode: Callable[[Any], Any]):
+        self.code = code
+        self.encode = encode
+        self.decode = decode
+
+
+class TypeRegistry:
+    """扩展类型注册表"""
+
+    def __init__(self):
+        self._by_type: Dict[type, ExtensionType] = {}
+        self._by_code: Dict[int, ExtensionType] = {}
+        # 按 "模块.类名" 延迟匹配的类型，用于不希望提前导入的可选依赖
+        self._by_name: Dict[str, ExtensionType] = {}
+        self._schemas: Dict[int, Tuple[type, List[str]]] = {}
+        self._by_code[EXT_DATACLASS] = ExtensionType(EXT_DATACLASS, None, self._decode_dataclass)
+
+    def register(self, cls: type, code: int, encode: Callable[[Any], Any],
+                 decode: Callable[[Any], Any]) -> None:
+        """
+        注册扩展类型
+
+        参数:
+            cls: 要传输的类型，子类也按该类型编码
+            code: 类型编号，自定义类型使用 32-127
+            encode: 把对象转换为可编码的负载（可以包含其他已支持的类型）
+            decode: 把负载还原为对象
+        """
+        self._add(code, encode, decode)
+        self._by_type[cls] = self._by_code[code]
+
+    def register_lazy(self, name: str, code: int, encode: Callable[[Any], Any],
+                      decode: Callable[[Any], Any]) -> None:
+        """按 "模块.类名" 注册扩展类型，不需要导入该类型所在的模块"""
+        self._add(code, encode, decode)
+        self._by_name[name] = self._by_code[code]
+
+    def _add(self, code: int, encode: Callable, decode: Callable) -> None:
+        if not 0 <= code <= MAX_CODE:
+            raise ValueError(f"扩展类型编号必须在 0-{MAX_CODE} 之间")
+        if code in self._by_code:
+            raise ValueError(f"扩展类型编号 {code} 已经被使用")
+        self._by_code[code] = ExtensionType(code, encode, decode)
+
+    def register_dataclass(self, cls: Optional[type] = None, *, schema_id: Optional[int] = None):
+        """
+        注册 dataclass，可以作为装饰器使用
+
+        参数:
+            cls: dataclass 类型
+            schema_id: 模式 ID，默认由类名和字段名计算，字段变化后 ID 随之改变，
+                两端定义不一致时解码会报错而不是错位
+        """
+        if cls is None:
+            return lambda c: self.register_dataclass(c, schema_id=schema_id)
+        if not dataclasses.is_dataclass(cls) or not isinstance(cls, type):
+            raise TypeError(f"{cls!r} 不是 dataclass 类型")
+
+        names = [field.name for field in dataclasses.fields(cls) if field.init]
+        if schema_id is None:
+            signature = f"{cls.__module__}.{cls.__qualname__}({','.join(names)})"
+            schema_id = zlib.crc32(signature.encode('utf-8')) & 0x7fffffff
+        registered = self._schemas.get(schema_id)
+        if registered is not None and registered[0] is not cls:
+            raise ValueError(f"模式 ID {schema_id} 已经被 {registered[0].__name__} 使用")
+        self._schemas[schema_id] = (cls, names)
+
+        def encode(obj):
+            return [schema_id, *[getattr(obj, name) for name in names]]
+
+        self._by_type[cls] = ExtensionType(EXT_DATACLASS, encode, None)
+        return cls
+
+    def _decode_dataclass(self, payload: List) -> Any:
+        schema = self._schemas.get(payload[0])
+        if schema is None:
+            raise ValueError(f"未注册的 dataclass 模式 ID {payload[0]}")
+        cls, names = schema
+        if len(payload) - 1 != len(names):
+            raise ValueError(f"{cls.__name__} 的字段数量不一致")
+        return cls(**dict(zip(names, payload[1:])))
+
+    def find(self, obj: Any) -> Optional[ExtensionType]:
+        """查找对象对应的扩展类型，没有时返回 None"""
+        cls = type(obj)
+        ext = self._by_type.get(cls)
+        if ext is not None:
+            return ext
+        for base in cls.__mro__:
+            ext = self._by_type.get(base)
+            if ext is None and self._by_name:
+                ext = self._by_name.get(f"{base.__module__}.{base.__qualname__}")
+            # 未注册的 dataclass 子类不能沿用父类的模式
+            if ext is not None and ext.code != EXT_DATACLASS:
+                self._by_type[cls] = ext
+                return ext
+        return None
+
+    def decode(self, code: int, payload: Any) -> Any:
+        ext = self._by_code.get(code)
+        if ext is None:
+            raise ValueError(f"未知的扩展类型 {code}")
+        return ext.decode(payload)
+
+
+def _encode_datetime(value: datetime.datetime) -> List:
+    offset = value.utcoffset()
+    return [value.year, value.month, value.day, value.hour, value.minute, value.second,
+            value.microsecond, None if offset is None else offset.total_seconds()]
+
+
+def _decode_datetime(payload: List) -> datetime.datetime:
+    *fields, offset = payload
+    tzinfo = None if offset is None else datetime.timezone(datetime.timedelta(seconds=offset))
+    return datetime.datetime(*fields, tzinfo=tzinfo)
+
+
+def _encode_array(value: array.array) -> List:
+    return [value.typecode, _LITTLE_ENDIAN, memoryview(value).cast('B')]
+
+
+def _decode_array(payload: List) -> array.array:
+    typecode, little_endian, buffer = payload
+    result = array.array(typecode)
+    result.frombytes(buffer)
+    if little_endian != _LITTLE_ENDIAN:
+        result.byteswap()
+    return result
+
+
+def _encode_ndarray(value) -> List:
+    import numpy
+    if value.dtype.hasobject or value.dtype.fields is not None:
+        raise TypeError(f"不支持的 ndarray dtype {value.dtype}")
+    data = numpy.ascontiguousarray(value).reshape(-1).view(numpy.uint8)
+    return [value.dtype.str, list(value.shape), memoryview(data)]
+
+
+def _decode_ndarray(payload: List):
+    import numpy
+    dtype, shape, buffer = payload
+    return numpy.frombuffer(buffer, dtype=numpy.dtype(dtype)).reshape(shape)
+
+
+def _register_builtins(registry: TypeRegistry) -> None:
+    registry.register(datetime.datetime, EXT_DATETIME, _encode_datetime, _decode_datetime)
+    registry.register(datetime.date, EXT_DATE, lambda value: [value.year, value.month, value.day],
+                      lambda payload: datetime.date(*payload))
+    registry.register(datetime.timedelta, EXT_TIMEDELTA,
+                      lambda value: [value.days, value.seconds, value.microseconds],
+                      lambda payload: datetime.timedelta(*payload))
+    registry.register(array.array, EXT_ARRAY, _encode_array, _decode_array)
+    # numpy 是可选依赖，只有在对象确实是 ndarray 时才会用到
+    registry.register_lazy('numpy.ndarray', EXT_NDARRAY, _encode_ndarray, _decode_ndarray)
+
+
+# 服务端和客户端默认共用的注册表
+DEFAULT_REGISTRY = TypeRegistry()
+_register_builtins(DEFAULT_REGISTRY)
+
+register_type = DEFAULT_REGISTRY.register
+register_dataclass = DEFAULT_REGISTRY.register_dataclass
@@ -0,0 +1,147 @@
+"""
+进程池执行模块 - 为 process 模式的方法提供跨进程调用支持
+
+方法以 ``模块:限定名`` 的形式交给工作进程，由工作进程自行导入，不需要序列化函数对象本身，
+因此只支持模块顶层定义的函数（不支持闭包和 lambda）。
+
+体积较大的 bytes/bytearray/memoryview 参数（包括嵌套在列表、元组和字典中的）放进共享内存，
+只把共享内存的名字发给工作进程，避免通过管道序列化整块数据。
+工作进程中方法收到的是共享内存上的 memoryview，只在方法执行期间有效，需要保留时请自行复制。
+"""
+
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 工作进程内已解析的方法缓存
+_resolved: Dict[str, Callable] = {}
+
+
+class SharedBuffer:
+    """放在共享内存中的参数，传给工作进程的只是名字和长度"""
+
+    __slots__ = ('name', 'size')
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def __reduce__(self):
+        return (SharedBuffer, (self.name, self.size))
+
+
+def _exit_with_parent(parent_pid: int) -> None:
+    """进程池工作进程的初始化函数：父进程被强制结束后随之退出，不留下孤儿进程"""
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1.0)
+        os._exit(1)
+
+    threading.Thread(target=watch, name='movan_rpc-parent-watch', daemon=True).start()
+
+
+def create_executor(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """创建进程池，先启动共享内存的资源跟踪进程，让 fork 出的工作进程与父进程共用它"""
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_exit_with_parent,
+                               initargs=(os.getpid(),))
+
+
+def qualified_name(func: Callable) -> str:
+    """返回可供工作进程导入的 ``模块:限定名``，函数不可导入时抛出 ValueError"""
+    module = getattr(func, '__module__', None)
+    qualname = getattr(func, '__qualname__', None)
+    if not module or not qualname or '<locals>' in qualname or '<lambda>' in qualname:
+        raise ValueError(f"{func!r} 不是模块顶层函数，无法在工作进程中导入")
+    return f"{module}:{qualname}"
+
+
+def resolve(name: str) -> Callable:
+    """根据 ``模块:限定名`` 导入函数"""
+    func = _resolved.get(name)
+    if func is None:
+        module_name, qualname = name.split(':', 1)
+        func = importlib.import_module(module_name)
+        for attr in qualname.split('.'):
+            func = getattr(func, attr)
+        _resolved[name] = func
+    return func
+
+
+def _map_nested(value: Any, convert: Callable[[Any], Any]) -> Any:
+    """对嵌套在列表、元组和字典中的每个值调用 convert，返回替换后的副本"""
+    if isinstance(value, list):
+        return [_map_nested(item, convert) for item in value]
+    if type(value) is tuple:
+        return tuple(_map_nested(item, convert) for item in value)
+    if isinstance(value, dict):
+        return {key: _map_nested(item, convert) for key, item in value.items()}
+    return convert(value)
+
+
+def share_large_buffers(args, kwargs: Dict, threshold: int
+                        ) -> Tuple[List, Dict, List[shared_memory.SharedMemory]]:
+    """把超过阈值的二进制参数放进共享内存，返回替换后的参数和需要由调用方释放的共享内存"""
+    segments: List[shared_memory.SharedMemory] = []
+
+    def share(value):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        size = value.nbytes if isinstance(value, memoryview) else len(value)
+        if size < threshold or size == 0:
+            # memoryview 无法 pickle，小块数据直接复制
+            return value.tobytes() if isinstance(value, memoryview) else value
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        segment.buf[:size] = value
+        segments.append(segment)
+        return SharedBuffer(segment.name, size)
+
+    try:
+        args = [_map_nested(value, share) for value in args]
+        kwargs = _map_nested(dict(kwargs), share)
+    except Exception:
+        release_segments(segments)
+        raise
+    return args, kwargs, segments
+
+
+def release_segments(segments: List[shared_memory.SharedMemory]) -> None:
+    """关闭并删除调用方创建的共享内存"""
+    for segment in segments:
+        try:
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def run_in_worker(name: str, args: List, kwargs: Dict) -> Any:
+    """工作进程入口：挂载共享内存参数后调用方法"""
+    attached: List[Tuple[shared_memory.SharedMemory, memoryview]] = []
+
+    def attach(value):
+        if not isinstance(value, SharedBuffer):
+            return value
+        segment = shared_memory.SharedMemory(name=value.name)
+        view = segment.buf[:value.size]
+        attached.append((segment, view))
+        return view
+
+    try:
+        args = [_map_nested(value, attach) for value in args]
+        kwargs = _map_nested(kwargs, attach)
+        return resolve(name)(*args, **kwargs)
+    finally:
+        for segment, view in attached:
+            try:
+                view.release()
+                segment.close()
+            except BufferError:
+                # 方法仍然持有视图时交给垃圾回收处理
+                pass
@@ -0,0 +1,481 @@
+"""
+帧协议模块 - 定义 Movan RPC 在 TCP 流上的分帧方式
+
+两种分帧格式:
+
+1. 旧版格式（协议版本 1）: ``[长度 4 字节][消息体]``，消息体是完整的 JSON 对象，
+   类型、时间戳和 uuid 都写在消息体里。未协商的连接使用这种格式。
+2. 紧凑格式（协议版本 2）: ``[长度 4 字节][类型 1 字节][标志 1 字节][请求 ID 4 字节][消息体]``，
+   长度只计算消息体。请求 ID 是每条连接上单调递增的整数，服务端无需解码消息体
+   就能路由、拒绝或应答一帧。
+
+生成器方法的结果以一串 stream 帧发送，最后是带 FLAG_STREAM 的 return 帧；客户端每消费一批项
+用 credit 帧补充服务端的发送额度。分块上传方向相反：upload 帧之后是一串 chunk 帧，
+由服务端用 credit 帧控制客户端的发送速度。
+
+协商了压缩算法的连接上，超过阈值的消息体整体压缩后发送，并设置 FLAG_COMPRESSED。
+
+上层代码只和 Frame 打交道，旧版格式在这里翻译成同样的 (类型, 标志, 请求 ID, 负载) 结构。
+"""
+
+import asyncio
+import struct
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from . import utils
+from .codec import BytesLike, Codec, DEFAULT_CODEC
+from .compression import CompressionStats, Compressor
+
+PROTOCOL_VERSION = 2
+
+# 长度、类型、标志、请求 ID
+HEADER = struct.Struct('!IBBI')
+HEADER_SIZE = HEADER.size
+# 附件表：附件数量，之后每个附件 8 字节长度
+ATTACHMENT_COUNT = struct.Struct('!I')
+LEGACY_HEADER_SIZE = 4
+MAX_REQUEST_ID = 0xffffffff
+
+# 紧凑格式中的帧类型编号
+FRAME_TYPES: Dict[str, int] = {
+    'call': 1,
+    'return': 2,
+    'heartbeat': 3,
+    'batch': 4,
+    'stream': 5,  # 流式返回中的一项
+    'credit': 6,  # 接收方补充流式返回或分块上传的发送额度，负载为项数
+    'upload': 7,  # 分块上传的调用，负载同 call，参数数据随后以 chunk 帧发送
+    'chunk': 8,  # 分块上传中的一块，带 FLAG_STREAM 的空 chunk 帧表示上传结束
+    'invalidate': 9,  # 服务端通知客户端失效本地缓存，负载为 [方法名, 参数前缀]
+    'cancel': 10,  # 客户端放弃一个调用，服务端取消对应的任务，没有负载
+}
+FRAME_NAMES: Dict[int, str] = {code: name for name, code in FRAME_TYPES.items()}
+
+# 帧标志位
+FLAG_ERROR = 0x01  # return 帧的负载是错误信息而不是结果
+FLAG_BATCH = 0x02  # return 帧的负载是批量调用的逐项结果 [[error, result], ...]
+FLAG_STREAM = 0x04  # return 帧表示流式返回结束，chunk 帧表示上传结束
+FLAG_ATTACHMENTS = 0x08  # 消息体带有二进制附件，格式见 split_attachments
+FLAG_COMPRESSED = 0x10  # 消息体使用协商的算法压缩，解压后再按其他标志解析
+FLAG_OVERLOADED = 0x20  # 与 FLAG_ERROR 一起出现：服务端过载，方法没有执行，可以稍后重试
+
+# 旧版格式的请求 ID 为 (timestamp, uuid)，紧凑格式为整数
+RequestId = Union[int, Tuple[str, str]]
+
+_MISSING = object()
+
+
+class Frame:
+    """一帧消息，负载在第一次访问时才解码"""
+
+    __slots__ = ('type', 'flags', 'request_id', 'body', '_payload', '_codec')
+
+    def __init__(self, msg_type: str, flags: int, request_id: RequestId, body: bytes = b'',
+                 codec: Optional[Codec] = None, payload: Any = _MISSING):
+        self.type = msg_type
+        self.flags = flags
+        self.request_id = request_id
+        self.body = body
+        self._codec = codec
+        self._payload = payload
+
+    @property
+    def payload(self) -> Any:
+        if self._payload is _MISSING:
+            if not self.body:
+                self._payload = None
+            elif self.flags & FLAG_ATTACHMENTS:
+                data, attachments = split_attachments(self.body)
+                self._payload = self._codec.decode_parts(data, attachments)
+            else:
+                self._payload = self._codec.decode_parts(self.body, [])
+        return self._payload
+
+
+class Framing:
+    """一条连接的分帧状态：编码方式以及是否使用紧凑格式"""
+
+    def __init__(self, codec: Codec = DEFAULT_CODEC, compact: bool = False,
+                 compressor: Optional[Compressor] = None, compress_threshold: int = 4096,
+                 stats: Optional[CompressionStats] = None,
+                 max_decompressed_size: Optional[int] = None):
+        """
+        参数:
+            codec: 编码方式
+            compact: 是否使用紧凑格式，压缩只在紧凑格式下生效
+            compressor: 协商的压缩算法，None 表示不压缩
+            compress_threshold: 消息体达到多少字节才尝试压缩
+            stats: 压缩统计，多条连接可以共用一个
+            max_decompressed_size: 解压后消息体的长度上限
+        """
+        self.codec = codec
+        self.compact = compact
+        self.compressor = compressor
+        self.compress_threshold = compress_threshold
+        self.stats = stats if stats is not None else CompressionStats()
+        self.max_decompressed_size = max_decompressed_size
+        self.header_size = HEADER_SIZE if compact else LEGACY_HEADER_SIZE
+        self._last_request_id = 0
+        self._request_id_lock = threading.Lock()
+
+    def new_request_id(self) -> RequestId:
+        """生成请求 ID，同步客户端会在多个线程中调用"""
+        if not self.compact:
+            return (str(time.time()), str(uuid.uuid4()))
+        with self._request_id_lock:
+            # 0 留给服务端主动推送的帧（例如 invalidate），回绕时跳过
+            self._last_request_id = (self._last_request_id + 1) & MAX_REQUEST_ID or 1
+            return self._last_request_id
+
+    def parse_header(self, data: bytes) -> Tuple[int, int, int, int]:
+        """解析头部，返回 (消息体长度, 类型编号, 标志, 请求 ID)"""
+        if self.compact:
+            return HEADER.unpack_from(data)
+        return int.from_bytes(data[:LEGACY_HEADER_SIZE], byteorder='big'), 0, 0, 0
+
+    def decode(self, header: Tuple[int, int, int, int], body: bytes) -> Frame:
+        """把读到的一帧转换为 Frame，未知类型抛出 ValueError"""
+        if not self.compact:
+            return _legacy_to_frame(self.codec.decode(body))
+        _, type_code, flags, request_id = header
+        msg_type = FRAME_NAMES.get(type_code)
+        if msg_type is None:
+            raise ValueError(f"未知的帧类型 {type_code}")
+        if flags & FLAG_COMPRESSED:
+            body = self._decompress(body)
+            flags &= ~FLAG_COMPRESSED
+        return Frame(msg_type, flags, request_id, body, self.codec)
+
+    def _decompress(self, body: bytes) -> bytes:
+        if self.compressor is None:
+            raise ValueError("收到压缩帧，但连接没有协商压缩算法")
+        start = time.thread_time()
+        body = self.compressor.decompress(body, self.max_decompressed_size)
+        self.stats.record_decompress(time.thread_time() - start)
+        return body
+
+    def _compress(self, parts: Tuple[BytesLike, ...]) -> Optional[bytes]:
+        """压缩消息体，压缩后没有变小时返回 None"""
+        size = _total_size(parts)
+        if size < self.compress_threshold:
+            return None
+        # 统计的是本线程的 CPU 时间，不包含等待调度的时间
+        start = time.thread_time()
+        data = parts[0] if len(parts) == 1 else b''.join(parts)
+        compressed = self.compressor.compress(data)
+        if len(compressed) >= size:
+            compressed = None
+        self.stats.record_compress(size, None if compressed is None else len(compressed),
+                                   time.thread_time() - start)
+        return compressed
+
+    def encode(self, msg_type: str, request_id: RequestId, payload: Any = None,
+               flags: int = 0) -> Tuple[BytesLike, ...]:
+        """
+        编码一帧，返回 (头部, 消息体...)，各部分分开写出以免拼接复制
+
+        紧凑格式下负载中的 bytes、bytearray、memoryview 作为附件原样跟在结构化部分之后，
+        发送完成前调用方不应修改这些缓冲区。
+        """
+        if not self.compact:
+            body = self.codec.encode(_frame_to_legacy(msg_type, flags, request_id, payload))
+            return len(body).to_bytes(LEGACY_HEADER_SIZE, byteorder='big'), body
+        if payload is None:
+            return HEADER.pack(0, FRAME_TYPES[msg_type], flags, request_id), b''
+        flags, parts = self.encode_body(payload, flags)
+        return self.frame(msg_type, request_id, flags, *parts)
+
+    def encode_body(self, payload: Any, flags: int = 0) -> Tuple[int, Tuple[BytesLike, ...]]:
+        """
+        只编码紧凑格式的消息体，返回 (标志, 消息体各部分)
+
+        消息体与请求 ID 无关，可以缓存下来配合 frame() 发给不同的请求。
+        """
+        body, attachments = self.codec.encode_parts(payload)
+        if attachments:
+            sizes = [attachment.nbytes for attachment in attachments]
+            table = ATTACHMENT_COUNT.pack(len(sizes)) + struct.pack(f'!{len(sizes)}Q', *sizes)
+            parts = (table, body, *attachments)
+            flags |= FLAG_ATTACHMENTS
+        else:
+            parts = (body,)
+        if self.compressor is not None:
+            compressed = self._compress(parts)
+            if compressed is not None:
+                parts = (compressed,)
+                flags |= FLAG_COMPRESSED
+        return flags, parts
+
+    def frame(self, msg_type: str, request_id: RequestId, flags: int,
+              *parts: BytesLike) -> Tuple[BytesLike, ...]:
+        """给 encode_body 得到的消息体加上紧凑格式的帧头"""
+        return (HEADER.pack(_total_size(parts), FRAME_TYPES[msg_type], flags, request_id), *parts)
+
+    @property
+    def body_variant(self) -> Tuple[str, Optional[str]]:
+        """决定消息体编码结果的 (编码名, 压缩算法名)"""
+        return self.codec.name, self.compressor.name if self.compressor is not None else None
+
+
+def _total_size(parts: Tuple[BytesLike, ...]) -> int:
+    return sum(len(part) if isinstance(part, bytes) else memoryview(part).nbytes for part in parts)
+
+
+class OverloadedError(Exception):
+    """服务端过载，调用没有被执行，可以退避后重试或换一个服务端"""
+
+
+class FrameTooLarge(ValueError):
+    """帧长度超过上限，消息体尚未读取"""
+
+    def __init__(self, header: Tuple, max_size: int):
+        super().__init__(f"帧长度 {header[0]} 超过上限 {max_size}，请使用分块上传")
+        self.header = header
+
+
+async def read_frame(reader: asyncio.StreamReader, framing: Framing,
+                     max_size: Optional[int] = None) -> Tuple[Tuple, bytes]:
+    """从流中读取一帧，返回 (头部, 消息体)，长度超过 max_size 时抛出 FrameTooLarge"""
+    header_bytes = await reader.readexactly(framing.header_size)
+    header = framing.parse_header(header_bytes)
+    if max_size is not None and header[0] > max_size:
+        raise FrameTooLarge(header, max_size)
+    body = await reader.readexactly(header[0])
+    return header, body
+
+
+async def skip_body(reader: asyncio.StreamReader, length: int, chunk_size: int = 64 * 1024) -> None:
+    """分段读出并丢弃消息体，不把整个消息体放进内存"""
+    while length > 0:
+        data = await reader.readexactly(min(chunk_size, length))
+        length -= len(data)
+
+
+class RecvBuffer:
+    """
+    同步客户端的接收缓冲区
+
+    用 recv_into 直接写入可增长的 bytearray，一次系统调用可以收到多帧；
+    frames() 按帧切出 memoryview，不复制消息体。头部读到后按帧长度一次性扩容，
+    大消息的接收时间与长度成线性关系。
+
+    带附件的帧解码后仍然引用缓冲区，这之后需要腾出空间时改用新的 bytearray，
+    已经交出去的数据不会被覆盖。
+
+    长度超过 max_size 的帧不扩容接收，frames() 抛出 FrameTooLarge，之后收到的消息体直接丢弃。
+    """
+
+    def __init__(self, initial_size: int = 64 * 1024, min_free: int = 4096,
+                 max_size: Optional[int] = None):
+        self.initial_size = initial_size
+        self.min_free = min_free
+        self.max_size = max_size
+        # 正在丢弃的过大消息体还剩的字节数
+        self._skip = 0
+        self._buffer = bytearray(initial_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        # 下一帧需要的总字节数，头部还没收全时为头部长度
+        self._need = 0
+        self._exported = False
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def recv_into(self, sock) -> int:
+        """从 socket 读取一次，返回读到的字节数，0 表示连接已关闭"""
+        self._reserve(self._need)
+        count = sock.recv_into(self._view[self._end:])
+        self._end += count
+        return count
+
+    def _reserve(self, need: int) -> None:
+        """保证从当前帧起有 need 字节的连续空间，并且尾部至少有 min_free 字节可写"""
+        capacity = len(self._buffer)
+        if capacity - self._start >= need and capacity - self._end >= self.min_free:
+            return
+        pending = self._end - self._start
+        size = max(self.initial_size, need, pending + self.min_free)
+        if size <= capacity and not self._exported:
+            # 已处理的数据没有被引用，把未处理的部分移到开头
+            self._buffer[:pending] = self._view[self._start:self._end].tobytes()
+        else:
+            if size <= capacity:
+                size = capacity
+            buffer = bytearray(size)
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._exported = False
+        self._start = 0
+        self._end = pending
+
+    def frames(self, framing: Framing) -> Iterator[Tuple[Tuple, memoryview]]:
+        """依次切出缓冲区中完整的帧，返回 (头部, 消息体)"""
+        header_size = framing.header_size
+        while True:
+            available = self._end - self._start
+            if self._skip:
+                skipped = min(self._skip, available)
+                self._start += skipped
+                self._skip -= skipped
+                if self._skip:
+                    self._need = header_size
+                    break
+                continue
+            if available < header_size:
+                self._need = header_size
+                break
+            header = framing.parse_header(self._view[self._start:self._start + header_size])
+            if self.max_size is not None and header[0] > self.max_size:
+                self._start += header_size
+                self._skip = header[0]
+                raise FrameTooLarge(header, self.max_size)
+            total = header_size + header[0]
+            if available < total:
+                self._need = total
+                break
+            body = self._view[self._start + header_size:self._start + total]
+            self._start += total
+            if header[2] & FLAG_ATTACHMENTS:
+                self._exported = True
+            yield header, body
+        if self._start == self._end:
+            if self._exported or len(self._buffer) > self.initial_size:
+                # 大消息处理完后释放扩容的空间
+                self._buffer = bytearray(self.initial_size)
+                self._view = memoryview(self._buffer)
+                self._exported = False
+            self._start = self._end = 0
+
+
+class FrameWriter:
+    """
+    连接的发送队列
+
+    同一轮事件循环内产生的帧先放进队列，在下一轮开始时用一次 writelines 写出；
+    只有当未发送的数据超过高水位时才等待 drain，避免每条消息一次系统调用和一次 drain。
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, high_water: int = 256 * 1024):
+        self.writer = writer
+        self.high_water = high_water
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    def write(self, *buffers: bytes) -> None:
+        """把缓冲区放进发送队列，不复制数据"""
+        if self.writer.is_closing():
+            raise ConnectionError("连接已关闭")
+        for buffer in buffers:
+            if buffer:
+                self._pending.append(buffer)
+                self._pending_size += len(buffer)
+        if self._flush_handle is None and self._pending:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        """立即把队列中的数据交给传输层"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+        self._pending_size = 0
+        if not self.writer.is_closing():
+            self.writer.writelines(pending)
+
+    async def send(self, *buffers: bytes) -> None:
+        """写入队列，未发送的数据超过高水位时才等待 drain"""
+        self.write(*buffers)
+        if self._pending_size + self.writer.transport.get_write_buffer_size() > self.high_water:
+            self.flush()
+            await self.writer.drain()
+
+
+def _legacy_to_frame(msg: Dict) -> Frame:
+    if not isinstance(msg, dict) or not utils.verify_msg(msg):
+        raise ValueError('消息格式错误')
+    msg_type = msg['type']
+    request_id = (msg['timestamp'], msg['id'])
+    if msg_type == 'call':
+        payload = [msg.get('method'), msg.get('args', []), msg.get('kwargs', {})]
+        if msg.get('deadline') is not None:
+            payload.append(msg['deadline'])
+        return Frame(msg_type, 0, request_id, payload=payload)
+    if msg_type == 'batch':
+        return Frame(msg_type, 0, request_id, payload=msg.get('calls', []))
+    if msg_type == 'return':
+        error = msg.get('error')
+        if error:
+            flags = FLAG_ERROR | (FLAG_OVERLOADED if msg.get('overloaded') else 0)
+            return Frame(msg_type, flags, request_id, payload=error)
+        flags = FLAG_BATCH if msg.get('batch') else 0
+        return Frame(msg_type, flags, request_id, payload=msg.get('result'))
+    return Frame(msg_type, 0, request_id, payload=msg)
+
+
+def _frame_to_legacy(msg_type: str, flags: int, request_id: RequestId, payload: Any) -> Dict:
+    timestamp, id = request_id
+    msg = {'type': msg_type, 'timestamp': timestamp, 'id': id}
+    if msg_type == 'call':
+        msg['method'], msg['args'], msg['kwargs'], *options = payload
+        if options and options[0] is not None:
+            msg['deadline'] = options[0]
+    elif msg_type == 'batch':
+        msg['calls'] = payload
+    elif msg_type == 'return':
+        msg['error' if flags & FLAG_ERROR else 'result'] = payload
+        if flags & FLAG_OVERLOADED:
+            msg['overloaded'] = True
+        if flags & FLAG_BATCH:
+            msg['batch'] = True
+    elif isinstance(payload, dict):
+        for key, value in payload.items():
+            msg.setdefault(key, value)
+    return msg
+
+
+def split_attachments(body: BytesLike) -> Tuple[memoryview, List[memoryview]]:
+    """
+    拆分带附件的消息体: ``[附件数 4 字节][每个附件的长度 8 字节...][结构化部分][附件...]``
+
+    返回结构化部分和各附件，都是 body 上的 memoryview 切片，不复制数据。
+    """
+    view = memoryview(body)
+    count = ATTACHMENT_COUNT.unpack_from(view)[0]
+    offset = ATTACHMENT_COUNT.size + 8 * count
+    if offset > len(view):
+        raise ValueError("附件表不完整")
+    sizes = struct.unpack_from(f'!{count}Q', view, ATTACHMENT_COUNT.size)
+    end = len(view) - sum(sizes)
+    if end < offset:
+        raise ValueError("附件长度超出消息体")
+    data = view[offset:end]
+    attachments = []
+    for size in sizes:
+        attachments.append(view[end:end + size])
+        end += size
+    return data, attachments
+
+
+def error_from_frame(frame: Frame) -> Exception:
+    """把带 FLAG_ERROR 的 return 帧转换为异常，服务端过载时为 OverloadedError"""
+    if frame.flags & FLAG_OVERLOADED:
+        return OverloadedError(f"远程调用错误: {frame.payload}")
+    return Exception(f"远程调用错误: {frame.payload}")
+
+
+def unpack_batch_results(items: List) -> List[Any]:
+    """把批量返回的 [[error, result], ...] 转换为结果列表，出错的项替换为异常对象"""
+    return [
+        Exception(f"远程调用错误: {error}") if error is not None else result
+        for error, result in items
+    ]
@@ -1,78 +1,629 @@
 import asyncio
-import json
-from typing import Dict, Any, Callable, Tuple
-from . import utils
+import inspect
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Deque, Dict, Any, Callable, Tuple, Optional, List, Union
+from . import process_pool
+from .supervisor import WorkerSupervisor
+from .cache import CacheEntry, CallKey, ResultCache
+from .codec import choose_codec
+from .compression import CompressionStats, choose_compressor
+from .protocol import (
+    Frame, FrameTooLarge, FrameWriter, Framing, RequestId, FLAG_BATCH, FLAG_ERROR, FLAG_OVERLOADED,
+    FLAG_STREAM, PROTOCOL_VERSION, read_frame, skip_body,
+)
 
 
 # 定义地址类型
 AddressType = Tuple[str, int]
 
+# 方法的执行模式：inline 在事件循环线程中直接调用，thread 交给共享线程池执行，
+# process 交给进程池执行（适合纯 Python 的 CPU 密集型方法）
+EXECUTION_MODES = ('inline', 'thread', 'process')
+
+# 流式返回中生成器耗尽的标记
+_STREAM_END = object()
+
+
+def _batch_deadline(calls: List) -> Optional[float]:
+    """批量调用的截止时间：每一项都带有截止时间时取最晚的一个"""
+    deadlines = [call[3] if len(call) > 3 else None for call in calls]
+    if not deadlines or None in deadlines:
+        return None
+    return max(deadlines)
+
+
+def _is_stream(result: Any) -> bool:
+    """生成器和异步生成器方法的结果逐项流式返回"""
+    return inspect.isgenerator(result) or inspect.isasyncgen(result)
+
+
+class MethodOptions:
+    """已注册方法的执行选项"""
+
+    def __init__(self, mode: str = 'inline', cache: Optional[ResultCache] = None,
+                 flight_key: Optional[CallKey] = None):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"未知的执行模式 {mode}，可选: {', '.join(EXECUTION_MODES)}")
+        self.mode = mode
+        self.cache = cache
+        # singleflight 方法计算参数键的函数，None 表示不合并调用
+        self.flight_key = flight_key
+        self.coalesced = 0
+        # process 模式下工作进程导入方法用的 模块:限定名
+        self.qualified_name: Optional[str] = None
+
+class Flight:
+    """singleflight 方法一次正在执行的调用：共享的任务和还在等待它的调用方数量"""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+class StreamCredit:
+    """一个流式返回的发送额度，每发送一项消耗一个，客户端消费后通过 credit 帧补充"""
+
+    def __init__(self, window: int):
+        self.credit = window
+        self.closed = False
+        self._event = asyncio.Event()
+
+    def grant(self, count: int) -> None:
+        self.credit += count
+        self._event.set()
+
+    def close(self) -> None:
+        """连接断开时唤醒等待中的发送方"""
+        self.closed = True
+        self._event.set()
+
+    async def acquire(self, timeout: float) -> None:
+        while self.credit <= 0 and not self.closed:
+            self._event.clear()
+            await asyncio.wait_for(self._event.wait(), timeout)
+        if self.closed:
+            raise ConnectionError("连接已关闭")
+        self.credit -= 1
+
+class UploadStream:
+    """
+    分块上传的数据，作为第一个参数传给方法
+
+    异步方法用 ``async for chunk in chunks`` 逐块读取，thread 模式的方法可以直接 ``for`` 迭代。
+    每取走一块就给客户端补充一块的发送额度，服务端缓存的块数不超过上传窗口。
+    """
+
+    def __init__(self, connection: 'Connection', request_id: RequestId, window: int):
+        self._connection = connection
+        self._request_id = request_id
+        self._window = window
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._finished = False
+        self.received = 0
+
+    def feed(self, chunk: Any) -> None:
+        if self._queue.qsize() >= self._window:
+            raise Exception("客户端发送的数据块超过上传窗口")
+        self.received += 1
+        self._queue.put_nowait(('chunk', chunk))
+
+    def finish(self) -> None:
+        self._queue.put_nowait(('end', None))
+
+    def fail(self, exc: Exception) -> None:
+        self._queue.put_nowait(('error', exc))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._finished:
+            raise StopAsyncIteration
+        kind, value = await self._queue.get()
+        if kind == 'end':
+            self._finished = True
+            raise StopAsyncIteration
+        if kind == 'error':
+            self._finished = True
+            raise value
+        try:
+            connection = self._connection
+            connection.frame_writer.write(*connection.framing.encode('credit', self._request_id, 1))
+        except Exception as e:
+            print(f"发送上传额度失败: {e}")
+        return value
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        # 在线程池中同步迭代，实际的读取交给事件循环
+        try:
+            return asyncio.run_coroutine_threadsafe(self.__anext__(), self._loop).result()
+        except StopAsyncIteration:
+            raise StopIteration
+
 class Connection:
     def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         self.reader = reader
         self.writer = writer
         self.address_tuple = writer.get_extra_info('peername')
-        
-        
-    async def send(self, data: bytes) -> None:
-        # print(data)
-        self.writer.write(data)
-        await self.writer.drain()
-        
+        # 协商前一律使用旧版 JSON 分帧，兼容旧版本客户端
+        self.framing = Framing()
+        # 同一轮事件循环内的响应合并写出
+        self.frame_writer = FrameWriter(writer)
+        # 正在进行的流式返回 request_id -> 发送额度
+        self.streams: Dict[RequestId, StreamCredit] = {}
+        # 正在进行的分块上传 request_id -> 上传数据
+        self.uploads: Dict[RequestId, UploadStream] = {}
+        # 正在执行的任务 request_id -> 任务，用于响应 cancel 帧
+        self.tasks: Dict[RequestId, asyncio.Task] = {}
+        # 正在执行的调用数，达到连接上限后新的调用先暂存，暂存也满了才暂停读取
+        self.in_flight = 0
+        self.held: Deque[Frame] = deque()
+        self._slot_freed = asyncio.Event()
+
+
+    async def send(self, *buffers: bytes) -> None:
+        await self.frame_writer.send(*buffers)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._slot_freed.set()
+
+    async def wait_for_slot(self, limit: int) -> None:
+        """等待在途调用数降到上限以下"""
+        while self.in_flight >= limit:
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+
 class RPCServer:
-    def __init__(self, address: str, port: int):
+    def __init__(self, address: str, port: int, batch_interval: Optional[float] = None,
+                 codecs: Optional[List[str]] = None, executor: Optional[Executor] = None,
+                 max_workers: Optional[int] = None, process_executor: Optional[Executor] = None,
+                 process_workers: Optional[int] = None,
+                 shared_memory_threshold: int = 1024 * 1024, stream_window: int = 16,
+                 upload_window: int = 8, max_connection_uploads: Optional[int] = 4,
+                 max_frame_size: Optional[int] = 64 * 1024 * 1024,
+                 compression: Optional[List[str]] = None, compress_threshold: int = 4096,
+                 max_tasks: Optional[int] = 1000, max_connection_tasks: Optional[int] = 128,
+                 call_timeout: Optional[float] = 30.0):
+        """
+        参数:
+            address: 监听地址
+            port: 监听端口
+            batch_interval: 异步结果的批量发送间隔（秒）。默认 None 表示结果一算出就立即写回，
+                设置后会把该间隔内完成的结果攒在一起并行发送
+            codecs: 允许客户端协商使用的编码名列表，默认允许全部内置编码
+            executor: thread 模式方法使用的线程池，默认在第一次需要时创建
+            max_workers: 默认线程池的线程数，传入 executor 时忽略
+            process_executor: process 模式方法使用的进程池，默认在第一次需要时创建
+            process_workers: 默认进程池的进程数，传入 process_executor 时忽略
+            shared_memory_threshold: process 模式下超过该字节数的二进制参数通过共享内存传递
+            stream_window: 生成器方法流式返回时，未被客户端确认消费的最大项数
+            upload_window: 分块上传时每个上传在服务端最多缓存的块数
+            max_connection_uploads: 单个连接同时进行的分块上传数上限，超过时返回 overloaded 错误，
+                None 表示不限制。一个连接缓存的上传数据不超过
+                max_connection_uploads * upload_window * max_frame_size
+            max_frame_size: 单帧消息体的最大字节数，超过时返回错误，更大的数据应使用分块上传。
+                None 表示不限制
+            compression: 允许客户端协商使用的压缩算法列表，默认允许全部可用算法，
+                传入空列表表示不压缩
+            compress_threshold: 消息体达到多少字节才压缩
+            max_tasks: 整个服务器同时执行的异步调用数上限，达到上限后新的调用直接返回
+                overloaded 错误（客户端抛出 OverloadedError），None 表示不限制
+            max_connection_tasks: 单个连接同时执行的调用数上限，None 表示不限制。达到上限后
+                新的调用先暂存，继续读取 cancel、credit 等控制帧；暂存的调用也达到这个数量时
+                才暂停读取该连接，由 TCP 流量控制让客户端放慢发送，此时控制帧同样要等到有调用结束
+            call_timeout: 客户端没有给出截止时间时，异步方法的最长执行时间（秒），None 表示不限制。
+                给出了截止时间的调用在截止时间到达时取消，已经过期的调用不执行，过期的结果不发送
+        """
         self.host = address
         self.port = port
         self.methods: Dict[str, Callable] = {}
+        self._method_options: Dict[str, MethodOptions] = {}
         self.connections: Dict[AddressType, Connection] = {}
-       
+
+        self.codecs = codecs
         self.server = None
         self._loop = None
         self._started = False
-        
-        self._call_buffer:Dict[Tuple[str,str,Connection],Any] = {}
-        self._call_buffer_lock = asyncio.Lock()
-        
+        self._supervisor: Optional[WorkerSupervisor] = None
+
+        self._batch_interval = batch_interval
+        self._call_buffer:Dict[Tuple[Connection,RequestId],Tuple[Any,Optional[str]]] = {}
+        self._call_buffer_event = asyncio.Event()
+
         # 新增任务管理相关属性
         self._tasks = set()
-        self._max_tasks = 1000  # 最大并发任务数
-        self._task_semaphore = asyncio.Semaphore(self._max_tasks)
-        
+        # 准入控制：在途调用数在任务结束时才释放
+        self._max_tasks = max_tasks
+        self._max_connection_tasks = max_connection_tasks
+        self._in_flight = 0
+        self._rejected = 0
+        self._pauses = 0
+        self._paused_seconds = 0.0
+
+        # 截止时间：到达时已过期、执行中超时取消、结果过期被丢弃的调用数
+        self._call_timeout = call_timeout
+        self._expired = 0
+        self._timed_out = 0
+        self._late = 0
+        # 被客户端 cancel 帧取消的任务数
+        self._cancelled = 0
+
+        # thread 模式使用的共享线程池及其排队统计
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._max_workers = max_workers
+        self._thread_stats_lock = threading.Lock()
+        self._thread_queued = 0
+        self._thread_running = 0
+        # 在线程池队列中等待的总时间和已开始执行的调用数
+        self._thread_wait_seconds = 0.0
+        self._thread_started = 0
+
+        # process 模式使用的进程池
+        self._process_executor = process_executor
+        self._owns_process_executor = process_executor is None
+        self._process_workers = process_workers
+        self._shared_memory_threshold = shared_memory_threshold
+        # 在进程池的回调线程中减少，同样由 _thread_stats_lock 保护
+        self._process_pending = 0
+
+        self._stream_window = stream_window
+        self._upload_window = upload_window
+        self._max_connection_uploads = max_connection_uploads
+        self._max_frame_size = max_frame_size
+
+        self.compression = compression
+        self._compress_threshold = compress_threshold
+        self.compression_stats = CompressionStats()
+
+        # singleflight 方法正在执行的调用 (方法名, 参数键) -> 共享的任务
+        self._flights: Dict[Tuple[str, Any], Flight] = {}
+
         self.register_method("init_connect",self._init_connect)
 
     def _init_connect(self):
         return True
 
-    def register_method(self, name: str, method: Callable):
+    def register_method(self, name: str, method: Callable, mode: str = 'inline',
+                        cache: Union[bool, ResultCache, None] = None, singleflight: bool = False):
+        """
+        注册方法
+
+        参数:
+            name: 方法名
+            method: 同步或异步函数，也可以是生成器或异步生成器函数，此时结果逐项流式返回
+            mode: 同步方法的执行模式，inline 在事件循环中直接调用，thread 放到线程池中执行，
+                process 放到进程池中执行（方法必须是可导入的模块顶层函数）
+            cache: 缓存幂等方法的结果，传入 ResultCache 设置有效期和容量，True 使用默认设置
+            singleflight: 参数相同的调用正在执行时，后来的调用不再执行方法，而是等待同一个结果。
+                只对异步、thread 和 process 模式的方法有效
+        """
         if self.methods.get(name):
             raise Exception(f"方法 {name} 已经注册")
+        if cache is True:
+            cache = ResultCache()
+        elif cache is False:
+            cache = None
+        if cache is not None:
+            if inspect.isgeneratorfunction(method) or inspect.isasyncgenfunction(method):
+                raise ValueError(f"生成器方法 {name} 不支持结果缓存")
+            cache.bind(method)
+        if singleflight and (inspect.isgeneratorfunction(method)
+                             or inspect.isasyncgenfunction(method)):
+            raise ValueError(f"生成器方法 {name} 不支持 singleflight")
+        options = MethodOptions(mode, cache, CallKey(method) if singleflight else None)
+        if options.mode != 'inline' and (inspect.iscoroutinefunction(method)
+                                         or inspect.isasyncgenfunction(method)):
+            raise ValueError(f"异步方法 {name} 只能使用 inline 模式")
+        if options.mode == 'process' and inspect.isgeneratorfunction(method):
+            raise ValueError(f"生成器方法 {name} 不支持 process 模式")
+        if options.mode == 'process':
+            options.qualified_name = process_pool.qualified_name(method)
         self.methods[name] = method
+        self._method_options[name] = options
 
 
 
-    # 装饰器注册方法
-    def method(self, func: Callable):
-        self.register_method(func.__name__, func)
+    # 装饰器注册方法，可直接使用 @server.method，也可以带参数 @server.method(mode='thread')
+    def method(self, func: Optional[Callable] = None, *, mode: str = 'inline',
+               cache: Union[bool, ResultCache, None] = None, singleflight: bool = False):
+        if func is None:
+            return lambda f: self.method(f, mode=mode, cache=cache, singleflight=singleflight)
+        self.register_method(func.__name__, func, mode=mode, cache=cache, singleflight=singleflight)
         return func
-        
+
+    def invalidate_cache(self, method_name: Optional[str] = None, *args) -> int:
+        """
+        失效结果缓存，返回本地删除的条目数，同时通知所有紧凑分帧的客户端失效各自的存根缓存
+
+        参数:
+            method_name: 方法名，None 表示清空全部方法的缓存
+            args: 参数前缀，只失效前几个参数与之相同的调用，不传时清空该方法的缓存
+        """
+        self._notify_invalidate(method_name, list(args))
+        if method_name is None:
+            return sum(options.cache.invalidate() for options in self._method_options.values()
+                       if options.cache is not None)
+        options = self._method_options.get(method_name)
+        if options is None or options.cache is None:
+            return 0
+        return options.cache.invalidate(args)
+
+    def _notify_invalidate(self, method_name: Optional[str], prefix: List) -> None:
+        """向客户端推送 invalidate 帧，可以在 thread 模式的方法中调用"""
+        if self._loop is None:
+            return
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._broadcast_invalidate(method_name, prefix)
+        else:
+            self._loop.call_soon_threadsafe(self._broadcast_invalidate, method_name, prefix)
+
+    def _broadcast_invalidate(self, method_name: Optional[str], prefix: List) -> None:
+        for connection in list(self.connections.values()):
+            # 旧版格式的客户端只能依赖缓存有效期
+            if not connection.framing.compact:
+                continue
+            try:
+                connection.frame_writer.write(
+                    *connection.framing.encode('invalidate', 0, [method_name, prefix]))
+            except Exception as e:
+                print(f"推送缓存失效消息到 {connection.address_tuple} 失败: {e}")
+
+    def _cache_of(self, method_name: str) -> Optional[ResultCache]:
+        options = self._method_options.get(method_name)
+        return options.cache if options is not None else None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix='movan_rpc')
+        return self._executor
+
+    def _run_in_thread(self, method: Callable, args, kwargs) -> asyncio.Future:
+        """把同步方法交给线程池执行，返回可等待的 Future"""
+        enqueued = time.perf_counter()
+
+        def run():
+            waited = time.perf_counter() - enqueued
+            with self._thread_stats_lock:
+                self._thread_queued -= 1
+                self._thread_running += 1
+                self._thread_wait_seconds += waited
+                self._thread_started += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self._thread_stats_lock:
+                    self._thread_running -= 1
+
+        def on_done(future):
+            # 开始执行前被取消（截止时间、cancel 帧或关闭线程池）时 run 不会执行
+            if future.cancelled():
+                with self._thread_stats_lock:
+                    self._thread_queued -= 1
+
+        with self._thread_stats_lock:
+            self._thread_queued += 1
+        future = self._get_executor().submit(run)
+        future.add_done_callback(on_done)
+        return asyncio.wrap_future(future)
+
+    def _get_process_executor(self) -> Executor:
+        if self._process_executor is None:
+            self._process_executor = process_pool.create_executor(self._process_workers)
+        return self._process_executor
+
+    def _run_in_process(self, options: MethodOptions, args, kwargs) -> asyncio.Future:
+        """把方法交给进程池执行，大块二进制参数经共享内存传递"""
+        args, kwargs, segments = process_pool.share_large_buffers(
+            args, kwargs, self._shared_memory_threshold)
+        try:
+            future = self._get_process_executor().submit(
+                process_pool.run_in_worker, options.qualified_name, args, kwargs)
+        except Exception:
+            process_pool.release_segments(segments)
+            raise
+
+        with self._thread_stats_lock:
+            self._process_pending += 1
+
+        def on_done(_):
+            # 等进程池中的任务真正结束后再释放共享内存：取消调用只取消了外层的 asyncio Future，
+            # 工作进程可能仍在排队或执行，还会访问这些共享内存
+            with self._thread_stats_lock:
+                self._process_pending -= 1
+            process_pool.release_segments(segments)
+
+        future.add_done_callback(on_done)
+        return asyncio.wrap_future(future)
+
+    def _invoke(self, method_name: str, args, kwargs) -> Any:
+        """按注册时的执行模式调用方法，返回结果，或需要等待的协程/Future"""
+        method = self.methods.get(method_name)
+        if not method:
+            raise Exception(f"方法 {method_name} 未找到")
+        options = self._method_options.get(method_name)
+        if options is not None and options.mode == 'thread':
+            if inspect.isgeneratorfunction(method):
+                # 创建生成器不会执行方法体，逐项取值时再交给线程池
+                return method(*args, **kwargs)
+            return self._run_in_thread(method, args, kwargs)
+        if options is not None and options.mode == 'process':
+            return self._run_in_process(options, args, kwargs)
+        return method(*args, **kwargs)
+
+    def _invoke_coalesced(self, method_name: str, args, kwargs,
+                          deadline: Optional[float] = None) -> Any:
+        """
+        调用方法，singleflight 方法在参数相同的调用执行期间共享同一个结果
+
+        共享的任务用 shield 包装，单个调用方超时不会取消其他调用方正在等待的任务；
+        所有调用方都离开后取消共享的任务。共享的任务最长执行 call_timeout，第一个调用方
+        给出的截止时间更晚时以截止时间为准，卡住的调用不会一直占用这个参数键。
+        """
+        options = self._method_options.get(method_name)
+        key = None
+        if options is not None and options.flight_key is not None:
+            key = options.flight_key(args, kwargs)
+        if key is None:
+            return self._invoke(method_name, args, kwargs)
+
+        flight_key = (method_name, key)
+        flight = self._flights.get(flight_key)
+        if flight is not None:
+            options.coalesced += 1
+            return self._join_flight(flight_key, flight)
+
+        result = self._invoke(method_name, args, kwargs)
+        if not inspect.isawaitable(result):
+            return result
+        timeout = self._call_timeout
+        if timeout is not None and deadline is not None:
+            timeout = max(timeout, deadline - time.time())
+        shared = asyncio.ensure_future(asyncio.wait_for(result, timeout))
+        flight = Flight(shared)
+        self._flights[flight_key] = flight
+        self._tasks.add(shared)
+
+        def on_done(future):
+            self._tasks.discard(future)
+            if self._flights.get(flight_key) is flight:
+                del self._flights[flight_key]
+            # 所有调用方都已超时离开时，避免未取出的异常告警
+            if not future.cancelled():
+                future.exception()
+
+        shared.add_done_callback(on_done)
+        return self._join_flight(flight_key, flight)
+
+    def _join_flight(self, flight_key: Tuple[str, Any], flight: Flight) -> asyncio.Future:
+        """返回等待共享任务的 Future，最后一个调用方离开时取消共享的任务"""
+        flight.waiters += 1
+        waiter = asyncio.shield(flight.task)
+
+        def on_leave(_):
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 取消要等到下一轮事件循环才生效，先移除，之后的调用重新执行方法
+                if self._flights.get(flight_key) is flight:
+                    del self._flights[flight_key]
+                flight.task.cancel()
+
+        waiter.add_done_callback(on_leave)
+        return waiter
+
+    def stats(self) -> Dict[str, Any]:
+        """服务器运行统计"""
+        with self._thread_stats_lock:
+            queued, running = self._thread_queued, self._thread_running
+            wait_seconds, started = self._thread_wait_seconds, self._thread_started
+            process_pending = self._process_pending
+        max_workers = getattr(self._executor, '_max_workers', self._max_workers)
+        return {
+            'connections': len(self.connections),
+            'tasks': len(self._tasks),
+            'thread_pool': {
+                'max_workers': max_workers,
+                'queued': queued,
+                'running': running,
+                'saturated': max_workers is not None and running >= max_workers,
+                'started': started,
+                'wait_seconds': wait_seconds,
+            },
+            'deadlines': {
+                'expired': self._expired,
+                'timed_out': self._timed_out,
+                'late': self._late,
+                'cancelled': self._cancelled,
+            },
+            'admission': {
+                'in_flight': self._in_flight,
+                'max_tasks': self._max_tasks,
+                'rejected': self._rejected,
+                'pauses': self._pauses,
+                'paused_seconds': self._paused_seconds,
+            },
+            'process_pool': {
+                'max_workers': getattr(self._process_executor, '_max_workers',
+                                       self._process_workers),
+                'pending': process_pending,
+            },
+            'compression': self.compression_stats.to_dict(),
+            'cache': {
+                name: options.cache.stats()
+                for name, options in self._method_options.items() if options.cache is not None
+            },
+            'singleflight': {
+                name: {
+                    'in_flight': sum(1 for flight in self._flights if flight[0] == name),
+                    'coalesced': options.coalesced,
+                }
+                for name, options in self._method_options.items() if options.flight_key is not None
+            },
+        }
+
     async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         connection = Connection(reader, writer)
         addr = connection.address_tuple
         self.connections[addr] = connection
         print(f"连接建立：{addr}")
-        
+
+        read_task: Optional[asyncio.Task] = None
+        paused_at: Optional[float] = None
         try:
             while True:
-                # 读取长度头部（4字节整数）
-                length_bytes = await asyncio.wait_for(reader.readexactly(4), timeout=30.0)  # 添加超时
-                length = int.from_bytes(length_bytes, byteorder='big')
-                
-                # 读取实际数据
-                data = await asyncio.wait_for(reader.readexactly(length), timeout=30.0)  # 添加超时
-                await self.on_data(connection, data)
-                
-
-                
+                limit = self._max_connection_tasks
+                # 有空闲额度时先执行暂存的调用
+                while connection.held and connection.in_flight < limit:
+                    await self.on_data(connection, connection.held.popleft())
+                if paused_at is not None and not connection.held:
+                    # 暂存的调用已经全部执行或被取消
+                    self._paused_seconds += time.perf_counter() - paused_at
+                    paused_at = None
+                if connection.held and len(connection.held) >= limit:
+                    # 暂存也满了才暂停读取，接收缓冲区填满后客户端的发送会被 TCP 流量控制阻塞
+                    await connection.wait_for_slot(limit)
+                    continue
+
+                if read_task is None:
+                    read_task = asyncio.create_task(self._read_frame(connection))
+                if connection.held:
+                    # 同时等待下一帧和空闲额度，额度先空出来时执行暂存的调用，读取继续进行
+                    slot = asyncio.create_task(connection.wait_for_slot(limit))
+                    try:
+                        await asyncio.wait((read_task, slot), return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        slot.cancel()
+                    if not read_task.done():
+                        continue
+                frame = await read_task
+                read_task = None
+                if frame is None:
+                    continue
+
+                if (limit is not None and frame.type in ('call', 'batch')
+                        and (connection.held or connection.in_flight >= limit)):
+                    # 达到连接上限时暂存调用，继续读取 cancel、credit 等控制帧，
+                    # 客户端仍然可以取消调用腾出额度，流式返回也能拿到额度继续发送
+                    if paused_at is None:
+                        self._pauses += 1
+                        paused_at = time.perf_counter()
+                    connection.held.append(frame)
+                    continue
+                await self.on_data(connection, frame)
+
         except asyncio.IncompleteReadError:
             # 连接关闭
             print(f"连接 {addr} 被客户端关闭")
@@ -81,7 +632,18 @@ class RPCServer:
         except Exception as e:
             print(f"处理连接 {addr} 异常: {e}")
         finally:
+            if read_task is not None:
+                read_task.cancel()
+            connection.held.clear()
+            # 连接已经断开，结果无法送达，取消仍在执行的任务
+            for task in list(connection.tasks.values()):
+                task.cancel()
+            for stream in connection.streams.values():
+                stream.close()
+            for upload in connection.uploads.values():
+                upload.fail(ConnectionError("连接已关闭"))
             try:
+                connection.frame_writer.flush()
                 writer.close()
                 try:
                     # 使用超时避免无限等待
@@ -92,159 +654,542 @@ class RPCServer:
                     print(f"关闭连接 {addr} 时出错: {e}")
             except Exception as e:
                 print(f"关闭写入器时出错 {addr}: {e}")
-                
+
             # 从连接列表中移除
             if addr in self.connections:
                 del self.connections[addr]
             print(f"连接关闭：{addr}")
 
+    async def _read_frame(self, connection: Connection) -> Optional[Frame]:
+        """读取并解码一帧，头部格式取决于协商出的分帧方式；被拒绝的帧返回 None"""
+        reader = connection.reader
+        try:
+            header, body = await asyncio.wait_for(
+                read_frame(reader, connection.framing, self._max_frame_size),
+                timeout=30.0)  # 添加超时
+        except FrameTooLarge as e:
+            # 丢弃过大的消息体，连接继续可用
+            await skip_body(reader, e.header[0])
+            await self._reject_frame(connection, e.header, e)
+            return None
+        try:
+            return connection.framing.decode(header, body)
+        except Exception as e:
+            await self._reject_frame(connection, header, e)
+            return None
+
     async def handle_call_buffer(self):
-        """处理调用缓冲区中的结果"""
+        """批量模式下处理调用缓冲区中的结果，空闲时挂起等待而不轮询"""
         while self._started:
             try:
-                async with self._call_buffer_lock:
-                    if not self._call_buffer:
-                        await asyncio.sleep(0.1)  # 增加sleep时间
-                        continue
-                        
-                    # 批量处理结果
-                    tasks = []
-                    for (timestamp,id,connection), result in self._call_buffer.items():
-                        response = {'type': 'return', 'timestamp': timestamp, 'id':id,'result': result}
-                        tasks.append(self.send_response(connection, response))
-                    
-                    # 并行发送响应
-                    await asyncio.gather(*tasks)
-                    self._call_buffer.clear()
-                    
+                await self._call_buffer_event.wait()
+                # 留出一个批量间隔收集更多结果
+                await asyncio.sleep(self._batch_interval)
+                self._call_buffer_event.clear()
+
+                # 换出缓冲区，发送期间新的结果写入新的缓冲区
+                buffer = self._call_buffer
+                self._call_buffer = {}
+
+                # 并行发送响应
+                tasks = [
+                    self.send_return(connection, request_id, result, error)
+                    for (connection, request_id), (result, error) in buffer.items()
+                ]
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 print(f"处理调用缓冲区时出错: {e}")
-                await asyncio.sleep(0.1)
-
-    async def _create_task(self, coro):
-        """创建受管理的任务"""
-        async with self._task_semaphore:
-            if len(self._tasks) >= self._max_tasks:
-                raise Exception("达到最大并发任务数限制")
-                
-            task = asyncio.create_task(coro)
-            self._tasks.add(task)
-            task.add_done_callback(self._tasks.discard)
-            return task
-
-    async def _compute_result(self, timestamp:float, id:str, connection:Connection, result):
-        """计算异步结果并存储到缓冲区"""
+
+    async def _create_task(self, coro, connection: Connection, request_id: RequestId,
+                           limited: bool = True):
+        """
+        创建受管理的任务，任务结束前一直计入服务器的在途调用数，并可以被 cancel 帧取消
+
+        limited 为 True 时同时计入该连接的在途调用数。流式返回和分块上传不计入，
+        它们需要继续读取 credit 和 chunk 帧，暂停读取会让它们互相等待。
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        self._in_flight += 1
+        connection.tasks[request_id] = task
+        if limited:
+            connection.in_flight += 1
+
+        def on_done(task):
+            self._tasks.discard(task)
+            self._in_flight -= 1
+            if connection.tasks.get(request_id) is task:
+                del connection.tasks[request_id]
+            if limited:
+                connection.release()
+
+        task.add_done_callback(on_done)
+        return task
+
+    async def _admit(self, connection: Connection, request_id: RequestId) -> bool:
+        """在途调用数达到服务器上限时直接返回 overloaded 错误，不执行方法"""
+        if self._max_tasks is None or self._in_flight < self._max_tasks:
+            return True
+        self._rejected += 1
+        await self.send_return(connection, request_id, error="服务端过载，请稍后重试",
+                               flags=FLAG_OVERLOADED)
+        return False
+
+    async def _await_result(self, coro,
+                            deadline: Optional[float] = None) -> Tuple[Any, Optional[str]]:
+        """
+        等待协程结果，返回 (结果, 错误信息)
+
+        有截止时间时等到截止时间为止，超时后取消任务。thread 和 process 模式的方法
+        已经开始执行时无法中断，只是不再等待它的结果。
+        """
+        timeout = self._call_timeout if deadline is None else deadline - time.time()
         try:
-            result = await asyncio.wait_for(result, timeout=30.0)
-            async with self._call_buffer_lock:
-                self._call_buffer[(timestamp, id, connection)] = result
+            return await asyncio.wait_for(coro, timeout=timeout), None
         except asyncio.TimeoutError:
-            async with self._call_buffer_lock:
-                self._call_buffer[(timestamp, id, connection)] = {"error": "方法执行超时"}
+            if deadline is not None:
+                self._timed_out += 1
+            return None, "方法执行超时"
+        except Exception as e:
+            return None, str(e)
+
+    @staticmethod
+    def _past(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.time() >= deadline
+
+    async def _compute_result(self, connection:Connection, request_id:RequestId, result,
+                              cache: Optional[ResultCache] = None, key: Any = None,
+                              deadline: Optional[float] = None, generation: int = 0):
+        """
+        等待异步结果并写回给调用方，方法带缓存时同时写入缓存，调用方已放弃等待时不发送
+
+        generation 是调用方法时缓存的失效代数，等待期间缓存被失效时结果可能已经过期，不写入缓存。
+        """
+        result, error = await self._await_result(result, deadline)
+
+        if cache is not None and error is None:
+            if cache.generation == generation:
+                entry = cache.put(key, result)
+            else:
+                cache = None
+        if self._past(deadline):
+            if error is None:
+                self._late += 1
+            return
+
+        if cache is not None and error is None:
+            if self._batch_interval is None:
+                try:
+                    await self._send_cached(connection, request_id, cache, entry)
+                except Exception as e:
+                    print(f"发送异步结果失败: {e}")
+                return
+
+        if self._batch_interval is not None:
+            self._call_buffer[(connection, request_id)] = (result, error)
+            self._call_buffer_event.set()
+            return
+
+        try:
+            await self.send_return(connection, request_id, result, error)
         except Exception as e:
-            async with self._call_buffer_lock:
-                self._call_buffer[(timestamp, id, connection)] = {"error": str(e)}
-    
-    async def on_data(self, connection: Connection, data: bytes) -> None:
-        """处理接收到的数据"""
+            print(f"发送异步结果失败: {e}")
+
+    async def on_data(self, connection: Connection, frame: Frame) -> None:
+        """处理接收到的一帧"""
+        msg_type = frame.type
+        request_id = frame.request_id
         try:
-            msg = json.loads(data.decode('utf-8'))
-            # print(msg)
-            if not utils.verify_msg(msg):
-                raise Exception('消息格式错误')
-                
-            msg_type = msg.get('type')
-
-            # print(msg)
-            
             if msg_type == 'call':
-                timestamp = msg.get('timestamp')
-                id:str = msg.get('id')
-                method_name = msg.get('method')
-                args = msg.get('args', [])
-                kwargs = msg.get('kwargs', {})
-                method = self.methods.get(method_name)
-                
-                if not method:
-                    error_response = {'type': 'return', 'timestamp': timestamp, 'id': id, 'error': f"方法 {method_name} 未找到"}
-                    await self.send_response(connection, error_response)
+                # 第四项是客户端给出的截止时间（Unix 时间戳），旧版客户端没有这一项
+                method_name, args, kwargs, *options = frame.payload
+                deadline = options[0] if options else None
+                if self._past(deadline):
+                    # 调用方已经不再等待，不执行也不回复
+                    self._expired += 1
                     return
-                    
                 try:
-                    # 处理同步和异步方法
-                    result = method(*args, **kwargs)
-                    
-                    if asyncio.iscoroutine(result):                                                                                                                                                                                       
+                    cache = self._cache_of(method_name)
+                    key = None
+                    if cache is not None:
+                        key = cache.make_key(args, kwargs)
+                        entry = cache.get(key) if key is not None else None
+                        if entry is not None:
+                            await self._send_cached(connection, request_id, cache, entry)
+                            return
+                        if key is None:
+                            cache = None
+                    if not await self._admit(connection, request_id):
+                        return
+
+                    generation = cache.generation if cache is not None else 0
+                    # 处理同步、异步以及放到线程池中执行的方法
+                    result = self._invoke_coalesced(method_name, args, kwargs, deadline)
+
+                    if _is_stream(result):
+                        await self._create_task(self._stream_result(
+                            connection, request_id, method_name, result), connection, request_id,
+                            limited=False)
+                    elif inspect.isawaitable(result):
                         # 使用任务管理创建异步任务
-                        await self._create_task(self._compute_result(timestamp, id, connection, result))
+                        await self._create_task(
+                            self._compute_result(connection, request_id, result, cache, key,
+                                                 deadline, generation),
+                            connection, request_id)
+                    elif cache is not None:
+                        await self._send_cached(connection, request_id, cache,
+                                                cache.put(key, result))
                     else:
-                        response = {'type': 'return', 'timestamp': timestamp, 'id': id, 'result': result}
-                        await self.send_response(connection, response)
-                        
+                        await self.send_return(connection, request_id, result)
+
                 except Exception as e:
-                    error_response = {'type': 'return', 'timestamp': timestamp, 'id': id, 'error': str(e)}
-                    await self.send_response(connection, error_response)
+                    await self.send_return(connection, request_id, error=str(e))
+            elif msg_type == 'batch':
+                deadline = _batch_deadline(frame.payload)
+                if self._past(deadline):
+                    self._expired += 1
+                elif await self._admit(connection, request_id):
+                    await self._handle_batch(connection, request_id, frame.payload, deadline)
+            elif msg_type == 'heartbeat':
+                # 紧凑格式下不解码消息体，直接回一个空的心跳帧
+                if connection.framing.compact:
+                    await connection.send(*connection.framing.encode('heartbeat', request_id))
+            elif msg_type == 'upload':
+                if await self._admit(connection, request_id):
+                    await self._start_upload(connection, request_id, frame.payload)
+            elif msg_type == 'chunk':
+                upload = connection.uploads.get(request_id)
+                if upload is not None:
+                    if frame.flags & FLAG_STREAM:
+                        upload.finish()
+                    else:
+                        upload.feed(frame.payload)
+            elif msg_type == 'cancel':
+                # 调用方已经放弃，取消任务，不再回复
+                task = connection.tasks.get(request_id)
+                if task is not None and not task.done():
+                    task.cancel()
+                    self._cancelled += 1
+                for held in connection.held:
+                    if held.request_id == request_id:
+                        # 还在暂存中的调用直接丢弃
+                        connection.held.remove(held)
+                        self._cancelled += 1
+                        break
+            elif msg_type == 'credit':
+                stream = connection.streams.get(request_id)
+                if stream is not None:
+                    stream.grant(frame.payload)
+            elif msg_type == 'negotiate':
+                await self._negotiate(connection, frame)
             else:
                 return
-                
+
+        except Exception as e:
+            await self.send_return(connection, request_id, error=str(e))
+
+    def _in_thread(self, method_name: str) -> bool:
+        options = self._method_options.get(method_name)
+        return options is not None and options.mode == 'thread'
+
+    async def _next_item(self, items, in_thread: bool) -> Any:
+        """取生成器的下一项，耗尽时返回 _STREAM_END"""
+        if inspect.isasyncgen(items):
+            try:
+                return await items.__anext__()
+            except StopAsyncIteration:
+                return _STREAM_END
+        if in_thread:
+            return await self._run_in_thread(next, (items, _STREAM_END), {})
+        return next(items, _STREAM_END)
+
+    async def _collect_stream(self, method_name: str, items) -> List:
+        """把生成器的全部结果收集成列表"""
+        in_thread = self._in_thread(method_name)
+        result = []
+        while True:
+            item = await self._next_item(items, in_thread)
+            if item is _STREAM_END:
+                return result
+            result.append(item)
+
+    async def _stream_result(self, connection: Connection, request_id: RequestId,
+                             method_name: str, items) -> None:
+        """
+        把生成器的结果逐项以 stream 帧发送，最后发送带 FLAG_STREAM 的 return 帧
+
+        每发送一项消耗一个额度，额度用完后等待客户端的 credit 帧，
+        生成器只在有额度时才继续取值，服务端和客户端缓存的项数都不超过 stream_window。
+        旧版格式的连接不支持流式返回，收集成列表后一次返回。
+        """
+        if not connection.framing.compact:
+            result, error = await self._await_result(self._collect_stream(method_name, items))
+            await self.send_return(connection, request_id, result, error)
+            return
+
+        in_thread = self._in_thread(method_name)
+        credit = StreamCredit(self._stream_window)
+        connection.streams[request_id] = credit
+        error = None
+        try:
+            while True:
+                await credit.acquire(timeout=30.0)
+                item = await self._next_item(items, in_thread)
+                if item is _STREAM_END:
+                    break
+                await connection.send(*connection.framing.encode('stream', request_id, item))
+        except asyncio.TimeoutError:
+            error = "等待客户端消费流式结果超时"
+        except Exception as e:
+            error = str(e)
+        finally:
+            connection.streams.pop(request_id, None)
+            try:
+                if inspect.isasyncgen(items):
+                    await items.aclose()
+                else:
+                    items.close()
+            except Exception as e:
+                print(f"关闭生成器 {method_name} 时出错: {e}")
+
+        try:
+            await self.send_return(connection, request_id, error=error, flags=FLAG_STREAM)
+        except Exception as e:
+            print(f"发送流式结果失败: {e}")
+
+    async def _start_upload(self, connection: Connection, request_id: RequestId,
+                            payload: List) -> None:
+        """开始一个分块上传：调用方法并把上传数据作为第一个参数，然后给客户端初始额度"""
+        method_name, args, kwargs = payload
+        method = self.methods.get(method_name)
+        if not method:
+            raise Exception(f"方法 {method_name} 未找到")
+        options = self._method_options.get(method_name)
+        mode = options.mode if options is not None else 'inline'
+        if mode == 'process' or (mode == 'inline' and not inspect.iscoroutinefunction(method)):
+            raise Exception(f"方法 {method_name} 不能接收分块上传，需要是异步方法或 thread 模式")
+        if (self._max_connection_uploads is not None
+                and len(connection.uploads) >= self._max_connection_uploads):
+            # 每个上传都会缓存最多一个窗口的数据块，限制数量才能限制单个连接占用的内存
+            self._rejected += 1
+            await self.send_return(connection, request_id, flags=FLAG_OVERLOADED,
+                                   error=f"连接同时进行的分块上传数已达上限 "
+                                         f"{self._max_connection_uploads}")
+            return
+
+        upload = UploadStream(connection, request_id, self._upload_window)
+        connection.uploads[request_id] = upload
+        try:
+            result = self._invoke(method_name, [upload, *args], kwargs)
+        except Exception:
+            connection.uploads.pop(request_id, None)
+            raise
+        await self._create_task(self._compute_upload(connection, request_id, upload, result),
+                                connection, request_id, limited=False)
+        await connection.send(*connection.framing.encode('credit', request_id, self._upload_window))
+
+    async def _compute_upload(self, connection: Connection, request_id: RequestId,
+                              upload: UploadStream, result) -> None:
+        """等待上传方法完成，上传的数据可能很大，不套用固定的执行超时"""
+        error = None
+        try:
+            result = await result
+        except Exception as e:
+            result, error = None, str(e)
+        finally:
+            connection.uploads.pop(request_id, None)
+        try:
+            await self.send_return(connection, request_id, result, error)
+        except Exception as e:
+            print(f"发送上传结果失败: {e}")
+
+    async def _handle_batch(self, connection: Connection, request_id: RequestId, calls: List,
+                            deadline: Optional[float] = None) -> None:
+        """分发批量调用中的每一项，全部完成后用一帧按顺序返回逐项结果"""
+        items: List[Optional[List]] = []
+        pending = []
+        for index, (method_name, args, kwargs, *_) in enumerate(calls):
+            cache = self._cache_of(method_name)
+            key = cache.make_key(args, kwargs) if cache is not None else None
+            if key is not None:
+                entry = cache.get(key)
+                if entry is not None:
+                    items.append([None, entry.value])
+                    continue
+            try:
+                result = self._invoke_coalesced(method_name, args, kwargs, deadline)
+            except Exception as e:
+                items.append([str(e), None])
+                continue
+            if _is_stream(result):
+                # 批量调用中的生成器方法收集成列表返回
+                result = self._collect_stream(method_name, result)
+            if key is not None:
+                if inspect.isawaitable(result):
+                    result = self._cache_result(cache, key, result, cache.generation)
+                else:
+                    cache.put(key, result)
+            if inspect.isawaitable(result):
+                pending.append((index, result))
+                items.append(None)
+            else:
+                items.append([None, result])
+
+        if pending:
+            await self._create_task(self._compute_batch(connection, request_id, items, pending,
+                                                        deadline), connection, request_id)
+        else:
+            await self.send_return(connection, request_id, items, flags=FLAG_BATCH)
+
+    async def _cache_result(self, cache: ResultCache, key: Any, result, generation: int) -> Any:
+        """等待异步结果并写入缓存，出错或等待期间缓存被失效的调用不缓存"""
+        result = await result
+        if cache.generation == generation:
+            cache.put(key, result)
+        return result
+
+    async def _compute_batch(self, connection: Connection, request_id: RequestId,
+                             items: List[Optional[List]], pending: List[Tuple[int, Any]],
+                             deadline: Optional[float] = None) -> None:
+        """等待批量调用中的异步项全部完成后写回"""
+        outcomes = await asyncio.gather(
+            *(self._await_result(coro, deadline) for _, coro in pending))
+        if self._past(deadline):
+            self._late += 1
+            return
+        for (index, _), (result, error) in zip(pending, outcomes):
+            items[index] = [error, result]
+        try:
+            await self.send_return(connection, request_id, items, flags=FLAG_BATCH)
+        except Exception as e:
+            print(f"发送批量结果失败: {e}")
+
+    async def _negotiate(self, connection: Connection, frame: Frame) -> None:
+        """用协商前的格式回复选定的编码和协议版本，之后切换到新格式"""
+        payload = frame.payload
+        codec = choose_codec(payload.get('codecs', []), self.codecs)
+        compact = payload.get('protocol', 1) >= PROTOCOL_VERSION
+        # 压缩只在紧凑格式下可用，旧版格式的帧头没有标志位
+        compressor = None
+        if compact:
+            compressor = choose_compressor(payload.get('compression', []), self.compression)
+        reply = {'codec': codec.name, 'protocol': PROTOCOL_VERSION if compact else 1,
+                 'compression': compressor.name if compressor is not None else None}
+        await connection.send(*connection.framing.encode('negotiate', frame.request_id, reply))
+        connection.framing = Framing(codec, compact, compressor, self._compress_threshold,
+                                     self.compression_stats, self._max_frame_size)
+
+    async def _reject_frame(self, connection: Connection, header: Tuple, error: Exception) -> None:
+        """无法解析的帧：紧凑格式按请求 ID 返回错误，旧版格式沿用无 ID 的错误消息"""
+        if connection.framing.compact:
+            await self.send_return(connection, header[3], error=str(error))
+        else:
+            await self.send_response(connection, {'error': str(error)})
+
+    async def send_return(self, connection: Connection, request_id: RequestId,
+                          result: Any = None, error: Optional[str] = None, flags: int = 0):
+        """向调用方发送返回结果或错误信息"""
+        framing = connection.framing
+        try:
+            if error is not None:
+                buffers = framing.encode('return', request_id, error, flags | FLAG_ERROR)
+            else:
+                buffers = framing.encode('return', request_id, result, flags)
         except Exception as e:
-            error_response = {'error': str(e)}
-            await self.send_response(connection, error_response)
-    
+            # 结果无法序列化时改为返回错误，避免调用方一直等到超时
+            buffers = framing.encode('return', request_id, f"结果序列化失败: {e}", FLAG_ERROR)
+        await connection.send(*buffers)
+
+    async def _send_cached(self, connection: Connection, request_id: RequestId,
+                           cache: ResultCache, entry: CacheEntry) -> None:
+        """发送缓存的结果，紧凑格式下复用编码好的消息体，只重新打包帧头"""
+        framing = connection.framing
+        if not framing.compact:
+            await self.send_return(connection, request_id, entry.value)
+            return
+        variant = framing.body_variant
+        cached = entry.bodies.get(variant)
+        if cached is None:
+            try:
+                flags, parts = framing.encode_body(entry.value)
+            except Exception:
+                # 无法序列化的结果不留在缓存中，由 send_return 返回错误
+                cache.discard(entry)
+                await self.send_return(connection, request_id, entry.value)
+                return
+            cached = (flags, b''.join(parts))
+            cache.add_body(entry, variant, *cached)
+        flags, body = cached
+        await connection.send(*framing.frame('return', request_id, flags, body))
+
     async def send_response(self, connection: Connection, response: Dict):
-        # 将响应转换为JSON并发送
-        json_data = json.dumps(response).encode('utf-8')
-        length = len(json_data)
+        # 按旧版格式直接发送一个完整的消息字典
+        data = connection.framing.codec.encode(response)
+        length = len(data)
         length_bytes = length.to_bytes(4, byteorder='big')
-        
+
         # 发送长度头部和数据
-        await connection.send(length_bytes + json_data)
-    
-    
-    
-    async def start(self):
-        """启动服务器（异步）"""
+        await connection.send(length_bytes, data)
+
+
+
+    async def start(self, sock: Optional[socket.socket] = None, reuse_port: bool = False):
+        """
+        启动服务器（异步）
+
+        参数:
+            sock: 使用已经在监听的 socket，而不是自行绑定 host:port
+            reuse_port: 绑定端口时设置 SO_REUSEPORT，允许多个进程监听同一端口
+        """
         if self._started:
             return
-        
+
         try:    
             self._loop = asyncio.get_running_loop()
             self._started = True
-            
-            self.server = await asyncio.start_server(
-                self.handle_connection, 
-                self.host, 
-                self.port,
-            )
-            
+
+            if sock is not None:
+                self.server = await asyncio.start_server(self.handle_connection, sock=sock)
+            else:
+                self.server = await asyncio.start_server(
+                    self.handle_connection,
+                    self.host,
+                    self.port,
+                    reuse_port=reuse_port or None,
+                )
+
             addr = self.server.sockets[0].getsockname()
             print(f'服务器启动在 {addr}')
 
-            # 启动异步任务 返回客户端的调用结果
-            buffer_task = asyncio.create_task(self.handle_call_buffer())
-            self._tasks.add(buffer_task)
-            buffer_task.add_done_callback(self._tasks.discard)
-            
+            # 批量模式下启动异步任务 返回客户端的调用结果
+            if self._batch_interval is not None:
+                buffer_task = asyncio.create_task(self.handle_call_buffer())
+                self._tasks.add(buffer_task)
+                buffer_task.add_done_callback(self._tasks.discard)
+
             async with self.server:
                 await self.server.serve_forever()
         except Exception as e:
             self._started = False
             print(f"启动服务器时出错: {e}")
             raise
-            
+
     async def shutdown(self):
         """优雅地关闭服务器"""
         print("正在关闭服务器...")
         if not self._started:
             return
-            
+
         # 关闭服务器
         if self.server:
             self.server.close()
             await self.server.wait_closed()
-            
+
         # 取消所有未完成的任务
-        for task in self._tasks:
+        for task in list(self._tasks):
             if not task.done():
                 task.cancel()
                 try:
@@ -253,7 +1198,7 @@ class RPCServer:
                     pass
                 except Exception as e:
                     print(f"取消任务时出错: {e}")
-            
+
         # 关闭所有客户端连接
         close_tasks = []
         for addr, conn in list(self.connections.items()):
@@ -262,14 +1207,39 @@ class RPCServer:
                 close_tasks.append(conn.writer.wait_closed())
             except Exception as e:
                 print(f"关闭连接 {addr} 时出错: {e}")
-                
+
         if close_tasks:
             await asyncio.gather(*close_tasks, return_exceptions=True)
-            
+
+        # 关闭自行创建的线程池，不等待仍在执行的同步方法
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._owns_process_executor and self._process_executor is not None:
+            self._process_executor.shutdown(wait=False, cancel_futures=True)
+            self._process_executor = None
+
         self._started = False
         print("服务器已关闭")
-    
-    def run(self):
-        """运行服务器（阻塞）"""
-        asyncio.run(self.start())
+
+    def run(self, workers: int = 1, stats_interval: float = 1.0):
+        """
+        运行服务器（阻塞）
+
+        参数:
+            workers: 工作进程数。大于 1 时 fork 出多个进程共同监听同一端口，
+                父进程负责重启崩溃的工作进程并汇总统计（见 worker_stats）
+            stats_interval: 多进程模式下工作进程上报统计的间隔（秒）
+        """
+        if workers <= 1:
+            asyncio.run(self.start())
+            return
+        self._supervisor = WorkerSupervisor(self, workers, stats_interval=stats_interval)
+        self._supervisor.run()
+
+    def worker_stats(self) -> Dict[str, Any]:
+        """多进程模式下各工作进程的统计及汇总，单进程模式下返回本进程的统计"""
+        if self._supervisor is None:
+            return {'workers': {0: self.stats()}, 'total': self.stats(), 'alive': 1}
+        return self._supervisor.worker_stats()
 
@@ -0,0 +1,206 @@
+"""
+多进程服务模块 - 让一个 RPCServer 在多个工作进程中同时运行
+
+父进程 fork 出 N 个工作进程，每个进程运行同一个 RPCServer（注册的方法随 fork 一起继承）。
+监听端口的共享方式:
+
+1. 系统支持 SO_REUSEPORT 时，每个工作进程各自以 reuse_port 绑定同一端口，由内核分配连接；
+2. 否则（或端口为 0 时）由父进程创建监听 socket，工作进程继承后共同 accept。
+
+父进程负责监督：工作进程异常退出后自动重启，并汇总各进程定期上报的运行统计。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from .compression import CompressionStats
+
+if TYPE_CHECKING:
+    from .server import RPCServer
+
+
+def combine_stats(stats_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把多个进程的统计按字段累加，嵌套字典逐层合并，非数值字段忽略"""
+    combined: Dict[str, Any] = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                combined[key] = combine_stats([combined.get(key, {}), value])
+            elif isinstance(value, (int, float)):
+                combined[key] = combined.get(key, 0) + value
+    return combined
+
+
+def _worker_main(server: 'RPCServer', index: int, sock: Optional[socket.socket],
+                 reuse_port: bool, stats_queue, stats_interval: float) -> None:
+    """工作进程入口"""
+
+    async def report_stats():
+        while True:
+            try:
+                stats_queue.put_nowait((index, os.getpid(), server.stats()))
+            except Exception as e:
+                print(f"上报工作进程统计失败: {e}")
+            await asyncio.sleep(stats_interval)
+
+    async def serve():
+        # 父进程用 SIGTERM 结束工作进程，这里转换为取消，让 shutdown 关闭进程池等资源
+        main_task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+        reporter = asyncio.create_task(report_stats())
+        try:
+            await server.start(sock=sock, reuse_port=reuse_port)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            reporter.cancel()
+            executors.append(server._process_executor)
+            await server.shutdown()
+
+    executors = []
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # multiprocessing 的子进程退出时不执行 atexit，需要自行等待进程池的子进程结束
+        for executor in executors:
+            if executor is not None and server._owns_process_executor:
+                executor.shutdown(wait=True)
+
+
+class WorkerSupervisor:
+    """在父进程中启动并监督工作进程"""
+
+    def __init__(self, server: 'RPCServer', workers: int, stats_interval: float = 1.0,
+                 restart_delay: float = 1.0):
+        if workers < 1:
+            raise ValueError("工作进程数必须大于 0")
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("当前平台不支持 fork，无法以多进程模式运行")
+        self.server = server
+        self.workers = workers
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+
+        self._context = multiprocessing.get_context('fork')
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._restarts: Dict[int, int] = {}
+        self._worker_stats: Dict[int, Dict[str, Any]] = {}
+        self._stats_queue = None
+        self._sock: Optional[socket.socket] = None
+        self._reuse_port = False
+        self._running = False
+
+    def _open_listener(self) -> None:
+        server = self.server
+        self._reuse_port = hasattr(socket, 'SO_REUSEPORT') and server.port != 0
+        if self._reuse_port:
+            return
+        # 不支持 SO_REUSEPORT 时由父进程监听，工作进程继承同一个 socket
+        self._sock = socket.create_server((server.host, server.port), reuse_port=False)
+        self._sock.setblocking(False)
+        print(f"父进程监听 {self._sock.getsockname()}，工作进程共享该 socket")
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.server, index, self._sock, self._reuse_port, self._stats_queue,
+                  self.stats_interval),
+            name=f'movan_rpc-worker-{index}',
+            # 守护进程不能创建子进程，process 模式的方法需要在工作进程中启动进程池；
+            # 退出时由 _stop_workers 负责结束工作进程
+            daemon=False,
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        print(f"工作进程 {index} 已启动 pid={process.pid}")
+
+    def _collect_stats(self, timeout: float) -> None:
+        try:
+            index, pid, stats = self._stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self._worker_stats[index] = dict(stats, pid=pid, restarts=self._restarts.get(index, 0))
+        # 把已经到达的统计一次取完
+        while True:
+            try:
+                index, pid, stats = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._worker_stats[index] = dict(stats, pid=pid, restarts=self._restarts.get(index, 0))
+
+    def _reap(self) -> None:
+        """重启异常退出的工作进程，短时间内连续崩溃时延迟重启"""
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            print(f"工作进程 {index} 退出 (exitcode={process.exitcode})，准备重启")
+            self._worker_stats.pop(index, None)
+            if time.monotonic() - self._started_at[index] < self.restart_delay:
+                time.sleep(self.restart_delay)
+            self._restarts[index] = self._restarts.get(index, 0) + 1
+            self._spawn(index)
+
+    def worker_stats(self) -> Dict[str, Any]:
+        """各工作进程最近一次上报的统计以及汇总结果"""
+        workers = dict(self._worker_stats)
+        total = combine_stats([
+            {key: value for key, value in stats.items() if key != 'pid'}
+            for stats in workers.values()
+        ])
+        # 压缩比不能累加，按汇总后的字节数重新计算
+        compression = total.get('compression')
+        if compression is not None:
+            compression['ratio'] = CompressionStats.ratio_of(
+                compression.get('raw_bytes', 0), compression.get('compressed_bytes', 0))
+        return {
+            'workers': workers,
+            'total': total,
+            'alive': sum(1 for process in self._processes.values() if process.is_alive()),
+        }
+
+    def run(self) -> None:
+        """启动工作进程并阻塞监督，直到收到 KeyboardInterrupt 或 stop()"""
+        self._open_listener()
+        self._stats_queue = self._context.Queue()
+        self._running = True
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            while self._running:
+                self._collect_stats(timeout=min(self.stats_interval, 0.5))
+                if self._running:
+                    self._reap()
+        except KeyboardInterrupt:
+            print("正在关闭工作进程...")
+        finally:
+            self._running = False
+            self._stop_workers()
+
+    def stop(self) -> None:
+        self._running = False
+
+    def _stop_workers(self) -> None:
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self._processes.clear()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        print("所有工作进程已关闭")
@@ -1,10 +1,10 @@
-from typing import Dict
+from typing import Any, Dict, Iterable, List, Sequence
 
 
 def verify_msg(msg:Dict)->bool:
     proto = msg.get('type')
     
-    if proto not in ['call', 'return','heartbeat']:
+    if proto not in ['call', 'return', 'heartbeat', 'negotiate', 'batch', 'cancel']:
         return False
 
     timestamp = msg.get('timestamp')
@@ -15,4 +15,17 @@ def verify_msg(msg:Dict)->bool:
     if not isinstance(id,str):
         return False
 
-    return True
\ No newline at end of file
+    return True
+
+
+def normalize_calls(calls: Iterable[Sequence[Any]]) -> List[List[Any]]:
+    """把 [(method, args, kwargs), ...] 规范为 [[method, args, kwargs], ...]，args/kwargs 可省略"""
+    normalized = []
+    for call in calls:
+        if isinstance(call, str):
+            call = (call,)
+        method = call[0]
+        args = call[1] if len(call) > 1 and call[1] is not None else []
+        kwargs = call[2] if len(call) > 2 and call[2] is not None else {}
+        normalized.append([method, args, kwargs])
+    return normalized
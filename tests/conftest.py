@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from movan_rpc import RPCClient
+
+
+@pytest.fixture
+def rpc_server():
+    """返回异步上下文管理器：在当前事件循环中启动服务器并产出端口，退出时关闭服务器"""
+
+    @contextlib.asynccontextmanager
+    async def serve(server):
+        serve_task = asyncio.create_task(server.start())
+        try:
+            while server.server is None:
+                if serve_task.done():
+                    # 启动失败时抛出原来的异常，而不是一直等待
+                    serve_task.result()
+                await asyncio.sleep(0.01)
+            yield server.server.sockets[0].getsockname()[1]
+        finally:
+            await server.shutdown()
+            serve_task.cancel()
+            await asyncio.gather(serve_task, return_exceptions=True)
+
+    return serve
+
+
+@pytest.fixture
+def rpc_client(rpc_server):
+    """在 rpc_server 的基础上连接一个 RPCClient 并产出它，client_kwargs 传给 RPCClient"""
+
+    @contextlib.asynccontextmanager
+    async def connect(server, **client_kwargs):
+        async with rpc_server(server) as port:
+            client = RPCClient('127.0.0.1', port, **client_kwargs)
+            await client.start_async()
+            try:
+                yield client
+            finally:
+                await client.close()
+
+    return connect
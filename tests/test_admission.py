@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from movan_rpc import OverloadedError, RPCServer
+from movan_rpc import protocol
+
+
+def test_global_limit_rejects_with_overloaded_error(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, max_tasks=2)
+
+        @server.method
+        async def slow():
+            await asyncio.sleep(0.2)
+            return 'done'
+
+        async with rpc_client(server) as client:
+            results = await asyncio.gather(*(client.call('slow') for _ in range(5)),
+                                           return_exceptions=True)
+            assert results.count('done') == 2
+            assert sum(isinstance(result, OverloadedError) for result in results) == 3
+            assert server.stats()['admission']['rejected'] == 3
+            # 任务结束后额度释放
+            assert await client.call('slow') == 'done'
+            assert server.stats()['admission']['in_flight'] == 0
+
+    asyncio.run(run())
+
+
+def test_connection_limit_pauses_reading(rpc_client):
+    running = []
+    peak = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, max_tasks=None, max_connection_tasks=2)
+
+        @server.method
+        async def work(index):
+            running.append(index)
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(index)
+            return index
+
+        async with rpc_client(server) as client:
+            results = await asyncio.gather(*(client.call('work', [i]) for i in range(8)))
+            assert results == list(range(8))
+            assert max(peak) == 2
+            stats = server.stats()['admission']
+            assert stats['pauses'] >= 1 and stats['paused_seconds'] > 0
+
+    asyncio.run(run())
+
+
+
+def test_control_frames_are_read_while_connection_is_full(rpc_client):
+    events = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, max_tasks=None, max_connection_tasks=3,
+                           stream_window=2)
+
+        @server.method
+        async def slow(tag):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                events.append(('cancelled', tag))
+                raise
+
+        @server.method
+        def fast(tag):
+            events.append(('fast', tag))
+            return tag
+
+        @server.method
+        def count(n):
+            yield from range(n)
+
+        async with rpc_client(server) as client:
+            stream = client.stream('count', [10])
+            assert await stream.__anext__() == 0
+
+            first = asyncio.create_task(client.call('slow', ['first']))
+            others = [asyncio.create_task(client.call('slow', [i])) for i in range(2)]
+            await asyncio.sleep(0.05)
+            held = asyncio.create_task(client.call('fast', ['held']))
+            dropped = asyncio.create_task(client.call('fast', ['dropped']))
+            await asyncio.sleep(0.05)
+            assert not held.done() and events == []
+
+            # 连接已满时 credit 帧仍然被读取，流式返回继续发送
+            assert [item async for item in stream] == list(range(1, 10))
+
+            # 取消暂存的调用直接丢弃，取消执行中的调用腾出额度，暂存的调用随后执行
+            dropped.cancel()
+            await asyncio.sleep(0.05)
+            first.cancel()
+            assert await asyncio.wait_for(held, 1.0) == 'held'
+            assert ('cancelled', 'first') in events
+            assert ('fast', 'dropped') not in events
+            stats = server.stats()
+            assert stats['deadlines']['cancelled'] == 2
+            assert stats['admission']['pauses'] >= 1
+
+            for task in others:
+                task.cancel()
+            await asyncio.gather(first, *others, dropped, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_overloaded_flag_roundtrip(compact):
+    framing = protocol.Framing(compact=compact)
+    request_id = framing.new_request_id()
+    data = b''.join(framing.encode('return', request_id, 'busy',
+                                   protocol.FLAG_ERROR | protocol.FLAG_OVERLOADED))
+    header = framing.parse_header(data[:framing.header_size])
+    frame = framing.decode(header, data[framing.header_size:])
+    assert isinstance(protocol.error_from_frame(frame), OverloadedError)
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import pytest
+
+from movan_rpc import RPCServer
+
+
+def test_batched_results_are_flushed_to_their_callers(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, batch_interval=0.05)
+
+        @server.method
+        async def delayed(index, delay):
+            await asyncio.sleep(delay)
+            if index == 7:
+                raise ValueError('boom')
+            return index * 10
+
+        async with rpc_client(server) as client:
+            start = time.perf_counter()
+            # 完成顺序与发起顺序相反，结果仍然对应各自的请求
+            calls = [client.call('delayed', [i, 0.002 * (20 - i)]) for i in range(20)]
+            results = await asyncio.gather(*calls, return_exceptions=True)
+            assert time.perf_counter() - start >= 0.05
+            for index, result in enumerate(results):
+                if index == 7:
+                    assert 'boom' in str(result)
+                else:
+                    assert result == index * 10
+            assert server._call_buffer == {}
+
+            # 空闲之后的结果同样会被发送，不需要新的调用触发
+            await asyncio.sleep(0.2)
+            assert await client.call('delayed', [1, 0]) == 10
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('batch_interval', [None, 0.02])
+def test_batch_interval_keeps_results_in_request_order(rpc_client, batch_interval):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, batch_interval=batch_interval)
+
+        @server.method
+        async def echo(value):
+            await asyncio.sleep(0)
+            return value
+
+        async with rpc_client(server) as client:
+            values = list(range(200))
+            assert await asyncio.gather(*(client.call('echo', [v]) for v in values)) == values
+
+    asyncio.run(run())
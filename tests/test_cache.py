@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+from movan_rpc import RPCServer, ResultCache
+
+
+def test_cache_keys_follow_signature():
+    cache = ResultCache()
+    cache.bind(lambda x, y=2: None)
+    assert cache.make_key([1], {}) == cache.make_key([], {'x': 1, 'y': 2})
+    assert cache.make_key([1], {}) != cache.make_key([1.0], {})
+    assert cache.make_key([[1, 2]], {}) != cache.make_key([(1, 2)], {})
+    assert cache.make_key([{'b': 1, 'a': 2}], {}) == cache.make_key([{'a': 2, 'b': 1}], {})
+    # 参数无法绑定时不使用缓存
+    assert cache.make_key([1, 2, 3], {}) is None
+
+
+def test_cache_eviction_and_invalidation():
+    cache = ResultCache(max_entries=2, max_bytes=10)
+    cache.bind(lambda room, player: None)
+    keys = [cache.make_key(params, {}) for params in (['a', 1], ['a', 2], ['b', 1])]
+    cache.put(keys[0], 'x')
+    cache.put(keys[1], 'y')
+    assert cache.get(keys[0]).value == 'x'
+    # 最近最少使用的条目先被淘汰
+    cache.put(keys[2], 'z')
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+
+    cache.add_body(cache.get(keys[0]), ('binary', None), 0, b'0123456789')
+    cache.add_body(cache.get(keys[2]), ('binary', None), 0, b'0')
+    assert cache.get(keys[0]) is None
+    assert cache.stats()['bytes'] == 1
+
+    cache.put(keys[0], 'x')
+    assert cache.invalidate(['a']) == 1
+    assert cache.get(keys[2]) is not None
+    assert cache.invalidate() == 1
+    assert cache.stats()['entries'] == 0
+
+    expiring = ResultCache(ttl=0.01)
+    expiring.put(('k',), 1)
+    time.sleep(0.02)
+    assert expiring.get(('k',)) is None
+    assert expiring.stats()['expirations'] == 1
+
+
+def test_server_result_cache(rpc_client):
+    calls = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method(cache=ResultCache(ttl=60))
+        def lookup(key, scale=1):
+            calls.append(key)
+            return {'key': key, 'value': [key] * 100 * scale}
+
+        @server.method(cache=True)
+        async def lookup_async(key):
+            calls.append(key)
+            return key * 2
+
+        async with rpc_client(server) as client:
+            first = await client.call('lookup', ['a'])
+            assert await client.call('lookup', [], {'key': 'a', 'scale': 1}) == first
+            assert await client.call('lookup_async', [3]) == 6
+            assert await client.call('lookup_async', [3]) == 6
+            assert await client.call_many([('lookup', ['a']), ('lookup_async', [3])]) == [first, 6]
+            assert calls == ['a', 3]
+
+            stats = server.stats()['cache']['lookup']
+            assert stats['hits'] == 2 and stats['entries'] == 1 and stats['bytes'] > 0
+
+            assert server.invalidate_cache('lookup', 'a') == 1
+            assert await client.call('lookup', ['a']) == first
+            assert calls == ['a', 3, 'a']
+            assert server.invalidate_cache() == 2
+
+    asyncio.run(run())
+
+
+def test_client_stub_cache_invalidated_by_server(rpc_client):
+    calls = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+        config = {'a': 1, 'b': 2}
+
+        def load_config(section, field='value'):
+            calls.append(section)
+            return config[section]
+
+        # 客户端存根按函数名调用，服务端的实现换个名字注册，避免同名函数互相覆盖
+        server.register_method('get_config', load_config)
+
+        @server.method(mode='thread')
+        def set_config(section, value):
+            config[section] = value
+            server.invalidate_cache('get_config', section)
+
+        async with rpc_client(server) as client:
+            @client.server_method_stub(cache=True)
+            async def get_config(section, field='value'):
+                pass
+
+            assert await get_config('a') == 1
+            assert await get_config('a', field='value') == 1
+            assert await get_config('b') == 2
+            assert calls == ['a', 'b']
+
+            await client.call('set_config', ['a', 10])
+            await asyncio.sleep(0.05)
+            assert await get_config('a') == 10
+            assert await get_config('b') == 2
+            assert calls == ['a', 'b', 'a']
+
+    asyncio.run(run())
+
+
+def test_result_computed_before_invalidation_is_not_cached(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+        config = {'a': 1}
+        started = asyncio.Event()
+
+        @server.method(cache=ResultCache(ttl=60))
+        async def read(section):
+            value = config[section]
+            started.set()
+            await asyncio.sleep(0.1)
+            return value
+
+        async with rpc_client(server) as client:
+            for call in (lambda: client.call('read', ['a']),
+                         lambda: client.call_many([('read', ['a'])])):
+                started.clear()
+                pending = asyncio.ensure_future(call())
+                await started.wait()
+                # 方法已经读到旧值，执行期间数据被修改并失效缓存
+                config['a'] += 1
+                server.invalidate_cache('read')
+                await pending
+                assert await client.call('read', ['a']) == config['a']
+                server.invalidate_cache('read')
+
+    asyncio.run(run())
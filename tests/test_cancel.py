@@ -0,0 +1,59 @@
+import asyncio
+
+from movan_rpc import RPCClientThreading, RPCServer
+
+
+def test_cancel_messages_stop_server_work(rpc_client):
+    events = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        async def slow(tag):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                events.append(('cancelled', tag))
+                raise
+
+        @server.method
+        async def ticks():
+            try:
+                index = 0
+                while True:
+                    yield index
+                    index += 1
+            finally:
+                events.append(('closed', 'ticks'))
+
+        async with rpc_client(server) as client:
+            task = asyncio.create_task(client.call('slow', ['async']))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.sleep(0.05)
+            assert ('cancelled', 'async') in events
+
+            stream = client.stream('ticks')
+            async for index in stream:
+                if index == 2:
+                    break
+            await stream.aclose()
+            await asyncio.sleep(0.05)
+            assert ('closed', 'ticks') in events
+
+            def threading_client():
+                sync_client = RPCClientThreading('127.0.0.1', client.port)
+                sync_client.connect()
+                try:
+                    call_id = sync_client.call('slow', lambda result: None, ['thread'])
+                    sync_client.unbind_call_back(call_id)
+                finally:
+                    sync_client.close()
+
+            await asyncio.to_thread(threading_client)
+            await asyncio.sleep(0.1)
+            assert ('cancelled', 'thread') in events
+            assert server.stats()['deadlines']['cancelled'] == 3
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from movan_rpc import RPCServer, protocol
+
+
+def test_calls_resolve_through_futures(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        def add(a, b):
+            return a + b
+
+        @server.method
+        async def fail():
+            raise ValueError('boom')
+
+        async with rpc_client(server) as client:
+            # 结果由读取循环直接设置，不受轮询间隔限制
+            start = time.perf_counter()
+            for i in range(20):
+                assert await client.call('add', [i, 1]) == i + 1
+            assert time.perf_counter() - start < 1.0
+
+            results = await asyncio.gather(*(client.call('add', [i, i]) for i in range(50)))
+            assert results == [i * 2 for i in range(50)]
+            with pytest.raises(Exception, match='boom'):
+                await client.call('fail')
+            assert client.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_late_results_are_dropped(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method(mode='thread')
+        def slow(value):
+            time.sleep(0.2)
+            return value
+
+        async with rpc_client(server) as client:
+            late = []
+            handle_data = client._handle_data
+
+            def record(header, body):
+                handle_data(header, body)
+                if header[1] == protocol.FRAME_TYPES['return']:
+                    late.append(header[3])
+
+            client._handle_data = record
+            # 不带截止时间发送，服务端照常算完并返回结果
+            with pytest.raises(TimeoutError):
+                await client._request('call', ['slow', ['late'], {}], 0.05, 'slow')
+            assert client.in_flight == 0
+
+            await asyncio.sleep(0.3)
+            assert late, "服务端的结果应该在超时之后到达"
+            assert client.in_flight == 0
+            assert await client.call('slow', ['next']) == 'next'
+
+    asyncio.run(run())
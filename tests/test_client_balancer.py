@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from movan_rpc import RPCServer
+from movan_rpc.client_balancer import RPCClientBalancer
+
+
+class FakeClient:
+    def __init__(self, connected=True, in_flight=0, error=None):
+        self.connected = connected
+        self.in_flight = in_flight
+        self.error = error
+        self.calls = 0
+
+    async def call(self, method, params=None, kwargs=None, timeout=5.0):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return method
+
+
+def make_balancer(clients, **kwargs):
+    balancer = RPCClientBalancer([('127.0.0.1', port) for port in range(len(clients))], **kwargs)
+    for endpoint, client in zip(balancer.endpoints, clients):
+        endpoint.client = client
+        endpoint.healthy = True
+    return balancer
+
+
+def test_pick_prefers_lower_cost():
+    fast, slow = FakeClient(in_flight=0), FakeClient(in_flight=0)
+    balancer = make_balancer([fast, slow])
+    balancer.endpoints[0].latency = 0.01
+    balancer.endpoints[1].latency = 0.5
+    assert all(balancer._pick().client is fast for _ in range(20))
+
+    # 在途请求多到一定程度时改选慢的服务端
+    fast.in_flight = 100
+    assert balancer._pick().client is slow
+
+    balancer.endpoints[1].healthy = False
+    fast.connected = False
+    assert balancer._pick() is None
+
+
+def test_eject_and_retry():
+    broken, good = FakeClient(error=ConnectionError("断开")), FakeClient()
+    balancer = make_balancer([broken, good])
+    balancer.endpoints[1].latency = 1.0  # 让第一次优先选中坏的服务端
+    assert asyncio.run(balancer.call('echo')) == 'echo'
+    assert broken.calls == 1 and not balancer.endpoints[0].healthy
+    assert balancer.endpoints[1].latency < 1.0
+
+    slow = FakeClient(error=TimeoutError("超时"))
+    balancer = make_balancer([slow], failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            asyncio.run(balancer.call('echo'))
+    assert not balancer.endpoints[0].healthy
+    with pytest.raises(ConnectionError):
+        asyncio.run(balancer.call('echo'))
+
+
+def _named_server(name, port=0):
+    server = RPCServer('127.0.0.1', port)
+
+    @server.method
+    async def whoami():
+        await asyncio.sleep(0.02)
+        return name
+
+    return server
+
+
+async def _wait_until(predicate, attempts=100):
+    for _ in range(attempts):
+        if predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return predicate()
+
+
+def test_endpoint_is_ejected_and_readmitted_against_servers(rpc_server):
+    async def run():
+        async with rpc_server(_named_server('a')) as port_a:
+            balancer = None
+            try:
+                async with rpc_server(_named_server('b')) as port_b:
+                    balancer = RPCClientBalancer([('127.0.0.1', port_a), ('127.0.0.1', port_b)],
+                                                 probe_interval=0.1, probe_timeout=0.5)
+                    assert await balancer.start_async()
+                    names = await asyncio.gather(*(balancer.call('whoami') for _ in range(20)))
+                    assert set(names) == {'a', 'b'}
+
+                # b 停止后由后台任务摘除，调用全部发给 a
+                endpoint_b = balancer.endpoints[1]
+                old_client = endpoint_b.client
+                assert await _wait_until(lambda: not endpoint_b.healthy)
+                assert set(await asyncio.gather(
+                    *(balancer.call('whoami') for _ in range(10)))) == {'a'}
+
+                # 在同一端口重新启动 b：后台探测重新连接，恢复后重新加入并收到调用
+                async with rpc_server(_named_server('b', port_b)):
+                    assert await _wait_until(lambda: balancer.stats()[1]['healthy'])
+                    assert endpoint_b.client is not old_client
+                    names = await asyncio.gather(*(balancer.call('whoami') for _ in range(20)))
+                    assert 'b' in names
+            finally:
+                if balancer is not None:
+                    await balancer.close()
+
+    asyncio.run(run())
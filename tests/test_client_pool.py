@@ -0,0 +1,64 @@
+import asyncio
+
+from movan_rpc import RPCServer
+from movan_rpc.client_pool import RPCClientPool
+
+
+class FakeClient:
+    def __init__(self, connected, in_flight):
+        self.connected = connected
+        self.in_flight = in_flight
+
+
+def test_pick_least_outstanding():
+    pool = RPCClientPool('127.0.0.1', 0, size=3)
+    pool.clients = [FakeClient(True, 3), FakeClient(False, 0), FakeClient(True, 1)]
+    assert pool._pick() is pool.clients[2]
+
+    pool.clients = [FakeClient(False, 0), FakeClient(False, 0)]
+    assert pool._pick() is None
+
+    # 在途请求数相同时轮流选择
+    pool.clients = [FakeClient(True, 0), FakeClient(True, 0)]
+    picked = {id(pool._pick()) for _ in range(4)}
+    assert len(picked) == 2
+
+
+def test_pool_retries_and_reconnects_against_a_server(rpc_server):
+    calls = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        async def slow(tag):
+            calls.append(tag)
+            await asyncio.sleep(0.2)
+            return tag
+
+        async with rpc_server(server) as port:
+            pool = RPCClientPool('127.0.0.1', port, size=2, reconnect_interval=0.1)
+            assert await pool.start_async()
+            try:
+                results = await asyncio.gather(*(pool.call('slow', [i]) for i in range(4)))
+                assert results == [0, 1, 2, 3]
+                assert [state['connected'] for state in pool.stats()] == [True, True]
+
+                # 服务端断开全部连接：进行中的调用换一条重新建立的连接重试
+                task = asyncio.create_task(pool.call('slow', ['retry']))
+                await asyncio.sleep(0.05)
+                for connection in list(server.connections.values()):
+                    connection.writer.close()
+                assert await task == 'retry'
+                assert calls.count('retry') == 2
+
+                for _ in range(50):
+                    if all(state['connected'] for state in pool.stats()):
+                        break
+                    await asyncio.sleep(0.05)
+                assert [state['connected'] for state in pool.stats()] == [True, True]
+                assert await pool.call_many([('slow', ['a']), ('slow', ['b'])]) == ['a', 'b']
+            finally:
+                await pool.close()
+
+    asyncio.run(run())
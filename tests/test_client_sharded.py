@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from movan_rpc.client_sharded import HashRing, RPCClientSharded
+
+
+def test_hash_ring_moves_about_one_nth_of_keys():
+    nodes = [('10.0.0.%d' % index, 9999) for index in range(4)]
+    ring = HashRing(nodes)
+    keys = [f'player-{index}' for index in range(20000)]
+    before = {key: ring.get_node(key) for key in keys}
+
+    # 分布大致均匀
+    counts = {node: 0 for node in nodes}
+    for node in before.values():
+        counts[node] += 1
+    assert min(counts.values()) > len(keys) / 4 * 0.7
+
+    # 加入第 5 个节点：约 1/5 的键移动，且只移动到新节点
+    new_node = ('10.0.0.4', 9999)
+    ring.add_node(new_node)
+    moved = [key for key in keys if ring.get_node(key) != before[key]]
+    assert 0.12 < len(moved) / len(keys) < 0.28
+    assert all(ring.get_node(key) == new_node for key in moved)
+
+    # 移除一个节点：只有原来属于它的键移动
+    ring.remove_node(nodes[0])
+    after_remove = {key: ring.get_node(key) for key in keys}
+    for key in keys:
+        if before[key] != nodes[0] and after_remove[key] != new_node:
+            assert after_remove[key] == before[key]
+
+    with pytest.raises(LookupError):
+        HashRing().get_node('x')
+
+
+class FakeClient:
+    def __init__(self, node):
+        self.node = node
+        self.connected = True
+
+    async def call(self, method, params=None, kwargs=None, timeout=5.0):
+        return self.node, method, list(params), kwargs
+
+
+def test_stub_routes_by_key():
+    client = RPCClientSharded([('127.0.0.1', 1), ('127.0.0.1', 2), ('127.0.0.1', 3)])
+    for node in client.clients:
+        client.clients[node] = FakeClient(node)
+
+    @client.server_method_stub(key='room')
+    async def join(player, room, seat=0):
+        pass
+
+    async def run():
+        results = [await join(f'p{index}', 'room-7', seat=index) for index in range(5)]
+        results.append(await join('p9', room='room-7'))
+        return results
+
+    results = asyncio.run(run())
+    assert {node for node, _, _, _ in results} == {client.node_for('room-7')}
+    assert results[0][1:] == ('join', ['p0', 'room-7'], {'seat': 0})
+
+    with pytest.raises(ValueError):
+        client.server_method_stub(key='missing')(join)
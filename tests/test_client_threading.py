@@ -0,0 +1,157 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from movan_rpc import RPCClientThreading, RPCServer, protocol
+from movan_rpc.codec import BINARY_CODEC
+
+
+def test_call_sync_and_futures(rpc_server):
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        async def add(a, b):
+            await asyncio.sleep(0.01)
+            return a + b
+
+        @server.method
+        async def slow():
+            await asyncio.sleep(5)
+
+        @server.method
+        def fail():
+            raise ValueError('bad')
+
+        @server.method
+        async def count(n):
+            for index in range(n):
+                yield index
+
+
+        def threading_client():
+            client = RPCClientThreading('127.0.0.1', port)
+            client.on_connect = lambda: None
+            assert client.start_sync()
+            try:
+                # 多个线程通过同一个连接并行调用，不需要 on_tick
+                with ThreadPoolExecutor(8) as pool:
+                    results = list(pool.map(lambda i: client.call_sync('add', [i, i]), range(32)))
+                assert results == [i * 2 for i in range(32)]
+
+                future = client.call_async('add', [1], {'b': 2})
+                assert future.result(timeout=5) == 3
+
+                @client.server_method_stub
+                def add(a, b):
+                    pass
+                assert add(3, 4) == 7
+
+                assert client.call_sync('count', [5]) == [0, 1, 2, 3, 4]
+
+                with pytest.raises(Exception, match='bad'):
+                    client.call_sync('fail')
+
+                with pytest.raises(TimeoutError):
+                    client.call_sync('slow', timeout=0.1)
+                assert not client._futures
+
+                pending = client.call_async('slow')
+            finally:
+                client.close()
+            # 关闭连接时等待中的调用以 ConnectionError 结束
+            with pytest.raises(ConnectionError):
+                pending.result(timeout=1)
+
+        async with rpc_server(server) as port:
+            await asyncio.to_thread(threading_client)
+
+    asyncio.run(run())
+
+
+def test_on_tick_callbacks_can_call_again(rpc_server):
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        def add(a, b):
+            return a + b
+
+
+        def threading_client():
+            client = RPCClientThreading('127.0.0.1', port)
+            client.on_connect = lambda: None
+            assert client.start_sync()
+            results = []
+            try:
+                # 回调中阻塞调用不会因为 on_tick 持有锁而死锁
+                def on_result(result):
+                    results.append(client.call_sync('add', [result, 1]))
+
+                client.call('add', on_result, [1, 2])
+                for _ in range(100):
+                    client.on_tick()
+                    if results:
+                        break
+                    time.sleep(0.01)
+                assert results == [4]
+            finally:
+                client.close()
+
+        async with rpc_server(server) as port:
+            await asyncio.to_thread(threading_client)
+
+    asyncio.run(run())
+
+
+def test_request_ids_are_unique_across_threads():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    with ThreadPoolExecutor(8) as pool:
+        ids = list(pool.map(lambda _: framing.new_request_id(), range(20000)))
+    assert len(set(ids)) == len(ids)
+    assert 0 not in ids
+
+
+def test_stream_callbacks_run_outside_the_lock(rpc_server):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, stream_window=2)
+
+        @server.method
+        def count(n):
+            yield from range(n)
+
+        def threading_client():
+            client = RPCClientThreading('127.0.0.1', port)
+            client.on_connect = lambda: None
+            assert client.start_sync()
+            chunks = []
+            done = []
+
+            def on_chunk(item):
+                chunks.append(item)
+                if item == 0:
+                    # 回调中可以再发起流式调用和阻塞调用
+                    client.stream('count', lambda nested: chunks.append(('nested', nested)),
+                                  done.append, [2])
+                    chunks.append(('sync', client.call_sync('count', [3])))
+
+            try:
+                client.stream('count', on_chunk, done.append, [5])
+                for _ in range(300):
+                    client.on_tick()
+                    if len(done) == 2:
+                        break
+                    time.sleep(0.01)
+                assert done == [None, None]
+                assert [item for item in chunks if isinstance(item, int)] == [0, 1, 2, 3, 4]
+                assert ('sync', [0, 1, 2]) in chunks
+                assert ('nested', 1) in chunks
+            finally:
+                client.close()
+
+        async with rpc_server(server) as port:
+            await asyncio.to_thread(threading_client)
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from movan_rpc import codec
+
+
+def test_binary_codec_roundtrip():
+    values = [
+        None, True, False, 0, 1, 127, 128, -1, -32, -33, -129, 2 ** 31, -2 ** 63, 2 ** 64 - 1,
+        1.5, -0.25, '', 'hello', '中文' * 100, 'x' * 70000,
+        b'', b'\x00\xff' * 200, [], [1, [2, [3]]], list(range(20)), (1, 'a', (2,)),
+        {}, {'a': 1, 2: 'b'}, {str(i): i for i in range(20)},
+    ]
+    binary = codec.BinaryCodec()
+    for value in values:
+        assert binary.decode(binary.encode(value)) == value
+
+    # tuple 与 bytes 原样保留类型
+    assert type(binary.decode(binary.encode((1, 2)))) is tuple
+    assert type(binary.decode(binary.encode(bytearray(b'ab')))) is bytes
+
+
+def test_binary_codec_rejects_unknown():
+    binary = codec.BinaryCodec()
+    with pytest.raises(TypeError):
+        binary.encode(object())
+    with pytest.raises(OverflowError):
+        binary.encode(2 ** 70)
+    with pytest.raises(ValueError):
+        binary.decode(binary.encode(1) + b'\x00')
+
+
+def test_choose_codec():
+    assert codec.choose_codec(['binary', 'json']).name == 'binary'
+    assert codec.choose_codec(['binary', 'json'], ['json']).name == 'json'
+    assert codec.choose_codec(['unknown']).name == 'json'
+    assert codec.choose_codec([]) is codec.DEFAULT_CODEC
+
+
+def test_attachments_roundtrip():
+    blob = bytearray(b'\x00\x01\x02' * 100)
+    message = ['upload', [b'raw', memoryview(blob)], {'name': 'a', 'extra': bytearray(b'x')}]
+    for c in (codec.BINARY_CODEC, codec.JSON_CODEC):
+        data, attachments = c.encode_parts(message)
+        # 结构化部分只保留附件序号，二进制数据不复制进去
+        assert len(data) < 100
+        assert [bytes(a) for a in attachments] == [b'raw', bytes(blob), b'x']
+        assert attachments[1].obj is blob
+        decoded = c.decode_parts(data, attachments)
+        assert decoded[1][1] is attachments[1]
+        assert decoded[2]['extra'] == b'x' and decoded[2]['name'] == 'a'
+
+    # 字典的键保持可哈希
+    data, attachments = codec.BINARY_CODEC.encode_parts({b'key': b'value'})
+    assert codec.BINARY_CODEC.decode_parts(data, attachments) == {b'key': b'value'}
+
+
+def test_json_marker_keys_in_user_data_roundtrip():
+    json_codec = codec.JSONCodec()
+    # 与附件引用、扩展类型标记同形的用户数据原样往返
+    values = [
+        {'$attachment': 0},
+        {'$ext': 1, '$value': 2},
+        {'$$attachment': 'x', 'plain': {'$': None}},
+        [{'$attachment': 5}, [{'$ext': 'a', '$value': [1]}]],
+    ]
+    for value in values:
+        data, attachments = json_codec.encode_parts([value, b'raw'])
+        decoded = json_codec.decode_parts(data, attachments)
+        assert decoded[0] == value
+        assert bytes(decoded[1]) == b'raw'
+        # 旧版格式不转义
+        assert json_codec.encode(value) == json.dumps(value).encode('utf-8')
+
+    # 编码不修改原对象，没有需要转义的键时不复制
+    value = {'$attachment': 0}
+    json_codec.encode_parts(value)
+    assert value == {'$attachment': 0}
+    plain = {'a': [1, {'b': (2, 3)}], 'c': 'd'}
+    assert codec._escape_keys(plain) is plain
+    nested = [1, [2], {'$x': 1}]
+    escaped = codec._escape_keys(nested)
+    assert escaped == [1, [2], {'$$x': 1}] and escaped[1] is nested[1]
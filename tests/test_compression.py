@@ -0,0 +1,119 @@
+import asyncio
+import random
+
+import pytest
+
+from movan_rpc import RPCClient, RPCClientThreading, RPCServer, protocol
+from movan_rpc.codec import BINARY_CODEC
+from movan_rpc.compression import COMPRESSORS, CompressionStats, choose_compressor, get_compressor
+
+
+def _roundtrip(framing, parts):
+    data = b''.join(parts)
+    header = framing.parse_header(data[:framing.header_size])
+    assert header[0] == len(data) - framing.header_size
+    return header, framing.decode(header, data[framing.header_size:])
+
+
+@pytest.mark.parametrize('name', list(COMPRESSORS))
+def test_compressor_roundtrip_and_limit(name):
+    compressor = get_compressor(name)
+    data = b'movan' * 10000
+    compressed = compressor.compress(memoryview(data))
+    assert len(compressed) < len(data)
+    assert compressor.decompress(compressed) == data
+    assert compressor.decompress(compressed, max_size=len(data)) == data
+    with pytest.raises(ValueError):
+        compressor.decompress(compressed, max_size=len(data) - 1)
+
+
+def test_choose_compressor():
+    assert choose_compressor(['lzma', 'zlib']).name == 'lzma'
+    assert choose_compressor(['lzma', 'zlib'], ['zlib']).name == 'zlib'
+    assert choose_compressor(['unknown']) is None
+    assert choose_compressor([]) is None
+    with pytest.raises(ValueError):
+        get_compressor('unknown')
+
+
+def test_compressed_frames_above_threshold():
+    stats = CompressionStats()
+    framing = protocol.Framing(BINARY_CODEC, compact=True, compressor=get_compressor('zlib'),
+                               compress_threshold=1024, stats=stats)
+
+    small = framing.encode('return', 1, 'x' * 100)
+    header, frame = _roundtrip(framing, small)
+    assert not header[2] & protocol.FLAG_COMPRESSED
+    assert frame.payload == 'x' * 100
+
+    payload = ['y' * 5000, b'z' * 5000]
+    header, frame = _roundtrip(framing, framing.encode('return', 2, payload))
+    assert header[2] & protocol.FLAG_COMPRESSED
+    assert header[2] & protocol.FLAG_ATTACHMENTS
+    assert not frame.flags & protocol.FLAG_COMPRESSED
+    assert frame.payload == ['y' * 5000, b'z' * 5000]
+
+    # 压缩后没有变小的帧按原样发送
+    noise = random.Random(0).randbytes(4096)
+    header, frame = _roundtrip(framing, framing.encode('return', 3, noise))
+    assert not header[2] & protocol.FLAG_COMPRESSED
+    assert frame.payload == noise
+
+    result = stats.to_dict()
+    assert result['compressed_frames'] == 1
+    assert result['skipped_frames'] == 1
+    assert result['decompressed_frames'] == 1
+    assert result['ratio'] < 0.1
+
+
+def test_compressed_frame_size_limit():
+    compressor = get_compressor('zlib')
+    sender = protocol.Framing(BINARY_CODEC, compact=True, compressor=compressor,
+                              compress_threshold=0)
+    receiver = protocol.Framing(BINARY_CODEC, compact=True, compressor=compressor,
+                                max_decompressed_size=1000)
+    data = b''.join(sender.encode('call', 1, ['f', ('a' * 10000,), {}]))
+    header = receiver.parse_header(data[:receiver.header_size])
+    with pytest.raises(ValueError):
+        receiver.decode(header, data[receiver.header_size:])
+
+    # 没有协商压缩的连接拒绝压缩帧
+    plain = protocol.Framing(BINARY_CODEC, compact=True)
+    with pytest.raises(ValueError):
+        plain.decode(header, data[plain.header_size:])
+
+
+def test_clients_limit_received_frames(rpc_server):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, compression=['zlib'], compress_threshold=0)
+
+        @server.method
+        def blob(size):
+            return b'x' * size
+
+        def threading_client():
+            client = RPCClientThreading('127.0.0.1', port, max_frame_size=1000)
+            client.on_connect = lambda: None
+            assert client.start_sync()
+            try:
+                with pytest.raises(ValueError, match='上限'):
+                    client.call_sync('blob', [100000])
+                assert client.call_sync('blob', [10]) == b'x' * 10
+            finally:
+                client.close()
+
+        async with rpc_server(server) as port:
+            for compression in (['zlib'], []):
+                # 压缩后很小的帧解压后超过上限，不压缩的大帧在读取消息体前被拒绝
+                client = RPCClient('127.0.0.1', port, compression=compression,
+                                   max_frame_size=1000)
+                assert await client.start_async()
+                try:
+                    with pytest.raises(ValueError, match='上限'):
+                        await client.call('blob', [100000])
+                    assert await client.call('blob', [10]) == b'x' * 10
+                finally:
+                    await client.close()
+            await asyncio.to_thread(threading_client)
+
+    asyncio.run(run())
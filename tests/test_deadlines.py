@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import pytest
+
+from movan_rpc import RPCServer
+
+
+def test_deadline_cancels_and_skips_calls(rpc_client):
+    events = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method
+        async def slow():
+            events.append('start')
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                events.append('cancelled')
+                raise
+
+        @server.method
+        def fast():
+            events.append('fast')
+            return True
+
+        async with rpc_client(server) as client:
+            with pytest.raises(TimeoutError):
+                await client.call('slow', timeout=0.1)
+            await asyncio.sleep(0.05)
+            assert events == ['start', 'cancelled']
+
+            # 到达时已经过期的调用不执行
+            with pytest.raises(TimeoutError):
+                await client._request('call', ['fast', [], {}, time.time() - 1], 0.2, 'fast')
+            with pytest.raises(TimeoutError):
+                await client._request('batch', [['fast', [], {}, time.time() - 1]], 0.2, 'fast')
+            assert 'fast' not in events
+            assert await client.call_many([('fast',)]) == [True]
+
+            stats = server.stats()['deadlines']
+            assert stats['timed_out'] == 1 and stats['expired'] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,88 @@
+import array
+import dataclasses
+import datetime
+
+import pytest
+
+from movan_rpc import protocol
+from movan_rpc.codec import BINARY_CODEC, JSON_CODEC
+from movan_rpc.extensions import TypeRegistry, register_dataclass
+
+
+@register_dataclass
+@dataclasses.dataclass
+class Vec:
+    x: float
+    y: float
+
+
+@register_dataclass
+@dataclasses.dataclass
+class Player:
+    name: str
+    pos: Vec
+    joined: datetime.datetime
+    scores: array.array
+    tags: list = dataclasses.field(default_factory=list)
+
+
+def _player():
+    return Player('p1', Vec(1.5, -2.0),
+                  datetime.datetime(2024, 5, 1, 12, 30, 0, 15, tzinfo=datetime.timezone.utc),
+                  array.array('d', [1.0, 2.5, 3.25]), ['a'])
+
+
+def test_extension_types_roundtrip():
+    value = {'player': _player(), 'day': datetime.date(2024, 5, 1),
+             'wait': datetime.timedelta(seconds=90), 'naive': datetime.datetime(2024, 1, 1)}
+    for codec in (BINARY_CODEC, JSON_CODEC):
+        decoded = codec.decode_parts(*codec.encode_parts(value))
+        assert decoded == value
+        assert decoded['player'].joined.tzinfo is not None
+
+    # dataclass 按位置编码，不携带字段名
+    assert b'name' not in BINARY_CODEC.encode(_player())
+
+
+def test_arrays_use_raw_buffers():
+    scores = array.array('i', range(1000))
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    buffers = framing.encode('return', 1, scores)
+    # 数组的缓冲区作为附件原样发送
+    assert buffers[-1].nbytes == scores.itemsize * len(scores)
+    header = framing.parse_header(buffers[0])
+    frame = framing.decode(header, b''.join(bytes(b) for b in buffers[1:]))
+    assert frame.payload == scores
+
+
+def test_dataclass_schema_checks():
+    registry = TypeRegistry()
+
+    @dataclasses.dataclass
+    class Item:
+        id: int
+
+    with pytest.raises(TypeError, match='register_dataclass'):
+        BINARY_CODEC.encode(Item(1))
+
+    registry.register_dataclass(Item, schema_id=7)
+    with pytest.raises(ValueError):
+        registry.register_dataclass(Vec, schema_id=7)
+    with pytest.raises(ValueError):
+        registry.decode(1, [8, 1])
+    with pytest.raises(ValueError):
+        registry.register(Item, 1, None, None)
+
+
+def test_numpy_arrays():
+    numpy = pytest.importorskip('numpy')
+    matrix = numpy.arange(12, dtype='<f4').reshape(3, 4)
+    for codec in (BINARY_CODEC, JSON_CODEC):
+        framing = protocol.Framing(codec, compact=True)
+        buffers = framing.encode('return', 1, {'m': matrix[:, 1:], 'e': numpy.zeros(0)})
+        header = framing.parse_header(buffers[0])
+        body = b''.join(bytes(b) for b in buffers[1:])
+        result = framing.decode(header, body).payload
+        assert result['m'].dtype == matrix.dtype
+        assert (result['m'] == matrix[:, 1:]).all()
+        assert result['e'].shape == (0,)
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from movan_rpc import RPCServer, process_pool
+
+
+def describe(data, small=b'', scale=1):
+    return [type(data).__name__, len(data) * scale, bytes(data[:2]), small]
+
+
+def test_qualified_name():
+    name = process_pool.qualified_name(describe)
+    assert name.endswith(':describe')
+    assert process_pool.resolve(name) is describe
+
+    with pytest.raises(ValueError):
+        process_pool.qualified_name(lambda: None)
+
+    def local():
+        pass
+
+    with pytest.raises(ValueError):
+        process_pool.qualified_name(local)
+
+
+def test_large_buffers_go_through_shared_memory():
+    name = process_pool.qualified_name(describe)
+    args, kwargs, segments = process_pool.share_large_buffers(
+        [b'ab' * 100, b'xy'], {'scale': 2}, threshold=64)
+    try:
+        assert isinstance(args[0], process_pool.SharedBuffer)
+        assert args[1] == b'xy'
+        assert len(segments) == 1
+        assert process_pool.run_in_worker(name, args, kwargs) == ['memoryview', 400, b'ab', b'xy']
+    finally:
+        process_pool.release_segments(segments)
+
+
+def total_size(chunks, named=None):
+    named = named or {}
+    return sum(len(chunk) for chunk in chunks) + sum(len(chunk) for chunk in named.values())
+
+
+def test_nested_buffers_in_process_mode(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, process_workers=1, shared_memory_threshold=1024)
+        server.register_method('total_size', total_size, mode='process')
+
+        async with rpc_client(server) as client:
+            # 协商后的连接把 bytes 解码为附件上的 memoryview，嵌套的也要能交给工作进程
+            assert client.framing.compact
+            assert await client.call('total_size', [[b'abc', b'de']]) == 5
+            assert await client.call('total_size', [(b'x' * 4096, b'y')],
+                                     {'named': {'k': b'z' * 2048}}) == 4096 + 1 + 2048
+            assert server.stats()['process_pool']['pending'] == 0
+
+    asyncio.run(run())
+
+
+def hold(seconds):
+    time.sleep(seconds)
+
+
+def write_size(data, path):
+    with open(path, 'w') as f:
+        f.write(str(len(data)))
+
+
+def test_cancelled_call_keeps_shared_memory_until_job_ends(rpc_client, tmp_path):
+    path = str(tmp_path / 'size.txt')
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, process_workers=1, shared_memory_threshold=1024)
+        server.register_method('hold', hold, mode='process')
+        server.register_method('write_size', write_size, mode='process')
+
+        async with rpc_client(server) as client:
+            busy = asyncio.create_task(client.call('hold', [0.3]))
+            await asyncio.sleep(0.05)
+            # 任务仍在进程池中排队时取消调用，共享内存不能提前释放
+            queued = asyncio.create_task(client.call('write_size', [b'x' * 100000, path]))
+            await asyncio.sleep(0.05)
+            queued.cancel()
+            await busy
+            for _ in range(100):
+                if server.stats()['process_pool']['pending'] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            assert server.stats()['process_pool']['pending'] == 0
+
+    asyncio.run(run())
+    with open(path) as f:
+        assert f.read() == '100000'
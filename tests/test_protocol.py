@@ -0,0 +1,208 @@
+import asyncio
+import json
+
+import pytest
+
+from movan_rpc import protocol
+from movan_rpc.codec import BINARY_CODEC
+
+
+def _roundtrip(framing, data):
+    if isinstance(data, tuple):
+        data = b''.join(data)
+    header = framing.parse_header(data[:framing.header_size])
+    assert header[0] == len(data) - framing.header_size
+    return framing.decode(header, data[framing.header_size:])
+
+
+def test_compact_frame_roundtrip():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    request_id = framing.new_request_id()
+    data = framing.encode('call', request_id, ['add', (1, 2), {}])
+
+    frame = _roundtrip(framing, data)
+    assert frame.type == 'call'
+    assert frame.request_id == request_id
+    assert frame.payload == ['add', (1, 2), {}]
+
+    error = _roundtrip(framing, framing.encode('return', request_id, 'boom', protocol.FLAG_ERROR))
+    assert error.flags & protocol.FLAG_ERROR
+    assert error.payload == 'boom'
+
+    # 空消息体只有头部
+    heartbeat = framing.encode('heartbeat', framing.new_request_id())
+    assert len(heartbeat[0]) == protocol.HEADER_SIZE and heartbeat[1] == b''
+    assert _roundtrip(framing, heartbeat).payload is None
+
+
+def test_compact_request_ids_are_monotonic_and_wrap():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    assert [framing.new_request_id() for _ in range(3)] == [1, 2, 3]
+    framing._last_request_id = protocol.MAX_REQUEST_ID
+    # 0 留给服务端推送的帧
+    assert framing.new_request_id() == 1
+
+
+def test_compact_rejects_unknown_type_without_decoding():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    data = protocol.HEADER.pack(3, 250, 0, 7) + b'\xff\xff\xff'
+    with pytest.raises(ValueError):
+        _roundtrip(framing, data)
+
+
+def test_legacy_frame_matches_old_wire_format():
+    framing = protocol.Framing()
+    request_id = framing.new_request_id()
+    assert isinstance(request_id, tuple)
+
+    _, body = framing.encode('return', request_id, 3)
+    msg = framing.codec.decode(body)
+    assert msg == {'type': 'return', 'timestamp': request_id[0], 'id': request_id[1], 'result': 3}
+
+    frame = _roundtrip(framing, framing.encode('call', request_id, ['add', [1, 2], {}]))
+    assert frame.request_id == request_id
+    assert frame.payload == ['add', [1, 2], {}]
+
+    # 以 $ 开头的键按原样发送，旧版本客户端不需要去掉转义
+    result = {'$set': 3, 'x': [{'$ref': 2}], '$attachment': 0}
+    _, body = framing.encode('return', request_id, result)
+    assert json.loads(body)['result'] == result
+    assert _roundtrip(framing, framing.encode('return', request_id, result)).payload == result
+
+    # 旧版本服务端对不认识的消息只回复 {'error': ...}
+    body = framing.codec.encode({'error': 'x'})
+    with pytest.raises(ValueError):
+        _roundtrip(framing, len(body).to_bytes(4, 'big') + body)
+
+
+class _FakeTransport:
+    def get_write_buffer_size(self):
+        return 0
+
+
+class _FakeWriter:
+    def __init__(self):
+        self.transport = _FakeTransport()
+        self.writes = []
+        self.drains = 0
+
+    def is_closing(self):
+        return False
+
+    def writelines(self, buffers):
+        self.writes.append(list(buffers))
+
+    async def drain(self):
+        self.drains += 1
+
+
+def test_frame_writer_coalesces_frames_of_one_tick():
+    async def scenario():
+        writer = _FakeWriter()
+        frame_writer = protocol.FrameWriter(writer, high_water=100)
+        await frame_writer.send(b'h1', b'b1')
+        await frame_writer.send(b'h2', b'')
+        assert writer.writes == []
+        await asyncio.sleep(0)
+        assert writer.writes == [[b'h1', b'b1', b'h2']]
+        assert writer.drains == 0
+
+        # 超过高水位时立即写出并等待 drain
+        await frame_writer.send(b'x' * 200)
+        assert writer.writes[-1] == [b'x' * 200]
+        assert writer.drains == 1
+
+    asyncio.run(scenario())
+
+
+def test_batch_frames_in_both_formats():
+    items = [[None, 3], ['boom', None]]
+    for framing in (protocol.Framing(), protocol.Framing(BINARY_CODEC, compact=True)):
+        request_id = framing.new_request_id()
+        calls = [['add', [1, 2], {}], ['boom', [], {}]]
+        frame = _roundtrip(framing, framing.encode('batch', request_id, calls))
+        assert frame.type == 'batch' and frame.payload == calls
+
+        reply = _roundtrip(framing,
+                           framing.encode('return', request_id, items, protocol.FLAG_BATCH))
+        assert reply.flags & protocol.FLAG_BATCH
+        results = protocol.unpack_batch_results(reply.payload)
+        assert results[0] == 3
+        assert isinstance(results[1], Exception) and 'boom' in str(results[1])
+
+
+def test_attachments_are_slices_of_the_received_body():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    payload = bytes(range(256)) * 16
+    buffers = framing.encode('return', 7, {'data': payload, 'n': 1})
+    # 附件作为独立的缓冲区写出，不拼进消息体
+    assert buffers[-1].obj is payload
+
+    frame = _roundtrip(framing, tuple(bytes(b) for b in buffers))
+    assert frame.flags & protocol.FLAG_ATTACHMENTS
+    data = frame.payload['data']
+    assert isinstance(data, memoryview) and data == payload
+    assert data.obj is frame.body
+
+    with pytest.raises(ValueError):
+        protocol.split_attachments(protocol.ATTACHMENT_COUNT.pack(1) + (99).to_bytes(8, 'big'))
+
+
+class _ChunkedSocket:
+    """按给定的大小分段返回数据，模拟 recv_into 只读到半帧或多帧"""
+
+    def __init__(self, data, sizes):
+        self.data = memoryview(data)
+        self.sizes = list(sizes)
+
+    def recv_into(self, view):
+        size = min(self.sizes.pop(0) if self.sizes else len(self.data), len(view), len(self.data))
+        view[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_recv_buffer_splits_partial_and_coalesced_frames(compact):
+    framing = protocol.Framing(BINARY_CODEC, compact=compact)
+    payloads = [['small', i] for i in range(50)] + ['x' * 200000, b'y' * 100000, 'tail']
+    data = b''.join(b''.join(framing.encode('return', framing.new_request_id(), payload))
+                    for payload in payloads)
+
+    buffer = protocol.RecvBuffer(initial_size=1024, min_free=64)
+    sock = _ChunkedSocket(data, [3, 1, 500, 7000] * 20)
+    frames = []
+    while sock.data:
+        assert buffer.recv_into(sock)
+        for header, body in buffer.frames(framing):
+            assert isinstance(body, memoryview)
+            frames.append(framing.decode(header, body).payload)
+    assert len(buffer) == 0
+    assert frames[:-2] == payloads[:-2]
+    # 附件引用的数据在之后的读取中没有被覆盖
+    assert bytes(frames[-2]) == b'y' * 100000
+    assert frames[-1] == 'tail'
+
+
+def test_recv_buffer_skips_frames_over_the_limit():
+    framing = protocol.Framing(BINARY_CODEC, compact=True)
+    payloads = ['before', b'z' * 50000, 'after']
+    data = b''.join(b''.join(framing.encode('return', index + 1, payload))
+                    for index, payload in enumerate(payloads))
+
+    buffer = protocol.RecvBuffer(initial_size=1024, min_free=64, max_size=1000)
+    sock = _ChunkedSocket(data, [700] * 200)
+    frames, rejected = [], []
+    while sock.data:
+        assert buffer.recv_into(sock)
+        while True:
+            try:
+                for header, body in buffer.frames(framing):
+                    frames.append(framing.decode(header, body).payload)
+                break
+            except protocol.FrameTooLarge as e:
+                rejected.append(e.header[3])
+    assert frames == ['before', 'after']
+    assert rejected == [2]
+    # 过大的消息体没有让缓冲区扩容
+    assert len(buffer._buffer) == 1024
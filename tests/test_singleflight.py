@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from movan_rpc import RPCServer
+
+
+def test_singleflight_coalesces_identical_calls(rpc_client):
+    calls = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0)
+
+        @server.method(singleflight=True)
+        async def load(key, version=1):
+            calls.append(key)
+            await asyncio.sleep(0.1)
+            return {'key': key}
+
+        @server.method(mode='thread', singleflight=True)
+        def fail(key):
+            calls.append(key)
+            raise ValueError('boom')
+
+        async with rpc_client(server) as client:
+            results = await asyncio.gather(
+                *(client.call('load', ['a']) for _ in range(20)),
+                *(client.call('load', [], {'key': 'a', 'version': 1}) for _ in range(5)),
+                client.call('load', ['b']),
+                client.call_many([('load', ['a'])]),
+            )
+            assert results[:25] == [{'key': 'a'}] * 25
+            assert results[25] == {'key': 'b'}
+            assert results[26] == [{'key': 'a'}]
+            assert sorted(calls) == ['a', 'b']
+            assert server.stats()['singleflight']['load'] == {'in_flight': 0, 'coalesced': 25}
+
+            # 结束后的调用重新执行方法，错误同样分发给所有等待者
+            assert await client.call('load', ['a']) == {'key': 'a'}
+            errors = await asyncio.gather(*(client.call('fail', ['x']) for _ in range(3)),
+                                          return_exceptions=True)
+            assert all('boom' in str(error) for error in errors)
+
+    asyncio.run(run())
+
+
+def test_hung_flight_is_dropped_and_recovers(rpc_client):
+    runs = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, call_timeout=0.3)
+
+        @server.method(singleflight=True)
+        async def load(key):
+            runs.append(key)
+            if len(runs) == 1:
+                # 只有第一次执行卡住
+                await asyncio.sleep(3600)
+            return key
+
+        async with rpc_client(server) as client:
+            first = asyncio.ensure_future(client.call('load', ['a']))
+            await asyncio.sleep(0.15)
+            # 加入卡住的执行的调用方也在共享任务的时限到达时结束，而不是一直等待
+            joined = asyncio.ensure_future(client.call('load', ['a']))
+            errors = await asyncio.gather(first, joined, return_exceptions=True)
+            assert all('超时' in str(error) for error in errors)
+            await asyncio.sleep(0.05)
+            assert server.stats()['singleflight']['load']['in_flight'] == 0
+
+            assert await client.call('load', ['a']) == 'a'
+            assert runs == ['a', 'a']
+
+    asyncio.run(run())
+
+
+def test_flight_is_cancelled_when_all_callers_leave(rpc_client):
+    cancelled = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, call_timeout=None)
+
+        @server.method(singleflight=True)
+        async def load(key):
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                cancelled.append(key)
+                raise
+
+        async with rpc_client(server) as client:
+            for _ in range(2):
+                with pytest.raises(TimeoutError):
+                    await client.call('load', ['a'], timeout=0.2)
+            await asyncio.sleep(0.1)
+            # 客户端超时后发送 cancel 帧，没有调用方等待时共享的任务被取消
+            assert cancelled == ['a', 'a']
+            assert server.stats()['singleflight']['load']['in_flight'] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from movan_rpc import OverloadedError, RPCServer
+
+
+def test_stream_generator_results(rpc_client):
+    produced = []
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, stream_window=4)
+
+        @server.method
+        def rows(n):
+            for index in range(n):
+                produced.append(index)
+                yield {'index': index}
+
+        @server.method
+        async def fail():
+            yield 1
+            raise ValueError('boom')
+
+        async with rpc_client(server) as client:
+            received = []
+            async for row in client.stream('rows', [50]):
+                received.append(row['index'])
+                if len(received) == 1:
+                    # 消费方暂停时，服务端最多多生成一个窗口的项
+                    await asyncio.sleep(0.1)
+                    assert len(produced) <= 1 + 4
+            assert received == list(range(50))
+
+            # 普通调用生成器方法时收集成列表
+            assert len(await client.call('rows', [10])) == 10
+
+            items = []
+            with pytest.raises(Exception, match='boom'):
+                async for item in client.stream('fail'):
+                    items.append(item)
+            assert items == [1]
+
+    asyncio.run(run())
+
+
+def test_chunked_upload(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, upload_window=2, max_frame_size=1024)
+
+        @server.method
+        async def total(chunks, scale):
+            size = 0
+            async for chunk in chunks:
+                # 服务端缓存的块数不超过上传窗口
+                assert chunks._queue.qsize() <= 2
+                size += len(chunk)
+            return size * scale
+
+        @server.method
+        def echo(data):
+            return data
+
+        async with rpc_client(server) as client:
+            data = b'x' * 10000
+            assert await client.upload('total', data, [2], chunk_size=512) == 20000
+            assert await client.upload('total', [b'ab', b'cd'], kwargs={'scale': 1}) == 4
+
+            # 超过单帧上限的调用返回错误，连接仍然可用
+            with pytest.raises(Exception, match='超过上限'):
+                await client.call('echo', [data])
+            assert await client.call('echo', [b'ok']) == b'ok'
+
+    asyncio.run(run())
+
+
+def test_uploads_per_connection_are_limited(rpc_client):
+    async def run():
+        server = RPCServer('127.0.0.1', 0, max_connection_uploads=1)
+
+        @server.method
+        async def total(chunks):
+            return sum([len(chunk) async for chunk in chunks])
+
+        async with rpc_client(server) as client:
+            release = asyncio.Event()
+
+            async def slow_chunks():
+                yield b'abc'
+                await release.wait()
+                yield b'de'
+
+            first = asyncio.create_task(client.upload('total', slow_chunks()))
+            await asyncio.sleep(0.05)
+            with pytest.raises(OverloadedError):
+                await client.upload('total', [b'x'])
+            release.set()
+            assert await first == 5
+            # 上传结束后名额释放
+            assert await client.upload('total', [b'x']) == 1
+
+    asyncio.run(run())
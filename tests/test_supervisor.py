@@ -0,0 +1,112 @@
+import asyncio
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from movan_rpc import RPCClient, RPCServer
+from movan_rpc.supervisor import WorkerSupervisor, combine_stats
+
+
+def test_combine_stats():
+    total = combine_stats([
+        {'connections': 2, 'thread_pool': {'queued': 1, 'max_workers': None, 'saturated': True}},
+        {'connections': 3, 'thread_pool': {'queued': 4, 'max_workers': 8, 'saturated': False}},
+    ])
+    assert total == {
+        'connections': 5,
+        'thread_pool': {'queued': 5, 'max_workers': 8, 'saturated': 1},
+    }
+
+
+def square(x):
+    return x * x
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.05)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="需要 fork")
+def test_supervisor_serves_and_restarts_workers():
+    server = RPCServer('127.0.0.1', 0, process_workers=1)
+    server.register_method('square', square, mode='process')
+    supervisor = WorkerSupervisor(server, 2, stats_interval=0.1, restart_delay=0.1)
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+
+    async def call(port):
+        client = RPCClient('127.0.0.1', port)
+        await client.start_async()
+        try:
+            # process 模式的方法要求工作进程能够创建子进程
+            return await client.call('square', [7])
+        finally:
+            await client.close()
+
+    try:
+        _wait_for(lambda: len(supervisor.worker_stats()['workers']) == 2)
+        port = supervisor._sock.getsockname()[1]
+        assert asyncio.run(call(port)) == 49
+
+        # 杀掉一个工作进程后被重启，服务不中断
+        pid = supervisor.worker_stats()['workers'][0]['pid']
+        os.kill(pid, signal.SIGKILL)
+        _wait_for(lambda: supervisor.worker_stats()['workers'].get(0, {}).get('restarts') == 1)
+        assert supervisor.worker_stats()['alive'] == 2
+        assert supervisor.worker_stats()['workers'][0]['pid'] != pid
+        assert asyncio.run(call(port)) == 49
+    finally:
+        supervisor.stop()
+        thread.join(timeout=15)
+    assert not thread.is_alive()
+    assert supervisor.worker_stats()['alive'] == 0
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'),
+                    reason="需要 SO_REUSEPORT 和 fork")
+def test_supervisor_binds_fixed_port_with_reuse_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = RPCServer('127.0.0.1', port)
+    server.register_method('worker_pid', worker_pid)
+    supervisor = WorkerSupervisor(server, 2, stats_interval=0.1, restart_delay=0.1)
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+
+    async def collect_pids():
+        pids = set()
+        # 内核按连接把新连接分给各自绑定端口的工作进程
+        for _ in range(50):
+            client = RPCClient('127.0.0.1', port)
+            if await client.start_async():
+                try:
+                    pids.add(await client.call('worker_pid'))
+                finally:
+                    await client.close()
+            if len(pids) == 2:
+                break
+            await asyncio.sleep(0.02)
+        return pids
+
+    try:
+        _wait_for(lambda: len(supervisor.worker_stats()['workers']) == 2)
+        # 端口固定时不经过父进程的监听 socket
+        assert supervisor._reuse_port and supervisor._sock is None
+        workers = {worker['pid'] for worker in supervisor.worker_stats()['workers'].values()}
+        assert asyncio.run(collect_pids()) == workers
+    finally:
+        supervisor.stop()
+        thread.join(timeout=15)
+    assert not thread.is_alive()
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from movan_rpc import RPCServer
+
+
+def test_thread_mode_stats_and_cancelled_jobs(rpc_client):
+    release = threading.Event()
+    started = []
+
+    async def wait_for(condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("等待超时")
+
+    async def run():
+        server = RPCServer('127.0.0.1', 0, max_workers=1)
+
+        @server.method(mode='thread')
+        def block(tag):
+            started.append((tag, threading.current_thread().name))
+            release.wait(5)
+            return tag
+
+        async with rpc_client(server) as client:
+            first = asyncio.create_task(client.call('block', ['a']))
+            second = asyncio.create_task(client.call('block', ['b']))
+            await wait_for(lambda: server.stats()['thread_pool']['queued'] == 1)
+            stats = server.stats()['thread_pool']
+            assert stats['running'] == 1 and stats['saturated']
+
+            # 排队中的调用被取消后不会执行，排队计数随之减少
+            second.cancel()
+            await wait_for(lambda: server.stats()['thread_pool']['queued'] == 0)
+
+            release.set()
+            assert await first == 'a'
+            await wait_for(lambda: server.stats()['thread_pool']['running'] == 0)
+            stats = server.stats()['thread_pool']
+            assert stats['started'] == 1 and stats['wait_seconds'] >= 0
+            assert [tag for tag, _ in started] == ['a']
+            assert started[0][1].startswith('movan_rpc')
+
+    asyncio.run(run())
@@ -31,4 +31,25 @@ def test_verify_msg():
         "timestamp": "1620000000.0",
         "id": 12345,  # 数字而非字符串
     }
-    assert not utils.verify_msg(invalid_id_msg)
\ No newline at end of file
+    assert not utils.verify_msg(invalid_id_msg)
+
+def test_verify_msg_batch():
+    assert utils.verify_msg({"type": "batch", "timestamp": "1620000000.0", "id": "12345"})
+    assert utils.verify_msg({"type": "cancel", "timestamp": "1620000000.0", "id": "12345"})
+
+
+def test_normalize_calls():
+    calls = utils.normalize_calls([
+        ("add", [1, 2], {"c": 3}),
+        ("add", (1, 2)),
+        ("ping",),
+        "ping",
+        ("add", None, {"a": 1}),
+    ])
+    assert calls == [
+        ["add", [1, 2], {"c": 3}],
+        ["add", (1, 2), {}],
+        ["ping", [], {}],
+        ["ping", [], {}],
+        ["add", [], {"a": 1}],
+    ]